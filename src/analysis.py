@@ -1,8 +1,17 @@
-import networkx as nx
-import matplotlib.pyplot as plt
+import numpy as np
 
+from lattice_graph import LatticeGraph
+
+
+# Every function takes a networkx graph or a LatticeGraph; the latter is read
+# from its arrays without building networkx attributes
 def plot_spin_distribution(graph):
-    spins = [data['spin'] for _, data in graph.nodes(data=True)]
+    import matplotlib.pyplot as plt
+
+    if isinstance(graph, LatticeGraph):
+        spins = np.ravel(graph.spins)
+    else:
+        spins = [data['spin'] for _, data in graph.nodes(data=True)]
     plt.hist(spins, bins=[-0.5, 0.5, 1.5], rwidth=0.8, color='purple')
     plt.xticks([0, 1], labels=['|0⟩', '|1⟩'])
     plt.xlabel('Spin State')
@@ -13,11 +22,19 @@ def plot_spin_distribution(graph):
     plt.show()
 
 def compute_coherence(graph):
+    if isinstance(graph, LatticeGraph):
+        return float(np.mean(graph.spins))
+    import networkx as nx
+
     spins = nx.get_node_attributes(graph, 'spin')
     values = list(spins.values())
     return sum(values) / len(values)
 
 def average_voltage(graph):
+    if isinstance(graph, LatticeGraph):
+        return float(np.mean(graph.voltage))
+    import networkx as nx
+
     voltages = nx.get_node_attributes(graph, 'voltage')
     return sum(voltages.values()) / len(voltages)
 
@@ -1,19 +1,165 @@
+import argparse
+import json
 import os
-import random
-from entangled_spin_grid import initialize_grid, update_grid, create_bioelectric_graph
-from gnn_data_export import export_pyg_data
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def run_batch(num_runs=5, grid_size=(30, 30, 10), steps=100, out_dir="batch_outputs"):
+import numpy as np
+
+from entangled_spin_grid import SimulationConfig, export, simulate
+from spin_engine import MODES
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def run_output_path(out_dir, run_id):
+    return os.path.join(out_dir, f"sim_{run_id}.pt")
+
+
+# Completed runs recorded in the manifest, keyed by run id. A line cut short by
+# an interrupted write is ignored; that run is simply redone.
+def load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[entry["run_id"]] = entry
+    return done
+
+
+# The settings that determine a run's output, as stored in its manifest entry
+def run_settings(seed_seq, grid_size, steps, params=None, mode="sequential"):
+    settings = {
+        "entropy": seed_seq.entropy,
+        "spawn_key": list(seed_seq.spawn_key),
+        "grid_size": list(grid_size),
+        "steps": steps,
+        "params": params or {},
+        "mode": mode,
+    }
+    return json.loads(json.dumps(settings))
+
+
+def _append_manifest(out_dir, entry):
+    with open(os.path.join(out_dir, MANIFEST_NAME), "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# One independent simulation with its own Generator stream. Output is written
+# under a temporary name and renamed, so a file at the final path is complete.
+def run_single(run_id, seed_seq, grid_size, steps, output, params=None, mode="sequential"):
+    start = time.time()
+    rng = np.random.Generator(np.random.PCG64(seed_seq))
+    config = SimulationConfig(grid_size, steps, mode=mode, params=params or {})
+    lattice = simulate(config, rng)
+
+    tmp = output + ".tmp"
+    export(lattice, tmp, fmt="pyg")
+    os.replace(tmp, output)
+    return {
+        "run_id": run_id,
+        "output": os.path.basename(output),
+        **run_settings(seed_seq, grid_size, steps, params, mode),
+        "seconds": round(time.time() - start, 3),
+    }
+
+
+# Several runs stepped together as one ensemble (see ensemble.py); each replica
+# draws from its own Generator, so outputs match run_single's for the same seed
+def run_ensemble(run_ids, seed_seqs, grid_size, steps, outputs, params=None, mode="sequential"):
+    from ensemble import simulate_ensemble
+
+    start = time.time()
+    configs = [SimulationConfig(grid_size, steps, seq, mode, params=params or {}) for seq in seed_seqs]
+    lattices = simulate_ensemble(configs)
+    seconds = round((time.time() - start) / len(run_ids), 3)
+
+    entries = []
+    for run_id, seed_seq, output, lattice in zip(run_ids, seed_seqs, outputs, lattices):
+        tmp = output + ".tmp"
+        export(lattice, tmp, fmt="pyg")
+        os.replace(tmp, output)
+        entries.append({
+            "run_id": run_id,
+            "output": os.path.basename(output),
+            **run_settings(seed_seq, grid_size, steps, params, mode),
+            "seconds": seconds,
+        })
+    return entries
+
+
+# Run num_runs seeds across a process pool. Run i always draws from child i of
+# SeedSequence(seed), so results do not depend on scheduling or on resuming.
+# A run whose output exists is skipped if its manifest entry records the same
+# settings (seed, grid_size, steps, params, mode); an output with other settings
+# or no manifest entry raises ValueError rather than being passed off as this
+# batch's. Runs in the manifest whose output is missing are redone.
+# With ensemble > 1 each task steps that many runs together in one array.
+def run_batch(num_runs=5, grid_size=(30, 30, 10), steps=100, out_dir="batch_outputs",
+              seed=0, workers=None, params=None, mode="sequential", ensemble=1):
     os.makedirs(out_dir, exist_ok=True)
+    done = load_manifest(out_dir)
+    children = np.random.SeedSequence(seed).spawn(num_runs)
+
+    pending = []
+    for run_id, child in enumerate(children):
+        output = run_output_path(out_dir, run_id)
+        if os.path.exists(output):
+            if run_id not in done:
+                raise ValueError(f"{output} is not in the manifest, so the run that wrote it is unknown; "
+                                 "move it away or use another out_dir")
+            settings = run_settings(child, grid_size, steps, params, mode)
+            recorded = {key: done[run_id].get(key) for key in settings}
+            if recorded != settings:
+                raise ValueError(f"{output} was written with {recorded}, not {settings}; "
+                                 "use another out_dir")
+            continue
+        pending.append((run_id, child, output))
+
+    print(f"{num_runs - len(pending)} of {num_runs} runs already complete, {len(pending)} to go")
+    if not pending:
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if ensemble > 1:
+            groups = [list(zip(*pending[i:i + ensemble])) for i in range(0, len(pending), ensemble)]
+            futures = [
+                pool.submit(run_ensemble, run_ids, children, grid_size, steps, outputs, params, mode)
+                for run_ids, children, outputs in groups
+            ]
+        else:
+            futures = [
+                pool.submit(run_single, run_id, child, grid_size, steps, output, params, mode)
+                for run_id, child, output in pending
+            ]
+        for future in as_completed(futures):
+            result = future.result()
+            for entry in result if ensemble > 1 else [result]:
+                _append_manifest(out_dir, entry)
+                print(f"Run {entry['run_id']} finished in {entry['seconds']:.1f}s")
 
-    for seed in range(num_runs):
-        random.seed(seed)
-        voltage, states, spins = initialize_grid(grid_size)
-        for _ in range(steps):
-            voltage, states, spins = update_grid(voltage, states, spins)
-        graph = create_bioelectric_graph(voltage, states, spins)
-        export_pyg_data(graph, filename=os.path.join(out_dir, f"sim_{seed}.pt"))
 
 if __name__ == "__main__":
-    run_batch()
+    parser = argparse.ArgumentParser(description="Run a batch of Bioelectric Spin Simulations")
+    parser.add_argument("--runs", type=int, default=5, help="Number of independent runs")
+    parser.add_argument("--size", type=int, nargs=3, default=[30, 30, 10], help="Grid size (X Y Z)")
+    parser.add_argument("--steps", type=int, default=100, help="Number of time steps")
+    parser.add_argument("--out-dir", type=str, default="batch_outputs", help="Output directory")
+    parser.add_argument("--seed", type=int, default=0, help="Root seed for the SeedSequence")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--mode", choices=MODES, default="sequential",
+                        help="Spin update mode")
+    parser.add_argument("--ensemble", type=int, default=1,
+                        help="Runs stepped together per task as one batched array")
+    args = parser.parse_args()
 
+    run_batch(args.runs, tuple(args.size), args.steps, args.out_dir, args.seed, args.workers, mode=args.mode,
+              ensemble=args.ensemble)
@@ -0,0 +1,297 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Benchmark harness for the hot paths: lattice stepping, graph building, PyG
+# conversion, exports and GNN training.
+#
+# Every (case, size, radius) runs in a fresh spawned process so its peak RSS is
+# its own. A case times `calls` calls of its function after one warm-up call
+# and keeps the best of `repeat` rounds. Results go to a JSON file together with
+# the commit and library versions; --compare flags cases whose throughput fell
+# by more than --threshold against an earlier file.
+#
+#     python benchmark_suite.py --sizes 50x50 64^3 --radii 1 3 --output new.json
+#     python benchmark_suite.py --compare old.json --output new.json
+
+SIZES = {
+    "50x50": (50, 50),
+    "32^3": (32, 32, 32),
+    "64^3": (64, 64, 64),
+    "128^3": (128, 128, 128),
+    "256^3": (256, 256, 256),
+}
+DEFAULT_SIZES = ("50x50", "32^3", "64^3")
+DEFAULT_RADII = (1, 3)
+
+# Lattices above this many voxels are skipped for cases that build a networkx
+# graph, which needs on the order of a kilobyte per node
+NX_MAX_VOXELS = 300_000
+
+
+class Skip(Exception):
+    pass
+
+
+def _lattice(shape, seed=0):
+    from spin_engine import initialize_grid
+
+    return initialize_grid(shape, np.random.default_rng(seed))
+
+
+def _bytes_in(folder):
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+
+
+# Each case builds its inputs and returns fn(tmpdir), the call that gets timed;
+# whatever it writes into tmpdir is reported as bytes written.
+def _case_update_grid(shape, radius, mode):
+    from spin_engine import make_params, update_grid
+
+    params = make_params(long_range_radius=radius)
+    rng = np.random.default_rng(1)
+    arrays = list(_lattice(shape))
+
+    def fn(tmpdir):
+        arrays[:] = update_grid(*arrays, params, rng, mode)
+
+    return fn
+
+
+def _case_sequential(shape, radius):
+    return _case_update_grid(shape, radius, "sequential")
+
+
+def _case_synchronous(shape, radius):
+    return _case_update_grid(shape, radius, "synchronous")
+
+
+def _case_kmc(shape, radius):
+    return _case_update_grid(shape, radius, "kmc")
+
+
+def _case_build_lattice_graph(shape, radius):
+    from lattice_graph import build_lattice_graph
+
+    arrays = _lattice(shape)
+
+    def fn(tmpdir):
+        graph = build_lattice_graph(*arrays)
+        graph.edge_index
+        graph.node_features()
+
+    return fn
+
+
+def _case_create_bioelectric_graph(shape, radius):
+    from lattice_graph import create_bioelectric_graph
+
+    if int(np.prod(shape)) > NX_MAX_VOXELS:
+        raise Skip("networkx graph too large")
+    arrays = _lattice(shape)
+    return lambda tmpdir: create_bioelectric_graph(*arrays)
+
+
+def _case_convert_to_pyg_data(shape, radius):
+    try:
+        from gnn_data_export import convert_to_pyg_data
+    except ImportError as exc:
+        raise Skip(str(exc))
+    from lattice_graph import build_lattice_graph
+
+    arrays = _lattice(shape)
+    return lambda tmpdir: convert_to_pyg_data(build_lattice_graph(*arrays))
+
+
+def _case_export_voltage_gradients(shape, radius):
+    from voltage_gradient_export import export_lattice_gradients
+
+    voltage = _lattice(shape)[0]
+    return lambda tmpdir: export_lattice_gradients(voltage, os.path.join(tmpdir, "gradients.npz"))
+
+
+def _case_export_graph_data(shape, radius):
+    from lattice_graph import build_lattice_graph, export_graph_data
+
+    if int(np.prod(shape)) > NX_MAX_VOXELS:
+        raise Skip("networkx graph too large")
+    arrays = _lattice(shape)
+    return lambda tmpdir: export_graph_data(build_lattice_graph(*arrays), os.path.join(tmpdir, "graph.gexf"))
+
+
+def _case_export_pyg_data(shape, radius):
+    try:
+        from gnn_data_export import export_pyg_data
+    except ImportError as exc:
+        raise Skip(str(exc))
+    from lattice_graph import build_lattice_graph
+
+    arrays = _lattice(shape)
+    return lambda tmpdir: export_pyg_data(build_lattice_graph(*arrays), os.path.join(tmpdir, "graph.pt"))
+
+
+# One full-graph training epoch of the GCN on the lattice
+def _case_gnn_training(shape, radius):
+    try:
+        import gnn_training
+        from gnn_data_export import convert_to_pyg_data
+    except ImportError as exc:
+        raise Skip(str(exc))
+    from lattice_graph import build_lattice_graph
+
+    data = convert_to_pyg_data(build_lattice_graph(*_lattice(shape)))
+    data.y = data.x[:, 2].long()
+    model = gnn_training.build_gcn_model(input_dim=3, output_dim=2)
+    return lambda tmpdir: gnn_training.train(model, [data], epochs=1)
+
+
+CASES = {
+    "update_grid.sequential": _case_sequential,
+    "update_grid.synchronous": _case_synchronous,
+    "update_grid.kmc": _case_kmc,
+    "build_lattice_graph": _case_build_lattice_graph,
+    "create_bioelectric_graph": _case_create_bioelectric_graph,
+    "convert_to_pyg_data": _case_convert_to_pyg_data,
+    "export_voltage_gradients": _case_export_voltage_gradients,
+    "export_graph_data": _case_export_graph_data,
+    "export_pyg_data": _case_export_pyg_data,
+    "gnn_training": _case_gnn_training,
+}
+# Only these cases depend on the coupling radius; the rest run once per size
+RADIUS_CASES = ("update_grid.sequential", "update_grid.synchronous", "update_grid.kmc")
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+# Runs inside the spawned worker
+def _run_case(case, size, radius, calls, repeat):
+    shape = SIZES[size]
+    result = {"case": case, "size": size, "radius": radius, "voxels": int(np.prod(shape))}
+    try:
+        fn = CASES[case](shape, radius)
+    except Skip as exc:
+        return dict(result, skipped=str(exc))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn(tmpdir)
+        bytes_written = _bytes_in(tmpdir)
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(calls):
+                fn(tmpdir)
+            best = min(best, time.perf_counter() - start)
+
+    calls_per_sec = calls / best
+    result.update(
+        calls=calls,
+        seconds=best,
+        steps_per_sec=calls_per_sec,
+        voxel_updates_per_sec=calls_per_sec * result["voxels"],
+        peak_rss_bytes=_peak_rss_bytes(),
+        bytes_written=bytes_written or None,
+    )
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmarks(cases=None, sizes=DEFAULT_SIZES, radii=DEFAULT_RADII, calls=3, repeat=3,
+                   output="benchmark_results.json"):
+    cases = list(CASES) if cases is None else cases
+    results = []
+    ctx = mp.get_context("spawn")
+    for case in cases:
+        for size in sizes:
+            for radius in radii if case in RADIUS_CASES else radii[:1]:
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    result = pool.submit(_run_case, case, size, radius, calls, repeat).result()
+                results.append(result)
+                print(format_result(result))
+
+    report = {"environment": environment(), "results": results}
+    if output:
+        tmp = output + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp, output)
+    return report
+
+
+def format_result(r):
+    label = f"{r['case']:<26} {r['size']:>6} r={r['radius']}"
+    if "skipped" in r:
+        return f"{label}  skipped ({r['skipped']})"
+    written = f"  {r['bytes_written'] / 2**20:8.1f} MiB written" if r["bytes_written"] else ""
+    return (f"{label}  {r['steps_per_sec']:9.2f} calls/s  {r['voxel_updates_per_sec']:.3e} voxel/s"
+            f"  peak {r['peak_rss_bytes'] / 2**20:7.1f} MiB{written}")
+
+
+# Cases slower than the baseline by more than `threshold` (fractional drop in
+# calls/s), as (key, old, new) tuples
+def compare(baseline, current, threshold=0.1):
+    def key(r):
+        return r["case"], r["size"], r["radius"]
+
+    old = {key(r): r for r in baseline["results"] if "skipped" not in r}
+    regressions = []
+    for r in current["results"]:
+        if "skipped" in r or key(r) not in old:
+            continue
+        before, after = old[key(r)]["steps_per_sec"], r["steps_per_sec"]
+        print(f"{' '.join(map(str, key(r))):<40} {after / before:6.2f}x")
+        if after < before * (1 - threshold):
+            regressions.append((key(r), before, after))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and export pipeline")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=None, help="Cases to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(DEFAULT_SIZES), help="Lattice sizes")
+    parser.add_argument("--radii", type=int, nargs="+", default=list(DEFAULT_RADII), help="Long-range coupling radii")
+    parser.add_argument("--calls", type=int, default=3, help="Timed calls per round")
+    parser.add_argument("--repeat", type=int, default=3, help="Rounds; the fastest is kept")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="JSON results file")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed fractional slowdown")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.cases, args.sizes, args.radii, args.calls, args.repeat, args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for (case, size, radius), before, after in regressions:
+            print(f"REGRESSION {case} {size} r={radius}: {before:.2f} -> {after:.2f} calls/s")
+        raise SystemExit(1 if regressions else 0)
@@ -1,8 +1,8 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 import networkx as nx
 
+from live_view import LiveView
+
 # Simulation Parameters
 grid_size = (50, 50)  # Grid dimensions
 diffusion_rate = 0.2   # Rate of voltage diffusion
@@ -44,26 +44,13 @@ def create_bioelectric_graph(grid):
             G.nodes[(i, j)]['voltage'] = grid[i, j]
     return G
 
-bioelectric_graph = create_bioelectric_graph(voltage_grid)
-
-def update_graph(G, grid):
-    for i in range(grid.shape[0]):
-        for j in range(grid.shape[1]):
-            G.nodes[(i, j)]['voltage'] = grid[i, j]
-    return G
-
-# Animate the simulation
-fig, ax = plt.subplots()
-cmap = plt.get_cmap("viridis")
-im = ax.imshow(voltage_grid, cmap=cmap, vmin=0, vmax=1)
-
-def animate(frame):
-    global voltage_grid, bioelectric_graph
-    voltage_grid = update_voltage(voltage_grid)
-    bioelectric_graph = update_graph(bioelectric_graph, voltage_grid)
-    im.set_array(voltage_grid)
-    return [im]
-
-ani = animation.FuncAnimation(fig, animate, frames=steps, interval=50, blit=True)
-plt.show()
+# Run the simulation; a separate viewer process renders the newest frame at its
+# own rate and drops the rest, so drawing never holds up the stepping. Under the
+# main guard, since a spawned viewer process re-imports this script.
+if __name__ == "__main__":
+    with LiveView(grid_size, fps=20) as view:
+        for step in range(steps):
+            voltage_grid = update_voltage(voltage_grid)
+            view.record(step + 1, voltage_grid)
 
+    bioelectric_graph = create_bioelectric_graph(voltage_grid)
@@ -1,6 +1,6 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+
+from live_view import LiveView
 
 # Simulation Parameters
 grid_size = (50, 50)  # Grid dimensions (50x50 cells)
@@ -32,17 +32,11 @@ def update_voltage(grid):
     
     return np.clip(new_grid, 0, 1)  # Keep voltages between 0 and 1
 
-# Animate the simulation
-fig, ax = plt.subplots()
-cmap = plt.get_cmap("viridis")
-im = ax.imshow(voltage_grid, cmap=cmap, vmin=0, vmax=1)
-
-def animate(frame):
-    global voltage_grid
-    voltage_grid = update_voltage(voltage_grid)
-    im.set_array(voltage_grid)
-    return [im]
-
-ani = animation.FuncAnimation(fig, animate, frames=steps, interval=50, blit=True)
-plt.show()
-
+# Run the simulation; a separate viewer process renders the newest frame at its
+# own rate and drops the rest, so drawing never holds up the stepping. Under the
+# main guard, since a spawned viewer process re-imports this script.
+if __name__ == "__main__":
+    with LiveView(grid_size, fps=20) as view:
+        for step in range(steps):
+            voltage_grid = update_voltage(voltage_grid)
+            view.record(step + 1, voltage_grid)
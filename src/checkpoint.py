@@ -0,0 +1,65 @@
+import json
+import os
+
+import numpy as np
+
+# Atomic checkpoints of a running simulation: lattice arrays, step counter,
+# parameters and the full bit-generator state, so a resumed run draws exactly
+# the numbers the uninterrupted run would have drawn. `rng` may also be a list
+# (one stream per worker of a domain-decomposed run) of generators or of
+# bit-generator states; it is restored as a list of generators.
+
+
+def _rng_state(rng):
+    if isinstance(rng, (list, tuple)):
+        return [_rng_state(r) for r in rng]
+    return rng if isinstance(rng, dict) else rng.bit_generator.state
+
+
+def save_checkpoint(path, step, voltage, states, spins, params, rng):
+    meta = {
+        "step": int(step),
+        "params": params,
+        "rng_state": _rng_state(rng),
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, voltage=voltage, states=states, spins=spins, meta=np.array(json.dumps(meta)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def restore_rng(rng_state):
+    if isinstance(rng_state, list):
+        return [restore_rng(state) for state in rng_state]
+    bit_generator = getattr(np.random, rng_state["bit_generator"])()
+    bit_generator.state = rng_state
+    return np.random.Generator(bit_generator)
+
+
+def load_checkpoint(path):
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"][()]))
+        return {
+            "step": meta["step"],
+            "voltage": data["voltage"],
+            "states": data["states"],
+            "spins": data["spins"],
+            "params": meta["params"],
+            "rng": restore_rng(meta["rng_state"]),
+        }
+
+
+# Recorder (record(step, voltage, states, spins)) saving a checkpoint every
+# `every` steps
+class CheckpointRecorder:
+    def __init__(self, path, every, params, rng):
+        self.path = path
+        self.every = every
+        self.params = params
+        self.rng = rng
+
+    def record(self, step, voltage, states, spins):
+        if self.every and step % self.every == 0:
+            save_checkpoint(self.path, step, voltage, states, spins, self.params, self.rng)
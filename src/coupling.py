@@ -0,0 +1,135 @@
+import numpy as np
+
+# Long-range spin coupling kernels.
+#
+# The spin scripts average the spins in an edge-truncated (2r+1)^3 window around
+# every voxel. Here the whole mean field is produced at once: box windows use a
+# separable integral image (O(N) per step for any radius), weighted kernels use
+# direct shifted sums for small radii and FFT convolution for large ones. Edge
+# truncation is kept by normalising with the same kernel applied to a ones mask.
+
+KERNELS = ("box", "gaussian", "inverse_distance")
+FFT_MIN_RADIUS = 5
+
+
+# Windowed sum along each axis from a cumulative sum (the integral image built
+# one axis at a time). Integer input is summed in int32, so sums are exact.
+# `axes` restricts the window to some axes, e.g. to skip a leading batch axis.
+def box_sum(a, radius, axes=None):
+    out = np.asarray(a)
+    dtype = np.int32 if out.dtype.kind in "biu" else out.dtype
+    axes = range(out.ndim) if axes is None else axes
+    for axis in axes:
+        n = out.shape[axis]
+        csum = np.cumsum(out, axis=axis, dtype=dtype)
+        # Sum over [0, i + r], minus the sum over [0, i - r - 1] where that is
+        # not empty
+        out = np.take(csum, np.minimum(np.arange(n) + radius, n - 1), axis=axis)
+        if n > radius + 1:
+            head = [slice(None)] * out.ndim
+            tail = [slice(None)] * out.ndim
+            head[axis] = slice(radius + 1, None)
+            tail[axis] = slice(None, n - radius - 1)
+            out[tuple(head)] -= csum[tuple(tail)]
+        del csum
+    return out
+
+
+# Number of in-bounds voxels in the clipped window around every voxel
+def window_count(shape, radius):
+    count = np.ones(shape, dtype=np.int32)
+    for axis, n in enumerate(shape):
+        idx = np.arange(n)
+        lengths = np.minimum(idx + radius + 1, n) - np.maximum(idx - radius, 0)
+        view = [1] * len(shape)
+        view[axis] = n
+        count *= lengths.reshape(view).astype(np.int32)
+    return count
+
+
+def box_mean(a, radius):
+    return box_sum(a, radius) / window_count(np.shape(a), radius)
+
+
+# Weights over the cubic (2r+1)^ndim support.
+#   gaussian:         exp(-d^2 / (2 sigma^2)), sigma defaults to r / 2
+#   inverse_distance: 1 / d, with the centre voxel weighted 1
+def make_kernel(kind, radius, ndim=3, sigma=None):
+    if kind not in KERNELS:
+        raise ValueError(f"kernel must be one of {KERNELS}, got {kind!r}")
+    axes = np.meshgrid(*[np.arange(-radius, radius + 1)] * ndim, indexing="ij")
+    dist = np.sqrt(sum(ax.astype(float) ** 2 for ax in axes))
+    if kind == "box":
+        return np.ones(dist.shape)
+    if kind == "gaussian":
+        sigma = radius / 2 if sigma is None else sigma
+        return np.exp(-dist ** 2 / (2 * sigma ** 2))
+    return 1.0 / np.maximum(dist, 1.0)
+
+
+def _direct_sum(a, kernel):
+    radius = kernel.shape[0] // 2
+    total = np.zeros(a.shape)
+    for shift in np.ndindex(*kernel.shape):
+        w = kernel[shift]
+        if w == 0:
+            continue
+        src, dst = [], []
+        for axis, s in enumerate(shift):
+            d = s - radius
+            n = a.shape[axis]
+            src.append(slice(max(d, 0), n + min(d, 0)))
+            dst.append(slice(max(-d, 0), n + min(-d, 0)))
+        total[tuple(dst)] += w * a[tuple(src)]
+    return total
+
+
+def _fft_sum(a, kernel):
+    radius = kernel.shape[0] // 2
+    shape = [n + k - 1 for n, k in zip(a.shape, kernel.shape)]
+    spectrum = np.fft.rfftn(a, shape) * np.fft.rfftn(kernel, shape)
+    full = np.fft.irfftn(spectrum, shape)
+    crop = tuple(slice(radius, radius + n) for n in a.shape)
+    return full[crop]
+
+
+# Kernel-weighted sum around every voxel with zero contribution from outside
+# the lattice. Kernels are symmetric, so convolution equals correlation.
+def kernel_sum(a, kernel, method="auto"):
+    if method == "auto":
+        method = "fft" if kernel.shape[0] // 2 >= FFT_MIN_RADIUS else "direct"
+    if method == "fft":
+        return _fft_sum(np.asarray(a, dtype=float), kernel)
+    if method == "direct":
+        return _direct_sum(np.asarray(a, dtype=float), kernel)
+    raise ValueError(f"method must be 'auto', 'direct' or 'fft', got {method!r}")
+
+
+# Weighted sum and normaliser of the long-range window around every voxel;
+# sum / norm is the edge-truncated mean field. The box kernel returns exact
+# integer sums and voxel counts.
+def long_range_field(spins, radius, kernel="box", sigma=None, method="auto"):
+    if kernel == "box":
+        return box_sum(spins, radius), window_count(spins.shape, radius)
+    weights = make_kernel(kernel, radius, spins.ndim, sigma)
+    norm = kernel_sum(np.ones(spins.shape), weights, method)
+    return kernel_sum(spins, weights, method), norm
+
+
+def long_range_mean(spins, radius, kernel="box", sigma=None, method="auto"):
+    total, norm = long_range_field(spins, radius, kernel, sigma, method)
+    return total / norm
+
+
+# Add delta * kernel centred on voxel p to a field from long_range_field, i.e.
+# patch the window sums after flipping the spin at p.
+def add_stamp(field, p, delta, radius, weights=None):
+    window, stamp = [], []
+    for c, n in zip(p, field.shape):
+        lo, hi = max(c - radius, 0), min(c + radius + 1, n)
+        window.append(slice(lo, hi))
+        stamp.append(slice(lo - c + radius, hi - c + radius))
+    if weights is None:
+        field[tuple(window)] += delta
+    else:
+        field[tuple(window)] += delta * weights[tuple(stamp)]
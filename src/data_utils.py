@@ -0,0 +1,15 @@
+import torch
+
+
+# |V_u - V_v| per edge as a (E, 1) edge_attr, the edge feature train_mpnn uses
+def voltage_gradient_edge_attr(x, edge_index):
+    return (x[edge_index[0], 0] - x[edge_index[1], 0]).abs().unsqueeze(1)
+
+
+# One PyG graph saved by gnn_data_export.export_pyg_data; voltage-gradient
+# edge features are added when the file has none
+def load_graph_data(path):
+    data = torch.load(path, weights_only=False)
+    if getattr(data, "edge_attr", None) is None:
+        data.edge_attr = voltage_gradient_edge_attr(data.x, data.edge_index)
+    return data
@@ -0,0 +1,176 @@
+import functools
+
+import numpy as np
+
+# Time integration of the voltage diffusion-decay equation
+#
+#     dV/dt = D lap(V) - k V        (D = diffusion_rate, k = decay_rate)
+#
+# on the lattice interior, the boundary voxels held at their values as in the
+# explicit stencil. params["integrator"] picks the scheme and params["dt"] the
+# step (1.0 is the original update, which "explicit" reproduces bit for bit):
+#
+#   explicit         forward Euler, V + dt f(V) with f = D lap(V) - k V; stable
+#                    only while dt <= stable_dt(params, ndim), about 0.8 at the
+#                    defaults in 3D
+#   implicit         backward Euler, unconditionally stable, first order
+#   crank_nicolson   trapezoidal rule, unconditionally stable, second order
+#
+# Both implicit schemes solve (I - theta dt A) dV = dt f(V) for the increment,
+# with A the diffusion-decay operator on the interior with zero boundary values
+# (the fixed boundary is already inside f). A type-I discrete sine transform
+# along every axis diagonalises A, so a solve is a forward and inverse DST of
+# the interior, O(N log N) through numpy's FFT and with no matrix.
+#
+# Operator splitting: the stimulus and spin tunneling are applied after the
+# diffusion solve as before. Their per-step probabilities are per unit time, so
+# for a step dt an event happens with probability 1 - (1 - p)^dt. Instead of
+# touching every probability, event_uniforms() maps each uniform u to
+# 1 - (1 - u)^(1/dt), which is below p exactly when u is below 1 - (1 - p)^dt.
+#
+# AdaptiveStepper picks dt step by step from the difference between a
+# backward-Euler and a Crank-Nicolson increment (an estimate of the local
+# error), so smooth stretches of a run take large steps.
+
+INTEGRATORS = ("explicit", "implicit", "crank_nicolson")
+THETA = {"implicit": 1.0, "crank_nicolson": 0.5}
+
+
+# Parameters saved before dt and the integrator existed step explicitly by 1
+def step_settings(params):
+    integrator = params.get("integrator", "explicit")
+    if integrator not in INTEGRATORS:
+        raise ValueError(f"integrator must be one of {INTEGRATORS}, got {integrator!r}")
+    dt = float(params.get("dt", 1.0))
+    if not dt > 0:
+        raise ValueError(f"dt must be positive, got {dt}")
+    return integrator, dt
+
+
+# Largest forward-Euler step that does not amplify the checkerboard mode
+def stable_dt(params, ndim):
+    return 2.0 / (4 * ndim * params["diffusion_rate"] + params["decay_rate"])
+
+
+# Uniforms for events with per-unit-time probabilities over a step dt
+def event_uniforms(u, dt):
+    if dt == 1.0:
+        return u
+    return -np.expm1(np.log1p(-u) / dt).astype(u.dtype, copy=False)
+
+
+# Unnormalised DST-I along `axis` from the FFT of the odd extension
+def _dst1(x, axis):
+    n = x.shape[axis]
+    zero = np.zeros_like(np.take(x, [0], axis=axis))
+    ext = np.concatenate([zero, x, zero, -np.flip(x, axis=axis)], axis=axis)
+    index = [slice(None)] * x.ndim
+    index[axis] = slice(1, n + 1)
+    return -np.fft.rfft(ext, axis=axis).imag[tuple(index)]
+
+
+# DST-I over `axes` (all by default) and its inverse
+def dst(x, axes=None):
+    for axis in range(x.ndim) if axes is None else axes:
+        x = _dst1(x, axis)
+    return x
+
+
+def idst(y, axes=None):
+    axes = range(y.ndim) if axes is None else axes
+    return dst(y, axes) / np.prod([2 * (y.shape[axis] + 1) for axis in axes])
+
+
+# Eigenvalues of the Dirichlet lattice Laplacian on an interior of this shape
+@functools.lru_cache(maxsize=16)
+def laplacian_eigenvalues(shape):
+    total = np.zeros(shape)
+    for axis, n in enumerate(shape):
+        view = [1] * len(shape)
+        view[axis] = n
+        total = total - 4 * np.sin(np.pi * np.arange(1, n + 1) / (2 * (n + 1))).reshape(view) ** 2
+    return total
+
+
+# `batch` leading axes are independent lattices (ensemble replicas), whose
+# parameters may be arrays broadcasting against them
+def _solve(rhs, params, dt, theta, batch=0):
+    axes = range(batch, rhs.ndim)
+    eig = params["diffusion_rate"] * laplacian_eigenvalues(rhs.shape[batch:]) - params["decay_rate"]
+    return idst(dst(rhs, axes) / (1 - theta * dt * eig), axes)
+
+
+# Voltage increment over one step from the explicit tendency f(V) of the
+# interior; the explicit dt = 1 case returns f itself
+def increment(tendency, params, integrator=None, dt=None, batch=0):
+    default_integrator, default_dt = step_settings(params)
+    integrator = default_integrator if integrator is None else integrator
+    dt = default_dt if dt is None else dt
+    if integrator == "explicit":
+        return tendency if dt == 1.0 else dt * tendency
+    return _solve(tendency * dt, params, dt, THETA[integrator], batch).astype(tendency.dtype, copy=False)
+
+
+# Local error of a step dt of `integrator` as the root-mean-square difference
+# from the increment of the other first/second-order scheme
+def error_estimate(tendency, params, integrator, dt):
+    reference = "implicit" if integrator == "crank_nicolson" else "crank_nicolson"
+    diff = increment(tendency, params, integrator, dt) - increment(tendency, params, reference, dt)
+    return float(np.sqrt(np.mean(np.square(diff)))) if diff.size else 0.0
+
+
+class AdaptiveStepper:
+    def __init__(self, params=None, tol=1e-3, dt=1.0, dt_min=1e-3, dt_max=100.0, safety=0.9):
+        from spin_engine import DEFAULT_PARAMS
+
+        self.params = dict(DEFAULT_PARAMS if params is None else params)
+        self.integrator, _ = step_settings(self.params)
+        self.tol = tol
+        self.dt = dt
+        self.dt_min = dt_min
+        self.dt_max = dt_max
+        self.safety = safety
+        self.time = 0.0
+        self.steps = 0
+        self.rejected = 0
+
+    def _limit(self, dt, ndim):
+        if self.integrator == "explicit":
+            dt = min(dt, stable_dt(self.params, ndim))
+        return min(max(dt, self.dt_min), self.dt_max)
+
+    # One accepted step, at most `max_dt` long; returns the new lattice
+    def step(self, voltage, states, spins, rng=None, mode="sequential", backend="numpy", max_dt=None):
+        from spin_engine import _interior, laplacian, update_grid
+
+        v = voltage[_interior(voltage.ndim)]
+        tendency = self.params["diffusion_rate"] * laplacian(voltage) - self.params["decay_rate"] * v
+        dt = self._limit(self.dt, voltage.ndim)
+        if max_dt is not None:
+            dt = min(dt, max_dt)
+        while True:
+            error = error_estimate(tendency, self.params, self.integrator, dt)
+            if error <= self.tol or dt <= self.dt_min:
+                break
+            self.rejected += 1
+            dt = max(dt * max(0.2, self.safety * (self.tol / error) ** 0.5), self.dt_min)
+
+        params = dict(self.params, dt=dt)
+        lattice = update_grid(voltage, states, spins, params, rng, mode, backend)
+        self.time += dt
+        self.steps += 1
+        growth = 5.0 if error == 0 else min(5.0, self.safety * (self.tol / error) ** 0.5)
+        self.dt = self._limit(dt * max(growth, 0.2), voltage.ndim)
+        return lattice
+
+    # Advance to `duration` time units; the recorder gets record(step, ...) after
+    # every accepted step, with .time holding the simulated time
+    def run(self, voltage, states, spins, duration, rng=None, mode="sequential", backend="numpy",
+            recorder=None):
+        end = self.time + duration
+        while end - self.time > 1e-12 * max(end, 1.0):
+            voltage, states, spins = self.step(voltage, states, spins, rng, mode, backend,
+                                               max_dt=end - self.time)
+            if recorder is not None:
+                recorder.record(self.steps, voltage, states, spins)
+        return voltage, states, spins
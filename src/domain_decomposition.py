@@ -0,0 +1,228 @@
+import multiprocessing as mp
+import os
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import diffusion
+from spin_engine import DEFAULT_PARAMS, _flip_probability, _interior, _odd_parity, _uniforms, laplacian
+
+# Domain-decomposed stepping of one large lattice across worker processes.
+#
+# The interior rows along the first axis are split into slabs, one per worker.
+# Voltage, states and spins live in multiprocessing.shared_memory blocks that
+# every worker maps, so the halo a slab needs (one row of voltage, the
+# long-range radius of spins) is read straight from its neighbours' rows instead
+# of being pickled between processes. A step is two phases separated by
+# barriers: every worker computes its new voltage, states and spin flips from
+# the shared start-of-step lattice, then writes its own rows back.
+#
+# Only the synchronous and checkerboard update rules decompose this way (the
+# sequential sweep is ordered across the whole lattice). Each slab draws its
+# uniforms from its own SeedSequence.spawn() stream; SlabStreams replays those
+# streams as a single rng, so
+#     update_grid(..., rng=SlabStreams(seed, shape, workers), mode="synchronous")
+# in one process gives exactly the decomposed result for the same seed (for the
+# box kernel; other kernels may differ in the last bits through FFT sizes).
+# After every step() the workers report their bit-generator states
+# (rng_states), which is what a checkpoint needs to resume the slab streams
+# exactly; pass them back as `rng_states` to continue.
+
+DECOMPOSED_MODES = ("synchronous", "checkerboard")
+
+
+# Interior rows [1, n - 1) split into `slabs` contiguous (start, stop) ranges
+def slab_bounds(n, slabs):
+    edges = np.linspace(1, n - 1, slabs + 1).round().astype(int).tolist()
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def slab_rngs(seed, slabs):
+    return [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(slabs)]
+
+
+# The per-slab streams seen as one rng with a random(shape) method, rows
+# concatenated in slab order
+class SlabStreams:
+    def __init__(self, seed, shape, slabs, dtype=np.float64):
+        self.bounds = slab_bounds(shape[0], slabs)
+        self.rngs = slab_rngs(seed, slabs)
+        self.dtype = dtype
+
+    def random(self, shape):
+        return np.concatenate([
+            _uniforms(rng, (stop - start,) + tuple(shape[1:]), self.dtype)
+            for rng, (start, stop) in zip(self.rngs, self.bounds)
+        ])
+
+
+# Flip decisions for rows [start, stop) from the current shared spins, computed
+# as in spin_engine._synchronous_flips on a block holding the rows within the
+# coupling halo
+def _slab_flips(spins, start, stop, barrier, u_flip, params, color=None):
+    lcs = params["long_range_coupling_strength"]
+    halo = max(int(params["long_range_radius"]), 1) if lcs else 1
+    lo, hi = max(start - halo, 0), min(stop + halo, spins.shape[0])
+    inner = (slice(start - lo, stop - lo),) + _interior(spins.ndim - 1)
+    flip = u_flip < _flip_probability(spins[lo:hi], barrier, params, inner)
+    if color is not None:
+        # Same colouring as spin_engine._checkerboard_flips on the full interior
+        odd = _odd_parity(barrier.shape, start - 1 + spins.ndim)
+        flip &= odd if color else ~odd
+    return flip
+
+
+def _slab_step(voltage, states, spins, start, stop, u, params, mode, sync):
+    rows = (slice(start, stop),) + _interior(voltage.ndim - 1)
+    v = voltage[rows]
+    nv = v + diffusion.increment(params["diffusion_rate"] * laplacian(voltage[start - 1:stop + 1])
+                                 - params["decay_rate"] * v, params)
+    nv[u[..., 0] < params["stimulus_prob"]] += params["stimulus_strength"]
+
+    threshold = params["threshold_potential"]
+    high = nv > threshold
+    low = (nv < threshold / 2) & ~high
+    st = states[rows]
+    st[high] = 1
+    st[low] = 0
+
+    barrier = np.abs(0.5 - nv)
+    colors = (None,) if mode == "synchronous" else (0, 1)
+    for color in colors:
+        flip = _slab_flips(spins, start, stop, barrier, u[..., 1], params, color)
+        sync.wait()
+        s = spins[rows]
+        s[flip] = 1 - s[flip]
+        if color in (None, 0):
+            voltage[rows] = np.clip(nv, 0, 1)
+        sync.wait()
+
+
+def _attach(names, shapes, dtypes):
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+              for block, shape, dtype in zip(blocks, shapes, dtypes)]
+    return blocks, arrays
+
+
+def _worker(index, names, shapes, dtypes, bounds, seed_seq, rng_state, params, mode, commands, done,
+            sync):
+    blocks, (voltage, states, spins) = _attach(names, shapes, dtypes)
+    start, stop = bounds
+    rng = np.random.default_rng(seed_seq)
+    if rng_state is not None:
+        rng.bit_generator.state = rng_state
+    shape = (stop - start,) + tuple(n - 2 for n in voltage.shape[1:]) + (2,)
+    _, dt = diffusion.step_settings(params)
+    try:
+        while True:
+            steps = commands.get()
+            if steps is None:
+                break
+            try:
+                for _ in range(steps):
+                    u = diffusion.event_uniforms(_uniforms(rng, shape, voltage.dtype), dt)
+                    _slab_step(voltage, states, spins, start, stop, u, params, mode, sync)
+            except threading.BrokenBarrierError:
+                done.put(RuntimeError(f"slab {bounds} stopped: another worker failed"))
+                break
+            except Exception as exc:
+                sync.abort()
+                done.put(exc)
+                break
+            done.put((index, rng.bit_generator.state))
+    finally:
+        del voltage, states, spins
+        for block in blocks:
+            block.close()
+
+
+# A lattice stepped by `workers` processes. The arrays are copied into shared
+# memory; .voltage, .states and .spins are live views while the lattice is open
+# and private copies after close().
+class DecomposedLattice:
+    def __init__(self, voltage, states, spins, params=None, workers=None, seed=None,
+                 mode="synchronous", rng_states=None):
+        if mode not in DECOMPOSED_MODES:
+            raise ValueError(f"mode must be one of {DECOMPOSED_MODES}, got {mode!r}")
+        self.params = DEFAULT_PARAMS if params is None else params
+        if diffusion.step_settings(self.params)[0] != "explicit":
+            raise ValueError("DecomposedLattice steps the explicit integrator only")
+        self.workers = max(1, min(workers or os.cpu_count() or 1, voltage.shape[0] - 2))
+        if rng_states is not None and len(rng_states) != self.workers:
+            raise ValueError(f"Expected {self.workers} rng states, got {len(rng_states)}")
+        self.rng_states = list(rng_states) if rng_states is not None else None
+        self.bounds = slab_bounds(voltage.shape[0], self.workers)
+        self.step_count = 0
+
+        self._blocks = []
+        arrays = []
+        for a in (voltage, states, spins):
+            block = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+            view = np.ndarray(a.shape, dtype=a.dtype, buffer=block.buf)
+            view[...] = a
+            self._blocks.append(block)
+            arrays.append(view)
+        self.voltage, self.states, self.spins = arrays
+
+        names = [block.name for block in self._blocks]
+        shapes = [a.shape for a in arrays]
+        dtypes = [a.dtype for a in arrays]
+        sync = mp.Barrier(self.workers)
+        self._done = mp.Queue()
+        self._commands = [mp.Queue() for _ in range(self.workers)]
+        seeds = np.random.SeedSequence(seed).spawn(self.workers)
+        states = self.rng_states or [None] * self.workers
+        self._procs = [
+            mp.Process(
+                target=_worker,
+                args=(i, names, shapes, dtypes, self.bounds[i], seeds[i], states[i], self.params, mode,
+                      self._commands[i], self._done, sync),
+                daemon=True,
+            )
+            for i in range(self.workers)
+        ]
+        for proc in self._procs:
+            proc.start()
+
+    def step(self, steps=1):
+        if not self._procs:
+            raise RuntimeError("DecomposedLattice is closed")
+        for commands in self._commands:
+            commands.put(steps)
+        replies = [self._done.get() for _ in self._procs]
+        errors = [r for r in replies if isinstance(r, BaseException)]
+        if errors:
+            self.close()
+            raise RuntimeError("Domain-decomposed step failed") from errors[0]
+        self.rng_states = [state for _, state in sorted(replies, key=lambda r: r[0])]
+        self.step_count += steps
+        return self.voltage, self.states, self.spins
+
+    def close(self):
+        if not self._blocks:
+            return
+        for commands in self._commands:
+            commands.put(None)
+        for proc in self._procs:
+            proc.join()
+        self._procs = []
+        self.voltage, self.states, self.spins = (a.copy() for a in (self.voltage, self.states, self.spins))
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_decomposed(voltage, states, spins, steps, params=None, workers=None, seed=None,
+                   mode="synchronous"):
+    with DecomposedLattice(voltage, states, spins, params, workers, seed, mode) as lattice:
+        lattice.step(steps)
+    return lattice.voltage, lattice.states, lattice.spins
@@ -0,0 +1,137 @@
+import numpy as np
+
+import diffusion
+from entangled_spin_grid import initial_lattice
+from profiling import count, phase
+from spin_engine import (MODES, _checkerboard_flips, _flip_functions, _interior, _synchronous_flips, _uniforms,
+                         _voltage_and_states)
+
+# Ensemble stepping: R independent replicas of one lattice shape held in
+# (R, X, Y, Z) arrays and advanced by the same vectorized operations.
+#
+# Every replica draws its uniforms from its own rng, in the same amounts as a
+# lone update_grid call, and the steps are spin_engine's own functions run with
+# one batch axis. Replica r therefore ends exactly where update_grid with
+# rngs[r] and its parameters would (bit for bit for the box kernel; other
+# kernels are computed per replica). The synchronous and checkerboard rules
+# run on the whole ensemble at once; the sequential sweep and kinetic Monte
+# Carlo are inherently per lattice and loop over replicas after the batched
+# voltage update.
+#
+# Numeric parameters may differ between replicas (VARYING_PARAMS); they are
+# carried as (R, 1, ..., 1) arrays that broadcast against the lattice. The
+# coupling radius and kernel, dt and the integrator shape the computation and
+# must be shared.
+#
+#     configs = [SimulationConfig((30, 30, 10), 100, seed=s, mode="synchronous") for s in range(64)]
+#     lattices = simulate_ensemble(configs)   # list of (voltage, states, spins)
+
+VARYING_PARAMS = (
+    "diffusion_rate",
+    "decay_rate",
+    "stimulus_strength",
+    "stimulus_prob",
+    "threshold_potential",
+    "kT",
+    "coupling_strength",
+    "long_range_coupling_strength",
+)
+
+
+# One parameter dict for the ensemble from a shared dict or one dict per
+# replica; parameters that differ become (R, 1, ..., 1) arrays
+def ensemble_params(params, replicas, ndim):
+    if isinstance(params, dict):
+        return params
+    if len(params) != replicas:
+        raise ValueError(f"Expected {replicas} parameter sets, got {len(params)}")
+    merged = {}
+    for key in params[0]:
+        values = [p[key] for p in params]
+        if all(v == values[0] for v in values):
+            merged[key] = values[0]
+        elif key in VARYING_PARAMS:
+            merged[key] = np.array(values, dtype=np.float64).reshape((replicas,) + (1,) * ndim)
+        else:
+            raise ValueError(f"{key} must be the same for every replica")
+    return merged
+
+
+# Parameters of replica r
+def replica_params(params, r):
+    return {key: value[r].item() if isinstance(value, np.ndarray) else value
+            for key, value in params.items()}
+
+
+# One step of every replica; `rngs` holds one generator per replica and
+# `params` a dict (shared, or from ensemble_params) or one dict per replica
+def update_ensemble(voltage, states, spins, params, rngs, mode="synchronous", backend="numpy"):
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+    replicas, ndim = voltage.shape[0], voltage.ndim - 1
+    if len(rngs) != replicas:
+        raise ValueError(f"Expected {replicas} rngs, got {len(rngs)}")
+    params = ensemble_params(params, replicas, ndim)
+    _, dt = diffusion.step_settings(params)
+
+    with phase("update_ensemble"):
+        inner_shape = tuple(n - 2 for n in voltage.shape[1:])
+        draws = 1 if mode == "kmc" else 2
+        with phase("rng"):
+            u = np.stack([_uniforms(rng, inner_shape + (draws,), voltage.dtype) for rng in rngs])
+            u = diffusion.event_uniforms(u, dt)
+        with phase("voltage"):
+            new_voltage = _voltage_and_states(voltage, states, u[..., 0], params, batch=1)
+            barrier = np.subtract(0.5, new_voltage[_interior(ndim, batch=1)])
+            np.abs(barrier, out=barrier)
+
+        with phase("spin_flips"):
+            if mode == "synchronous":
+                flips = _synchronous_flips(spins, barrier, u[..., 1], params, batch=1)
+            elif mode == "checkerboard":
+                flips = _checkerboard_flips(spins, barrier, u[..., 1], params, batch=1)
+            elif mode == "kmc":
+                flips = 0
+                for r in range(replicas):
+                    p = replica_params(params, r)
+                    flips += _flip_functions(backend, p, ndim)["kmc"](spins[r], barrier[r], rngs[r], p, dt)
+            else:
+                flips = 0
+                for r in range(replicas):
+                    p = replica_params(params, r)
+                    flip_spins = _flip_functions(backend, p, ndim)[mode]
+                    flips += flip_spins(spins[r], barrier[r], u[r, ..., 1], p)
+            count("spins_flipped", flips)
+
+        np.clip(new_voltage, 0, 1, out=new_voltage)
+    return new_voltage, states, spins
+
+
+# Stack per-replica lattices into ensemble arrays, and split them back into
+# (voltage, states, spins) tuples for the exporters
+def stack(lattices):
+    return tuple(np.stack(field) for field in zip(*lattices))
+
+
+def split(voltage, states, spins):
+    return list(zip(voltage, states, spins))
+
+
+# Run the replicas described by `configs`, which must agree on grid size,
+# steps, mode, backend and dtypes; seeds and parameters may differ. Each
+# replica uses config.rng() (or rngs[r]), so it reproduces simulate(config).
+# A recorder gets record(step, voltage, states, spins) with ensemble arrays.
+def simulate_ensemble(configs, rngs=None, recorder=None):
+    first = configs[0]
+    for config in configs[1:]:
+        for name in ("grid_size", "steps", "mode", "backend", "compact"):
+            if getattr(config, name) != getattr(first, name):
+                raise ValueError(f"Ensemble replicas must share {name}")
+    rngs = [config.rng() for config in configs] if rngs is None else rngs
+    voltage, states, spins = stack(initial_lattice(config, rng) for config, rng in zip(configs, rngs))
+    params = ensemble_params([config.params for config in configs], len(configs), len(first.grid_size))
+    for step in range(first.steps):
+        voltage, states, spins = update_ensemble(voltage, states, spins, params, rngs, first.mode, first.backend)
+        if recorder is not None:
+            recorder.record(step + 1, voltage, states, spins)
+    return split(voltage, states, spins)
@@ -0,0 +1,131 @@
+import os
+from dataclasses import asdict, dataclass, field, replace
+
+import numpy as np
+
+from lattice_state import BINARY_DTYPE
+from spin_engine import BACKENDS, MODES, initialize_grid, make_params, update_grid
+
+# Importable entry point for the 3D spin simulation, shared by run_simluation,
+# batch_sim_runner, param_sweep and the exporters. Importing it runs nothing and
+# loads only numpy and the engine; networkx, torch and matplotlib are imported
+# by the exporters that need them, so worker processes start quickly.
+#
+#     config = SimulationConfig(grid_size=(64, 64, 32), steps=200, seed=1)
+#     voltage, states, spins = simulate(config)
+#     export((voltage, states, spins), "lattice.gexf")
+
+# Output formats by file extension
+EXPORT_FORMATS = {
+    ".gexf": "graph",
+    ".pt": "pyg",
+    ".npz": "gradients",
+    ".csv": "gradients_csv",
+}
+
+
+@dataclass
+class SimulationConfig:
+    grid_size: tuple = (30, 30, 10)
+    steps: int = 100
+    seed: object = None  # int, np.random.SeedSequence or None
+    mode: str = "sequential"
+    backend: str = "numpy"
+    compact: bool = False  # float32 voltage, uint8 states and spins (lattice_state.LatticeState)
+    params: dict = field(default_factory=make_params)
+
+    def __post_init__(self):
+        if self.mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {self.mode!r}")
+        if self.backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}, got {self.backend!r}")
+        self.grid_size = tuple(int(n) for n in self.grid_size)
+        self.params = make_params(**self.params)
+
+    def with_params(self, **overrides):
+        return replace(self, params={**self.params, **overrides})
+
+    # JSON-friendly form; a SeedSequence seed is stored as its entropy, spawn
+    # key and spawn count, so spawned seeds come back as the same stream
+    def to_dict(self):
+        config = asdict(self)
+        if isinstance(self.seed, np.random.SeedSequence):
+            config["seed"] = {
+                "entropy": self.seed.entropy,
+                "spawn_key": list(self.seed.spawn_key),
+                "n_children_spawned": self.seed.n_children_spawned,
+            }
+        config["grid_size"] = list(self.grid_size)
+        return config
+
+    @classmethod
+    def from_dict(cls, config):
+        config = dict(config)
+        seed = config.get("seed")
+        if isinstance(seed, dict):
+            config["seed"] = np.random.SeedSequence(
+                seed["entropy"],
+                spawn_key=tuple(seed.get("spawn_key", ())),
+                n_children_spawned=seed.get("n_children_spawned", 0),
+            )
+        return cls(**config)
+
+    def rng(self):
+        return np.random.default_rng(self.seed)
+
+    def dtypes(self):
+        if self.compact:
+            return np.float32, BINARY_DTYPE, BINARY_DTYPE
+        return np.float64, np.float64, None
+
+
+def initial_lattice(config, rng=None):
+    rng = config.rng() if rng is None else rng
+    return initialize_grid(config.grid_size, rng, *config.dtypes())
+
+
+# Run config.steps steps (from `start` when continuing a saved lattice) and
+# return (voltage, states, spins). A recorder gets record(step, voltage,
+# states, spins) after every step, as with spin_engine.run.
+def simulate(config, rng=None, lattice=None, start=0, recorder=None):
+    rng = config.rng() if rng is None else rng
+    voltage, states, spins = initial_lattice(config, rng) if lattice is None else lattice
+    for step in range(start, config.steps):
+        voltage, states, spins = update_grid(voltage, states, spins, config.params, rng, config.mode,
+                                             config.backend)
+        if recorder is not None:
+            recorder.record(step + 1, voltage, states, spins)
+    return voltage, states, spins
+
+
+# Write the lattice as a networkx graph (.gexf), PyG data (.pt) or voltage
+# gradients (.npz/.csv); `fmt` overrides the extension
+def export(lattice, output, fmt=None):
+    voltage, states, spins = lattice
+    if fmt is None:
+        ext = os.path.splitext(output)[1]
+        if ext not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown output extension {ext!r}; expected one of {sorted(EXPORT_FORMATS)}")
+        fmt = EXPORT_FORMATS[ext]
+    if fmt == "graph":
+        from lattice_graph import build_lattice_graph, export_graph_data
+
+        export_graph_data(build_lattice_graph(voltage, states, spins), output)
+    elif fmt == "pyg":
+        from lattice_graph import build_lattice_graph
+        from gnn_data_export import export_pyg_data
+
+        export_pyg_data(build_lattice_graph(voltage, states, spins), filename=output)
+    elif fmt in ("gradients", "gradients_csv"):
+        from voltage_gradient_export import export_lattice_gradients
+
+        export_lattice_gradients(voltage, output, fmt="npz" if fmt == "gradients" else "csv")
+    else:
+        raise ValueError(f"fmt must be one of {sorted(set(EXPORT_FORMATS.values()))}, got {fmt!r}")
+
+
+def run_simulation(config, output=None, rng=None, recorder=None, fmt=None):
+    lattice = simulate(config, rng, recorder=recorder)
+    if output:
+        export(lattice, output, fmt)
+    return lattice
@@ -1,8 +1,21 @@
-import networkx as nx
+import numpy as np
 import torch
 from torch_geometric.data import Data
 
+from lattice_graph import LatticeGraph
+from profiling import profiled
+
+# Array path: features and edge_index come straight from the lattice arrays and
+# grid strides; torch.from_numpy shares memory with them
+def lattice_to_pyg_data(lattice):
+    x = torch.from_numpy(lattice.node_features(np.float32))
+    edge_index = torch.from_numpy(lattice.edge_index)
+    return Data(x=x, edge_index=edge_index)
+
 def convert_to_pyg_data(graph):
+    if isinstance(graph, LatticeGraph):
+        return lattice_to_pyg_data(graph)
+
     node_attrs = []
     for _, data in graph.nodes(data=True):
         voltage = data.get("voltage", 0.0)
@@ -12,11 +25,6 @@ def convert_to_pyg_data(graph):
 
     x = torch.tensor(node_attrs, dtype=torch.float)
 
-    edge_index = []
-    for u, v in graph.edges():
-        edge_index.append([u, v])
-        edge_index.append([v, u])  # Make undirected
-
     node_to_index = {node: i for i, node in enumerate(graph.nodes())}
     edge_index_tensor = torch.tensor(
         [[node_to_index[u], node_to_index[v]] for u, v in graph.edges()] +
@@ -27,13 +35,14 @@ def convert_to_pyg_data(graph):
     data = Data(x=x, edge_index=edge_index_tensor)
     return data
 
+@profiled()
 def export_pyg_data(graph, filename="pyg_graph.pt"):
     data = convert_to_pyg_data(graph)
     torch.save(data, filename)
     print(f"PyTorch Geometric data saved to {filename}")
 
 # Example usage:
-# from entangled_spin_grid import create_bioelectric_graph
-# graph = create_bioelectric_graph(voltage_grid, cell_states, spin_states)
+# from lattice_graph import build_lattice_graph
+# graph = build_lattice_graph(voltage_grid, cell_states, spin_states)
 # export_pyg_data(graph)
 
@@ -0,0 +1,264 @@
+import argparse
+import functools
+import math
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch_geometric.data import Data
+from torch_geometric.loader import DataLoader
+
+from data_utils import voltage_gradient_edge_attr
+from lattice_graph import lattice_edge_index
+
+# Mini-batched training shared by the GCN (gnn_training), GAT (gnn_training_gat)
+# and MPNN (gnn_training_mpnn) models.
+#
+# Three ways to batch, all fed through a DataLoader whose workers prepare the
+# next batches in the background:
+#   graph_loader     many simulation graphs per step (e.g. a LatticeDataset)
+#   block_loader     one huge lattice cut into spatial blocks (a regular-grid
+#                    cluster partition); each block carries a halo of `halo`
+#                    voxels and the loss covers only its core. The core outputs
+#                    equal the full-graph ones once halo >= number of layers
+#                    (GAT, MPNN) or layers + 1 (GCN, whose normalisation also
+#                    needs the degrees one hop further out)
+#   neighbor_loader  one huge lattice, seed voxels plus `num_neighbors[h]`
+#                    sampled lattice neighbours per node at hop h; the batch is
+#                    the subgraph induced on the sampled voxels, loss on seeds
+# Both lattice samplers work from index arithmetic on the grid, so they need
+# neither pyg-lib/torch-sparse nor a stored edge_index. train() reports loss,
+# accuracy and nodes/sec (loss nodes) per epoch.
+
+MODELS = ("gcn", "gat", "mpnn")
+
+
+def build_model(name, input_dim=3, hidden_dim=None, output_dim=2):
+    if name == "gcn":
+        from gnn_training import build_gcn_model
+
+        return build_gcn_model(input_dim, hidden_dim or 32, output_dim)
+    if name == "gat":
+        from gnn_training_gat import GAT
+
+        return GAT(input_dim, hidden_dim or 16, output_dim)
+    if name == "mpnn":
+        from gnn_training_mpnn import MPNN
+
+        return MPNN(input_dim, 1, hidden_dim or 16, output_dim)
+    raise ValueError(f"model must be one of {MODELS}, got {name!r}")
+
+
+# Call any of the three models on a batch
+def forward(model, batch):
+    from gnn_training_gat import GAT
+    from gnn_training_mpnn import MPNN
+
+    if isinstance(model, MPNN):
+        edge_attr = getattr(batch, "edge_attr", None)
+        if edge_attr is None:
+            edge_attr = voltage_gradient_edge_attr(batch.x, batch.edge_index)
+        return model(batch.x, batch.edge_index, edge_attr)
+    if isinstance(model, GAT):
+        return model(batch.x, batch.edge_index)
+    return model(batch)
+
+
+def _strides(shape):
+    return np.cumprod((tuple(shape[1:]) + (1,))[::-1])[::-1]
+
+
+@functools.lru_cache(maxsize=64)
+def _box_edge_index(shape):
+    return torch.from_numpy(lattice_edge_index(shape))
+
+
+def _labels(data):
+    y = getattr(data, "y", None)
+    return data.x[:, 2].long() if y is None else y
+
+
+class LatticeBlockSampler(torch.utils.data.Dataset):
+    def __init__(self, data, shape, block=16, halo=3):
+        self.x = data.x
+        self.y = _labels(data)
+        self.shape = tuple(shape)
+        self.block = block
+        self.halo = halo
+        self.origins = list(np.ndindex(*(-(-n // block) for n in self.shape)))
+
+    def __len__(self):
+        return len(self.origins)
+
+    def __getitem__(self, index):
+        lo = [i * self.block for i in self.origins[index]]
+        hi = [min(l + self.block, n) for l, n in zip(lo, self.shape)]
+        glo = [max(l - self.halo, 0) for l in lo]
+        ghi = [min(h + self.halo, n) for h, n in zip(hi, self.shape)]
+        sub_shape = tuple(h - l for l, h in zip(glo, ghi))
+
+        grids = np.meshgrid(*(np.arange(l, h) for l, h in zip(glo, ghi)), indexing="ij")
+        ids = torch.from_numpy(np.ravel_multi_index(tuple(g.ravel() for g in grids), self.shape))
+        core = np.zeros(sub_shape, dtype=bool)
+        core[tuple(slice(l - g, h - g) for l, h, g in zip(lo, hi, glo))] = True
+        return Data(x=self.x[ids], edge_index=_box_edge_index(sub_shape), y=self.y[ids],
+                    loss_mask=torch.from_numpy(core.ravel()), n_id=ids)
+
+
+class LatticeNeighborSampler(torch.utils.data.Dataset):
+    def __init__(self, data, shape, num_neighbors=(6, 4), batch_size=1024, seed=None):
+        self.x = data.x
+        self.y = _labels(data)
+        self.shape = tuple(shape)
+        self.num_nodes = int(np.prod(self.shape))
+        self.num_neighbors = tuple(num_neighbors)
+        self.batch_size = batch_size
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.set_epoch(0)
+
+    # New seed order (and neighbour draws) for every epoch
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.order = np.random.default_rng((self.seed, epoch)).permutation(self.num_nodes)
+
+    def __len__(self):
+        return math.ceil(self.num_nodes / self.batch_size)
+
+    # (2 * ndim, len(ids)) lattice neighbours of ids, -1 outside the lattice
+    def _neighbors(self, ids):
+        coords = np.unravel_index(ids, self.shape)
+        out = []
+        for axis, (n, stride) in enumerate(zip(self.shape, _strides(self.shape))):
+            out.append(np.where(coords[axis] > 0, ids - stride, -1))
+            out.append(np.where(coords[axis] < n - 1, ids + stride, -1))
+        return np.stack(out)
+
+    def __getitem__(self, index):
+        rng = np.random.default_rng((self.seed, self.epoch, index))
+        seeds = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        nodes, frontier = [seeds], seeds
+        seen = np.sort(seeds)
+        for fanout in self.num_neighbors:
+            nbrs = self._neighbors(frontier)
+            if fanout < nbrs.shape[0]:
+                keys = np.where(nbrs >= 0, rng.random(nbrs.shape), np.inf)
+                pick = np.argsort(keys, axis=0)[:fanout]
+                nbrs = np.take_along_axis(nbrs, pick, axis=0)
+            new = np.unique(nbrs[nbrs >= 0])
+            new = new[~np.isin(new, seen, assume_unique=True)]
+            if new.size == 0:
+                break
+            nodes.append(new)
+            seen = np.union1d(seen, new)
+            frontier = new
+        ids = np.concatenate(nodes)
+
+        # Induced lattice edges, both directions
+        order = np.argsort(ids)
+        sorted_ids = ids[order]
+        src, dst = [], []
+        for axis, (n, stride) in enumerate(zip(self.shape, _strides(self.shape))):
+            has = np.unravel_index(ids, self.shape)[axis] < n - 1
+            u = np.flatnonzero(has)
+            pos = np.searchsorted(sorted_ids, ids[u] + stride)
+            pos = np.minimum(pos, sorted_ids.size - 1)
+            hit = sorted_ids[pos] == ids[u] + stride
+            src.append(u[hit])
+            dst.append(order[pos[hit]])
+        src, dst = np.concatenate(src), np.concatenate(dst)
+        edge_index = torch.from_numpy(np.stack([np.concatenate([src, dst]), np.concatenate([dst, src])]))
+
+        loss_mask = torch.zeros(ids.size, dtype=torch.bool)
+        loss_mask[:seeds.size] = True
+        ids = torch.from_numpy(ids)
+        return Data(x=self.x[ids], edge_index=edge_index, y=self.y[ids], loss_mask=loss_mask, n_id=ids)
+
+
+# Workers are kept across epochs unless the dataset reshuffles itself per epoch
+def _loader(dataset, batch_size, shuffle, num_workers):
+    persistent = num_workers > 0 and not hasattr(dataset, "set_epoch")
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers,
+                      persistent_workers=persistent)
+
+
+def graph_loader(dataset, batch_size=32, shuffle=True, num_workers=0):
+    return _loader(dataset, batch_size, shuffle, num_workers)
+
+
+def block_loader(data, shape, block=16, halo=3, batch_size=1, shuffle=True, num_workers=0):
+    return _loader(LatticeBlockSampler(data, shape, block, halo), batch_size, shuffle, num_workers)
+
+
+def neighbor_loader(data, shape, num_neighbors=(6, 4), batch_size=1024, num_workers=0, seed=None):
+    return _loader(LatticeNeighborSampler(data, shape, num_neighbors, batch_size, seed), 1, False, num_workers)
+
+
+def train(model, loader, epochs=10, lr=0.01, device=None, log=print):
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    model = model.to(device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    history = []
+    for epoch in range(epochs):
+        if hasattr(loader.dataset, "set_epoch"):
+            loader.dataset.set_epoch(epoch)
+        model.train()
+        start = time.perf_counter()
+        total_loss = correct = nodes = 0
+        for batch in loader:
+            batch = batch.to(device)
+            optimizer.zero_grad()
+            out = forward(model, batch)
+            target = _labels(batch)
+            mask = getattr(batch, "loss_mask", None)
+            if mask is not None:
+                out, target = out[mask], target[mask]
+            loss = F.cross_entropy(out, target)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * target.size(0)
+            correct += (out.argmax(dim=1) == target).sum().item()
+            nodes += target.size(0)
+        seconds = time.perf_counter() - start
+        entry = {"epoch": epoch + 1, "loss": total_loss / max(nodes, 1), "accuracy": correct / max(nodes, 1),
+                 "nodes_per_sec": nodes / seconds}
+        history.append(entry)
+        if log:
+            log(f"Epoch {entry['epoch']:03d}, Loss: {entry['loss']:.4f}, Accuracy: {entry['accuracy']:.4f}, "
+                f"{entry['nodes_per_sec']:.0f} nodes/s")
+    return history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mini-batched GNN training on lattice graphs")
+    parser.add_argument("--model", choices=MODELS, default="gcn")
+    parser.add_argument("--dataset", type=str, default=None,
+                        help="LatticeDataset directory or folder of .pt graphs (batched by graph)")
+    parser.add_argument("--lattice", type=str, default=None, help="Single large lattice .pt graph")
+    parser.add_argument("--size", type=int, nargs=3, default=None, help="Grid size (X Y Z) of --lattice")
+    parser.add_argument("--sampler", choices=("block", "neighbor"), default="block")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Graphs, blocks or seed voxels per batch (default 32, 1, 1024)")
+    parser.add_argument("--block", type=int, default=16, help="Block edge length for --sampler block")
+    parser.add_argument("--halo", type=int, default=3, help="Block halo (layers + 1 for exact GCN outputs)")
+    parser.add_argument("--num-neighbors", type=int, nargs="+", default=[6, 4], help="Fanout per hop")
+    parser.add_argument("--workers", type=int, default=2, help="Background loader processes")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--lr", type=float, default=0.01)
+    args = parser.parse_args()
+
+    if args.dataset:
+        from gnn_training import load_graph_dataset
+
+        loader = graph_loader(load_graph_dataset(args.dataset), args.batch_size or 32, num_workers=args.workers)
+    elif args.lattice and args.size:
+        data = torch.load(args.lattice, weights_only=False)
+        if args.sampler == "block":
+            loader = block_loader(data, args.size, args.block, args.halo, args.batch_size or 1,
+                                  num_workers=args.workers)
+        else:
+            loader = neighbor_loader(data, args.size, args.num_neighbors, args.batch_size or 1024,
+                                     num_workers=args.workers)
+    else:
+        parser.error("pass --dataset, or --lattice with --size")
+    train(build_model(args.model), loader, args.epochs, args.lr)
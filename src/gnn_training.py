@@ -4,16 +4,26 @@ from torch_geometric.data import DataLoader
 from torch_geometric.nn import GCNConv
 import os
 
-# Sample GCN Model for Classification (spin prediction)
-def build_gcn_model(input_dim, hidden_dim=32, output_dim=2):
+# Sample GCN Model for Classification (spin prediction). backend="lattice"
+# uses lattice_conv stencil layers; that model takes the (X, Y, Z, C) grid
+# tensor in place of a Data object.
+def build_gcn_model(input_dim, hidden_dim=32, output_dim=2, backend="sparse"):
+    if backend == "lattice":
+        from lattice_conv import LatticeGCNConv as Conv
+    else:
+        Conv = GCNConv
+
     class GCN(torch.nn.Module):
         def __init__(self):
             super().__init__()
-            self.conv1 = GCNConv(input_dim, hidden_dim)
-            self.conv2 = GCNConv(hidden_dim, output_dim)
+            self.conv1 = Conv(input_dim, hidden_dim)
+            self.conv2 = Conv(hidden_dim, output_dim)
 
         def forward(self, data):
-            x, edge_index = data.x, data.edge_index
+            if torch.is_tensor(data):
+                x, edge_index = data, None
+            else:
+                x, edge_index = data.x, data.edge_index
             x = self.conv1(x, edge_index)
             x = F.relu(x)
             x = self.conv2(x, edge_index)
@@ -21,8 +31,13 @@ def build_gcn_model(input_dim, hidden_dim=32, output_dim=2):
 
     return GCN()
 
-# Load all PyG graph files from a folder
+# Load all PyG graph files from a folder. A folder written by lattice_dataset
+# (meta.json present) is opened as a lazy, memory-mapped LatticeDataset.
 def load_graph_dataset(folder_path):
+    if os.path.exists(os.path.join(folder_path, "meta.json")):
+        from lattice_dataset import LatticeDataset
+
+        return LatticeDataset(folder_path)
     dataset = []
     for file in os.listdir(folder_path):
         if file.endswith(".pt"):
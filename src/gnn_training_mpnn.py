@@ -5,18 +5,25 @@ from torch_geometric.data import Data
 
 from data_utils import load_graph_data
 
+# backend="lattice" runs the convolution as a lattice_conv stencil; call it
+# with the (X, Y, Z, C) grid tensor and no edge_index/edge_attr
 class MPNN(torch.nn.Module):
-    def __init__(self, input_dim, edge_dim, hidden_dim, output_dim):
+    def __init__(self, input_dim, edge_dim, hidden_dim, output_dim, backend="sparse"):
         super(MPNN, self).__init__()
         edge_nn = torch.nn.Sequential(
             torch.nn.Linear(edge_dim, 32),
             torch.nn.ReLU(),
             torch.nn.Linear(32, input_dim * hidden_dim)
         )
-        self.conv = NNConv(input_dim, hidden_dim, edge_nn, aggr='mean')
+        if backend == "lattice":
+            from lattice_conv import LatticeNNConv
+
+            self.conv = LatticeNNConv(input_dim, hidden_dim, edge_nn, aggr='mean')
+        else:
+            self.conv = NNConv(input_dim, hidden_dim, edge_nn, aggr='mean')
         self.lin = torch.nn.Linear(hidden_dim, output_dim)
 
-    def forward(self, x, edge_index, edge_attr):
+    def forward(self, x, edge_index=None, edge_attr=None):
         x = F.relu(self.conv(x, edge_index, edge_attr))
         return self.lin(x)
 
@@ -0,0 +1,263 @@
+import math
+
+import numpy as np
+
+import coupling
+
+# Kinetic Monte Carlo (rejection-free, n-fold way) spin flips: update_grid's
+# mode="kmc".
+#
+# The per-step modes flip a spin with its tunneling probability p =
+# exp(-max(barrier - influence, 0) / kT) per unit time, i.e. with probability
+# 1 - (1 - p)^dt over a step. Here each spin flips at the event rate
+# -log(1 - p), which gives an isolated spin the same probability, and at most
+# once per step, as in the per-step modes. Saturated spins (barrier <=
+# influence, p = 1) have an infinite rate and flip as soon as they saturate, in
+# random order when several do at once. Within a step the voltage (and so every
+# barrier) is fixed and the coupling influence changes only when a nearby spin
+# flips, so kmc differs from the per-step modes in the order of the flips only:
+# a spin sees the flips made before it in continuous time rather than those
+# made before it in a sweep (sequential) or none (synchronous).
+#
+# Rates are bounded from above using the largest possible influence, as
+# _sequential_flips does for its candidates. Spins whose bound is at most
+# HOT_EVENTS per step ("cold", nearly all of them at low kT) are sampled by
+# thinning: a Poisson number of proposals, their times, voxels and acceptance
+# thresholds are drawn for the whole step in a few vectorized calls from one
+# cumulative sum of the bounds, and a proposal is accepted if its threshold is
+# below the voxel's rate at that moment. The remaining "hot" spins
+# (near-saturated, possibly saturated) are drawn from their exact rates in a
+# bucketed table (buckets of about sqrt(n) rates plus the sum of each bucket).
+# Hot and proposed spins are the only ones tracked: their neighbour sums,
+# window sums and rates are computed once per step and patched after each flip
+# for the tracked spins within coupling range, and so is the table.
+#
+# Besides the O(N) bound pass (the voltage update is O(N) per step anyway) the
+# cost is the vectorized setup for the tracked spins plus a constant amount of
+# work per flip and per proposal; no neighbour or window sums are computed for
+# the whole lattice unless gathering the tracked spins' windows would read
+# more. With NumPy that constant is about 0.1 ms, so on a 64^3 lattice kmc only
+# beats synchronous mode below about one flip per 10^4 spins per step.
+# spin_jit compiles the event loop (backend="numba"); then a step costs about
+# the same as a synchronous one at one flip per 100-300 spins and a third less
+# at one per 10^4, where the voltage update is most of what is left.
+
+# Rates above this many events per step are drawn exactly rather than thinned
+HOT_EVENTS = 1.0
+
+
+# Event rate -log(1 - p) of a flip probability p per unit time (inf at p = 1)
+def _event_rate(p):
+    with np.errstate(divide="ignore"):
+        return -np.log1p(-p)
+
+
+# Event rates from spins `s` and their neighbour sums, window sums and window
+# normalisers, computed as in spin_engine._flip_probability
+def _rates(s, nbr, win, norm, barrier, cs, lcs, kT, ndim):
+    influence = cs * (1 - np.abs(s - nbr / (2 * ndim)))
+    if lcs:
+        influence = influence + lcs * (1 - np.abs(s - win / norm))
+    return _event_rate(np.exp(-np.maximum(barrier - influence, 0) / kT))
+
+
+# Offsets (rows) of the window of `radius` in `ndim` dimensions, in the raster
+# order of coupling.make_kernel
+def _window_offsets(radius, ndim):
+    return np.indices((2 * radius + 1,) * ndim).reshape(ndim, -1).T - radius
+
+
+# Neighbour spin sums, long-range window sums and window normalisers of the
+# spins at `coords` (rows of interior coordinates), as neighbor_spin_sum and
+# coupling.long_range_field give them for the whole lattice. Windows are
+# gathered per spin unless that reads more voxels than the lattice has.
+def _fields(spins, coords, offsets, weights, chunk=1024):
+    x = coords + 1
+    if offsets is not None and len(x) * len(offsets) > spins.size:
+        radius = int(offsets.max())
+        if weights is None:
+            win, norm = coupling.box_sum(spins, radius), coupling.window_count(spins.shape, radius)
+        else:
+            kernel = weights.reshape((2 * radius + 1,) * spins.ndim)
+            win, norm = coupling.kernel_sum(spins, kernel), coupling.kernel_sum(np.ones(spins.shape), kernel)
+        nbr = _fields(spins, coords, None, None)[0]
+        index = tuple(x.T)
+        return nbr, win[index].astype(np.float64), norm[index].astype(np.float64)
+    if len(x) > chunk:
+        parts = [_fields(spins, coords[i:i + chunk], offsets, weights, chunk)
+                 for i in range(0, len(coords), chunk)]
+        return tuple(np.concatenate(field) for field in zip(*parts))
+    nbr = np.zeros(len(x), dtype=np.int64)
+    for axis in range(spins.ndim):
+        for offset in (-1, 1):
+            x[:, axis] += offset
+            nbr += spins[tuple(x.T)]
+            x[:, axis] -= offset
+    if offsets is None:
+        return nbr, np.zeros(len(x)), np.ones(len(x))
+    # Windows clear of the lattice edge are one flat offset pattern; the
+    # others are clipped and masked
+    size = np.array(spins.shape)
+    radius = int(offsets.max())
+    strides = np.array([int(np.prod(spins.shape[axis + 1:])) for axis in range(spins.ndim)])
+    block = np.empty((len(x), len(offsets)), dtype=spins.dtype)
+    inside = np.ones(block.shape, dtype=bool)
+    edge = ((x < radius) | (x >= size - radius)).any(axis=1)
+    clear = np.flatnonzero(~edge)
+    block[clear] = spins.take((x[clear] @ strides)[:, None] + offsets @ strides)
+    if edge.any():
+        window = x[edge, None, :] + offsets
+        inside[edge] = ((window >= 0) & (window < size)).all(axis=-1)
+        block[edge] = spins.take(np.clip(window, 0, size - 1) @ strides) * inside[edge]
+    if weights is None:
+        return nbr, block.sum(axis=1, dtype=np.int64).astype(np.float64), inside.sum(axis=1).astype(np.float64)
+    return nbr, block @ weights, inside @ weights
+
+
+# Rate table: `rates` padded to whole buckets of about sqrt(n), and the sum of
+# each bucket
+def _buckets(rates):
+    bucket = max(16, 1 << math.isqrt(max(len(rates), 1)).bit_length())
+    leaves = np.zeros(max(-(-len(rates) // bucket), 1) * bucket)
+    leaves[:len(rates)] = rates
+    return leaves, leaves.reshape(-1, bucket).sum(axis=1), bucket
+
+
+# Leaf whose cumulative rate interval holds u * total
+def _sample(leaves, sums, bucket, u):
+    cumulative = np.cumsum(sums)
+    target = u * cumulative[-1]
+    b = min(int(np.searchsorted(cumulative, target, side="right")), len(sums) - 1)
+    lo = cumulative[b - 1] if b else 0.0
+    rates = leaves[b * bucket:(b + 1) * bucket]
+    i = int(np.searchsorted(np.cumsum(rates), target - lo, side="right"))
+    if i == bucket or rates[i] == 0:
+        # Rounding at the top end: the last positive rate
+        return int(np.flatnonzero(leaves)[-1])
+    return b * bucket + i
+
+
+# Event loop over one step. Tracked spin k has value s[k], fields nbr[k],
+# win[k], norm[k], barrier[k] and rate rates[k]; saturated[k] marks infinite
+# rates and hot[k] the spins drawn from the table (leaves, sums), the others
+# flip through the proposals (times, picks, threshold) only. slot maps flat
+# interior indices (`shape`) to tracked spins; nbr_stamp and win_stamp give the
+# change of a tracked spin's fields when the spin at offset `offsets` from it
+# flips. Updates the arrays in place and returns the number of flips.
+# spin_jit._kmc_kernel is the compiled version of this loop.
+def _events(rng, dt, times, picks, threshold, s, nbr, win, norm, barrier, hot, rates, saturated,
+            coords, slot, shape, offsets, nbr_stamp, win_stamp, leaves, sums, bucket, cs, lcs, kT):
+    ndim = len(shape)
+    reach = int(offsets.max())
+    slot = slot.reshape(tuple(shape))
+    nbr_stamp = nbr_stamp.reshape((2 * reach + 1,) * ndim)
+    win_stamp = win_stamp.reshape((2 * reach + 1,) * ndim)
+    n, times, picks, threshold = len(times), times.tolist(), picks.tolist(), threshold.tolist()
+    n_sat = int(saturated.sum())
+
+    t, flips, i = 0.0, 0, 0
+    total = float(sums.sum())
+    t_hot = t + rng.standard_exponential() / total if total > 0 else math.inf
+    while True:
+        if n_sat:
+            k = int(np.flatnonzero(saturated)[min(int(rng.random() * n_sat), n_sat - 1)])
+        else:
+            t_cold = times[i] if i < n else math.inf
+            if min(t_cold, t_hot) > dt:
+                break
+            if t_cold <= t_hot:
+                k, i = picks[i], i + 1
+                # Flipped spins keep rate 0
+                if not threshold[i - 1] < rates[k]:
+                    continue
+                t = t_cold
+            else:
+                t = t_hot
+                k = _sample(leaves, sums, bucket, rng.random())
+
+        inner = coords[k].tolist()
+        delta = 1 - 2 * int(s[k])
+        s[k] = 1 - s[k]
+        flips += 1
+        slot[tuple(inner)] = -1
+        rates[k] = 0
+        n_sat -= bool(saturated[k])
+        saturated[k] = False
+
+        # Patch the fields and rates of the tracked spins within coupling range
+        window, stamp = [], []
+        for c, size in zip(inner, shape):
+            lo, hi = max(c - reach, 0), min(c + reach + 1, size)
+            window.append(slice(lo, hi))
+            stamp.append(slice(lo - c + reach, hi - c + reach))
+        near = slot[tuple(window)]
+        found = near >= 0
+        near = near[found]
+        nbr[near] += delta * nbr_stamp[tuple(stamp)][found]
+        win[near] += delta * win_stamp[tuple(stamp)][found]
+        rates[near] = _rates(s[near], nbr[near], win[near], norm[near], barrier[near], cs, lcs, kT, ndim)
+        n_sat -= int(saturated[near].sum())
+        saturated[near] = np.isinf(rates[near])
+        n_sat += int(saturated[near].sum())
+        near = np.append(near, k)
+        leaves[near] = np.where(hot[near] & ~saturated[near], rates[near], 0)
+        sums[near // bucket] = leaves.reshape(-1, bucket)[near // bucket].sum(axis=1)
+        total = float(sums.sum())
+        t_hot = t + rng.standard_exponential() / total if total > 0 else math.inf
+    return flips
+
+
+# Flips over a step of length dt; returns their number. `events` replaces the
+# event loop (spin_jit passes its compiled one).
+def kmc_flips(spins, barrier, rng, params, dt=1.0, events=None):
+    shape, ndim = barrier.shape, spins.ndim
+    cs, lcs, kT = params["coupling_strength"], params["long_range_coupling_strength"], params["kT"]
+    bound = _event_rate(np.exp(-np.maximum(barrier - max(cs, 0) - max(lcs, 0), 0) / kT)).ravel()
+    offsets, weights, radius, reach = None, None, 0, 1
+    if lcs:
+        radius = int(params["long_range_radius"])
+        reach = max(radius, 1)
+        offsets = _window_offsets(radius, ndim)
+        if params["long_range_kernel"] != "box":
+            weights = coupling.make_kernel(params["long_range_kernel"], radius, ndim,
+                                           params["long_range_sigma"]).ravel()
+
+    # Cold proposals for the whole step
+    hot = bound * dt > HOT_EVENTS
+    cold = np.where(hot, 0, bound)
+    cumulative = np.cumsum(cold)
+    n = rng.poisson(cumulative[-1] * dt) if cumulative.size else 0
+    times = np.sort(rng.random(n)) * dt
+    picks = np.searchsorted(cumulative, rng.random(n) * cumulative[-1], side="right")
+    if n:
+        # Rounding at the top end: the last positive bound
+        picks = np.minimum(picks, np.flatnonzero(cold)[-1])
+    threshold = rng.random(n) * cold[picks]
+
+    # Tracked spins: hot and proposed ones
+    tracked = np.union1d(np.flatnonzero(hot), picks)
+    slot = np.full(bound.size, -1, dtype=np.int64)
+    slot[tracked] = np.arange(tracked.size)
+    coords = np.stack(np.unravel_index(tracked, shape), axis=1)
+    s = spins[tuple(coords.T + 1)].astype(np.float64)
+    nbr, win, norm = _fields(spins, coords, offsets, weights)
+    tracked_barrier = barrier.ravel()[tracked].astype(np.float64)
+    tracked_hot = hot[tracked]
+    rates = _rates(s, nbr, win, norm, tracked_barrier, cs, lcs, kT, ndim)
+    saturated = np.isinf(rates)
+    leaves, sums, bucket = _buckets(np.where(tracked_hot & ~saturated, rates, 0))
+
+    # Field changes at offsets within `reach` of a flipped spin
+    offsets = _window_offsets(reach, ndim)
+    span = np.abs(offsets)
+    nbr_stamp = (span.sum(axis=1) == 1).astype(np.int64)
+    win_stamp = np.zeros(len(offsets))
+    if lcs:
+        win_stamp[span.max(axis=1) <= radius] = 1 if weights is None else weights
+
+    events = _events if events is None else events
+    flips = events(rng, float(dt), times, slot[picks], threshold, s, nbr, win, norm, tracked_barrier,
+                   tracked_hot, rates, saturated, coords, slot, np.array(shape), offsets, nbr_stamp,
+                   win_stamp, leaves, sums, bucket, float(cs), float(lcs), float(kT))
+    spins[tuple(coords.T + 1)] = s
+    return int(flips)
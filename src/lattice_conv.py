@@ -0,0 +1,146 @@
+import copy
+
+import torch
+
+# Dense-stencil counterparts of GCNConv and NNConv for lattice graphs.
+#
+# Node features are held as a grid tensor (*shape, C) in the voxel order of
+# lattice_graph (to_grid / from_grid convert from and to the (N, C) layout).
+# Message passing over the 2*ndim lattice neighbours becomes sums of shifted
+# slices of that tensor, with no edge_index and no scatter. Boundary voxels
+# simply have fewer neighbours, so degrees and means match the sparse layers on
+# the lattice graph node for node, up to floating-point summation order.
+#
+#   LatticeGCNConv  D^-1/2 (A + I) D^-1/2 X W + b, as GCNConv with its default
+#                   self-loops and symmetric normalisation
+#   LatticeNNConv   NNConv: root(x_i) + aggr_j x_j Theta(e_ij) + b, aggr "mean"
+#                   or "add"; edge features default to |V_i - V_j| from input
+#                   channel 0 (data_utils.voltage_gradient_edge_attr)
+#
+# from_sparse() wraps the parameters of an existing layer, and to_lattice()
+# turns a trained GCN or MPNN model into one that takes the grid tensor.
+
+
+def to_grid(x, shape):
+    return x.reshape(*shape, x.shape[-1])
+
+
+def from_grid(x):
+    return x.reshape(-1, x.shape[-1])
+
+
+def _axis_slices(ndim, axis, lo, hi):
+    index = [slice(None)] * (ndim + 1)
+    index[axis] = slice(lo, hi)
+    return tuple(index)
+
+
+# (source, target) index pairs for every lattice direction: target voxels
+# receive from the neighbour at -1, then +1, along each axis
+def _directions(ndim):
+    for axis in range(ndim):
+        yield _axis_slices(ndim, axis, None, -1), _axis_slices(ndim, axis, 1, None)
+        yield _axis_slices(ndim, axis, 1, None), _axis_slices(ndim, axis, None, -1)
+
+
+# Sum over the lattice neighbours of every voxel: shifted slices of a copy
+# zero-padded by one voxel on each side
+def neighbor_sum(g):
+    ndim = g.dim() - 1
+    padded = g.new_zeros(*(n + 2 for n in g.shape[:-1]), g.shape[-1])
+    padded[(slice(1, -1),) * ndim] = g
+    out = None
+    for axis in range(ndim):
+        for lo in (0, 2):
+            index = [slice(1, -1)] * ndim
+            index[axis] = slice(lo, lo + g.shape[axis])
+            term = padded[tuple(index)]
+            out = term if out is None else out + term
+    return out
+
+
+# Number of lattice neighbours of every voxel as a (*shape, 1) tensor
+def lattice_degree(shape, device=None, dtype=torch.float32):
+    return neighbor_sum(torch.ones(*shape, 1, device=device, dtype=dtype))
+
+
+class LatticeGCNConv(torch.nn.Module):
+    def __init__(self, in_channels, out_channels, bias=True):
+        super().__init__()
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.lin = torch.nn.Linear(in_channels, out_channels, bias=False)
+        self.bias = torch.nn.Parameter(torch.zeros(out_channels)) if bias else None
+
+    @classmethod
+    def from_sparse(cls, conv):
+        layer = cls(conv.in_channels, conv.out_channels, bias=False)
+        layer.lin = conv.lin
+        layer.bias = conv.bias
+        return layer
+
+    # edge_index is accepted for call compatibility and ignored
+    def forward(self, x, edge_index=None):
+        h = self.lin(x)
+        norm = (lattice_degree(x.shape[:-1], x.device, x.dtype) + 1) ** -0.5
+        g = h * norm
+        out = norm * (g + neighbor_sum(g))
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
+
+class LatticeNNConv(torch.nn.Module):
+    def __init__(self, in_channels, out_channels, nn, aggr="mean", root_weight=True, bias=True):
+        super().__init__()
+        if aggr not in ("mean", "add"):
+            raise ValueError(f"aggr must be 'mean' or 'add', got {aggr!r}")
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.nn = nn
+        self.aggr = aggr
+        self.lin = torch.nn.Linear(in_channels, out_channels, bias=False) if root_weight else None
+        self.bias = torch.nn.Parameter(torch.zeros(out_channels)) if bias else None
+
+    @classmethod
+    def from_sparse(cls, conv):
+        layer = cls(conv.in_channels_l, conv.out_channels, conv.nn, conv.aggr, root_weight=False, bias=False)
+        layer.lin = conv.lin if conv.root_weight else None
+        layer.bias = conv.bias
+        return layer
+
+    # edge_attr: None for |V_i - V_j| from channel 0, or a callable
+    # f(x_target, x_source) -> (..., edge_dim) evaluated per direction
+    def forward(self, x, edge_index=None, edge_attr=None):
+        ndim = x.dim() - 1
+        out = torch.zeros(*x.shape[:-1], self.out_channels, device=x.device, dtype=x.dtype)
+        for src, dst in _directions(ndim):
+            x_j, x_i = x[src], x[dst]
+            if edge_attr is None:
+                e = (x_i[..., :1] - x_j[..., :1]).abs()
+            else:
+                e = edge_attr(x_i, x_j)
+            weight = self.nn(e).view(*e.shape[:-1], self.in_channels, self.out_channels)
+            out[dst] = out[dst] + torch.matmul(x_j.unsqueeze(-2), weight).squeeze(-2)
+        if self.aggr == "mean":
+            out = out / lattice_degree(x.shape[:-1], x.device, x.dtype).clamp(min=1)
+        if self.lin is not None:
+            out = out + self.lin(x)
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
+
+# Copy of a GCN (gnn_training) or MPNN (gnn_training_mpnn) model whose GCNConv
+# and NNConv layers run as lattice stencils; it takes the (*shape, C) grid
+def to_lattice(model):
+    from torch_geometric.nn import GCNConv, NNConv
+
+    model = copy.deepcopy(model)
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, GCNConv):
+                setattr(module, name, LatticeGCNConv.from_sparse(child))
+            elif isinstance(child, NNConv):
+                setattr(module, name, LatticeNNConv.from_sparse(child))
+    return model
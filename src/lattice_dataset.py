@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+from lattice_graph import FEATURES, lattice_edge_index, node_features
+
+# On-disk dataset of many simulations on one lattice shape.
+#
+#   meta.json       shape, sample count, feature names and dtype
+#   edge_index.npy  the lattice edge_index, stored once for every sample
+#   features.bin    (samples, nodes, 3) float32 [voltage, state, spin], raw
+#   labels.bin      (samples, nodes) uint8 spin labels
+#
+# Per-sample .pt files repeat the int64 edge_index, about 8x the size of the
+# float32 features on a 3D lattice; here it is stored once. The binary files
+# are appended sample by sample and read through np.memmap, so writing or
+# loading thousands of simulations keeps memory constant and a sample is only
+# read when it is indexed. meta.json is rewritten after every append and its
+# sample count is authoritative: a partly written trailing sample is ignored.
+
+META_NAME = "meta.json"
+
+
+def _meta_path(root):
+    return os.path.join(root, META_NAME)
+
+
+def _write_meta(root, meta):
+    tmp = _meta_path(root) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, _meta_path(root))
+
+
+def load_meta(root):
+    with open(_meta_path(root)) as f:
+        return json.load(f)
+
+
+class LatticeDatasetWriter:
+    def __init__(self, root, shape, dtype=np.float32):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(_meta_path(root)):
+            self.meta = load_meta(root)
+            if tuple(self.meta["shape"]) != tuple(shape):
+                raise ValueError(f"Dataset {root} holds shape {tuple(self.meta['shape'])}, not {tuple(shape)}")
+        else:
+            self.meta = {"shape": list(shape), "num_samples": 0, "features": list(FEATURES),
+                         "dtype": np.dtype(dtype).name}
+            np.save(os.path.join(root, "edge_index.npy"), lattice_edge_index(shape))
+            _write_meta(root, self.meta)
+        self.dtype = np.dtype(self.meta["dtype"])
+        self.num_nodes = int(np.prod(shape))
+
+        # Drop any partial sample left by an interrupted append
+        n = self.meta["num_samples"]
+        self._features = self._open("features.bin", n * self.num_nodes * len(FEATURES) * self.dtype.itemsize)
+        self._labels = self._open("labels.bin", n * self.num_nodes)
+
+    def _open(self, name, size):
+        f = open(os.path.join(self.root, name), "ab")
+        f.truncate(size)
+        return f
+
+    def append(self, voltage, states, spins):
+        if voltage.size != self.num_nodes:
+            raise ValueError(f"Expected {self.num_nodes} voxels, got {voltage.size}")
+        self._features.write(node_features(voltage, states, spins, self.dtype).tobytes())
+        self._labels.write(np.ravel(spins).astype(np.uint8).tobytes())
+        self._features.flush()
+        self._labels.flush()
+        self.meta["num_samples"] += 1
+        _write_meta(self.root, self.meta)
+
+    # A torch_geometric Data object from export_pyg_data / convert_to_pyg_data
+    def append_data(self, data):
+        x = data.x.numpy()
+        self.append(x[:, 0], x[:, 1], x[:, 2])
+
+    def close(self):
+        self._features.close()
+        self._labels.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Samples as Data(x, edge_index, y). The memmaps are opened on first access in
+# each process, so the dataset pickles cheaply into DataLoader workers; every
+# sample shares the same edge_index tensor.
+class LatticeDataset(torch.utils.data.Dataset):
+    def __init__(self, root):
+        self.root = root
+        self.meta = load_meta(root)
+        self.shape = tuple(self.meta["shape"])
+        self.num_nodes = int(np.prod(self.shape))
+        self._arrays = None
+
+    def _open(self):
+        if self._arrays is None:
+            n = self.meta["num_samples"]
+            features = np.memmap(os.path.join(self.root, "features.bin"), dtype=self.meta["dtype"], mode="r",
+                                 shape=(n, self.num_nodes, len(self.meta["features"])))
+            labels = np.memmap(os.path.join(self.root, "labels.bin"), dtype=np.uint8, mode="r",
+                               shape=(n, self.num_nodes))
+            edge_index = torch.from_numpy(np.load(os.path.join(self.root, "edge_index.npy")))
+            self._arrays = features, labels, edge_index
+        return self._arrays
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_arrays"] = None
+        return state
+
+    @property
+    def edge_index(self):
+        return self._open()[2]
+
+    @property
+    def num_node_features(self):
+        return len(self.meta["features"])
+
+    def __len__(self):
+        return self.meta["num_samples"]
+
+    def __getitem__(self, index):
+        features, labels, edge_index = self._open()
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"Sample {index} out of range for {len(self)} samples")
+        x = torch.from_numpy(np.array(features[index]))
+        y = torch.from_numpy(labels[index].astype(np.int64))
+        return Data(x=x, edge_index=edge_index, y=y)
+
+
+# Pack a folder of per-run .pt files (e.g. batch_sim_runner output) into a
+# dataset, one file in memory at a time
+def convert_pt_folder(folder, root, shape):
+    with LatticeDatasetWriter(root, shape) as writer:
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(".pt"):
+                writer.append_data(torch.load(os.path.join(folder, name), weights_only=False))
+    return LatticeDataset(root)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack per-run PyG .pt files into a memory-mapped dataset")
+    parser.add_argument("folder", help="Folder with .pt files")
+    parser.add_argument("root", help="Dataset directory to create or extend")
+    parser.add_argument("--size", type=int, nargs=3, default=[30, 30, 10], help="Grid size (X Y Z)")
+    args = parser.parse_args()
+
+    dataset = convert_pt_folder(args.folder, args.root, tuple(args.size))
+    print(f"{len(dataset)} samples in {args.root}")
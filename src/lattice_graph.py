@@ -0,0 +1,112 @@
+import numpy as np
+
+from profiling import profiled
+
+# Array-native lattice graph.
+#
+# Nodes are voxels in C order, so node id = np.ravel_multi_index(voxel, shape)
+# and node (i, j, k) carries voltage[i, j, k]. Edges join voxels one step apart
+# along an axis and are listed node by node, axis by axis -- the same node order
+# and edge order networkx.grid_graph produces. The networkx graph is only built
+# on request.
+
+FEATURES = ("voltage", "state", "spin")
+
+
+# Undirected lattice edges (u < v) as a (2, E) int64 array
+def lattice_edges(shape):
+    shape = tuple(shape)
+    n = int(np.prod(shape))
+    ids = np.arange(n, dtype=np.int64)
+    strides = np.cumprod((shape[1:] + (1,))[::-1])[::-1]
+    coords = np.unravel_index(ids, shape)
+    dst = np.full((n, len(shape)), -1, dtype=np.int64)
+    for axis, (size, stride) in enumerate(zip(shape, strides)):
+        valid = coords[axis] < size - 1
+        dst[valid, axis] = ids[valid] + stride
+    src = np.repeat(ids, len(shape))
+    dst = dst.ravel()
+    keep = dst >= 0
+    return np.stack([src[keep], dst[keep]])
+
+
+# COO edge_index with both directions: all (u, v) followed by all (v, u),
+# matching convert_to_pyg_data on the networkx graph
+def lattice_edge_index(shape):
+    edges = lattice_edges(shape)
+    return np.concatenate([edges, edges[::-1]], axis=1)
+
+
+# (N, 3) node feature matrix [voltage, state, spin], filled column by column
+# from flat views of the lattice arrays without intermediate copies
+def node_features(voltage, states, spins, dtype=np.float32):
+    x = np.empty((voltage.size, len(FEATURES)), dtype=dtype)
+    for col, field in enumerate((voltage, states, spins)):
+        x[:, col] = np.ravel(field)
+    return x
+
+
+class LatticeGraph:
+    def __init__(self, voltage, states, spins):
+        self.voltage = voltage
+        self.states = states
+        self.spins = spins
+        self.shape = tuple(voltage.shape)
+        self._edge_index = None
+        self._nx = None
+
+    @property
+    def num_nodes(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def edge_index(self):
+        if self._edge_index is None:
+            self._edge_index = lattice_edge_index(self.shape)
+        return self._edge_index
+
+    def node_features(self, dtype=np.float32):
+        return node_features(self.voltage, self.states, self.spins, dtype)
+
+    def node_ids(self):
+        return np.arange(self.num_nodes).reshape(self.shape)
+
+    # Optional networkx view with the same nodes, edges and attributes
+    def to_networkx(self):
+        if self._nx is None:
+            import networkx as nx
+
+            G = nx.Graph()
+            nodes = np.ndindex(*self.shape)
+            values = zip(*(np.ravel(f).tolist() for f in (self.voltage, self.states, self.spins)))
+            G.add_nodes_from(
+                (node, dict(zip(FEATURES, vals))) for node, vals in zip(nodes, values)
+            )
+            edges = lattice_edges(self.shape)
+            coords = np.stack(np.unravel_index(edges, self.shape), axis=-1)
+            G.add_edges_from(zip(map(tuple, coords[0].tolist()), map(tuple, coords[1].tolist())))
+            self._nx = G
+        return self._nx
+
+
+# Accepts the three arrays or a lattice_state.LatticeState
+@profiled()
+def build_lattice_graph(grid, states=None, spins=None):
+    if states is None:
+        grid, states, spins = grid
+    return LatticeGraph(grid, states, spins)
+
+
+# Create 3D graph representation (networkx, node (i, j, k) = voxel [i, j, k])
+@profiled()
+def create_bioelectric_graph(grid, states, spins):
+    return LatticeGraph(grid, states, spins).to_networkx()
+
+# Export graph data for analysis
+@profiled()
+def export_graph_data(graph, filename='bioelectric_graph.gexf'):
+    import networkx as nx
+
+    if isinstance(graph, LatticeGraph):
+        graph = graph.to_networkx()
+    nx.write_gexf(graph, filename)
@@ -0,0 +1,65 @@
+import numpy as np
+
+from spin_engine import initialize_grid
+
+# Compact lattice state: voltage as float32 (or float64), cell state and spin
+# as uint8. Unpacks like the (voltage, states, spins) tuple the rest of the code
+# passes around, so it can be handed to update_grid, build_lattice_graph,
+# export functions and recorders as *lattice without widening any array.
+# pack() bit-packs the two binary fields for storage at 1 bit per voxel.
+
+BINARY_DTYPE = np.uint8
+
+
+class LatticeState:
+    def __init__(self, voltage, states, spins):
+        self.voltage = voltage
+        self.states = states
+        self.spins = spins
+
+    @classmethod
+    def initialize(cls, size, rng=None, voltage_dtype=np.float32):
+        return cls(*initialize_grid(size, rng, voltage_dtype, BINARY_DTYPE, BINARY_DTYPE))
+
+    # Compact copy of arrays from the reference (float64/int64) representation
+    @classmethod
+    def from_arrays(cls, voltage, states, spins, voltage_dtype=np.float32):
+        return cls(
+            np.asarray(voltage, dtype=voltage_dtype),
+            np.asarray(states).astype(BINARY_DTYPE),
+            np.asarray(spins).astype(BINARY_DTYPE),
+        )
+
+    @property
+    def shape(self):
+        return self.voltage.shape
+
+    @property
+    def nbytes(self):
+        return self.voltage.nbytes + self.states.nbytes + self.spins.nbytes
+
+    def __iter__(self):
+        return iter((self.voltage, self.states, self.spins))
+
+    # float64/int64 arrays as produced by the scripts
+    def widen(self):
+        return (self.voltage.astype(np.float64), self.states.astype(np.float64),
+                self.spins.astype(np.int64))
+
+    def pack(self):
+        return {
+            "shape": np.array(self.shape),
+            "voltage": self.voltage,
+            "states": np.packbits(self.states.ravel()),
+            "spins": np.packbits(self.spins.ravel()),
+        }
+
+    @classmethod
+    def unpack(cls, packed):
+        shape = tuple(int(n) for n in packed["shape"])
+        size = int(np.prod(shape))
+        return cls(
+            np.asarray(packed["voltage"]),
+            np.unpackbits(packed["states"], count=size).reshape(shape),
+            np.unpackbits(packed["spins"], count=size).reshape(shape),
+        )
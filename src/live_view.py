@@ -0,0 +1,205 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Live viewing decoupled from the simulation.
+#
+# The simulation publishes decimated frames into a FrameRing, a fixed number of
+# frame slots in shared memory. Publishing copies one small frame and never
+# waits, so stepping runs at the same speed with or without a viewer. The
+# viewer is a separate process with its own render loop: at every tick it takes
+# the newest complete frame and skips whatever was published in between, so a
+# slow renderer drops frames instead of slowing the simulation.
+#
+# Frame kinds:
+#   "slice"   one plane of a 3D field (middle of the last axis by default), or
+#             the whole field for 2D lattices
+#   "max"     maximum projection along an axis
+#   "points"  coordinates of differentiated voxels (states > 0), subsampled to
+#             at most max_points and padded with NaN
+
+FRAME_KINDS = ("slice", "max", "points")
+
+_SEQ, _CLOSED = 0, 1
+
+
+def frame_shape(shape, kind="slice", axis=-1, stride=1, max_points=4096):
+    if kind not in FRAME_KINDS:
+        raise ValueError(f"kind must be one of {FRAME_KINDS}, got {kind!r}")
+    if kind == "points":
+        return (max_points, len(shape))
+    if len(shape) > 2:
+        shape = tuple(n for i, n in enumerate(shape) if i != axis % len(shape))
+    return tuple(-(-n // stride) for n in shape)
+
+
+def make_frame(voltage, states=None, kind="slice", axis=-1, index=None, stride=1, max_points=4096):
+    if kind == "points":
+        coords = np.argwhere(np.asarray(states) > 0)
+        if len(coords) > max_points:
+            coords = coords[:: -(-len(coords) // max_points)]
+        frame = np.full((max_points, voltage.ndim), np.nan, dtype=np.float32)
+        frame[: len(coords)] = coords
+        return frame
+    if voltage.ndim > 2:
+        if kind == "max":
+            voltage = voltage.max(axis=axis)
+        else:
+            index = voltage.shape[axis] // 2 if index is None else index
+            voltage = np.take(voltage, index, axis=axis)
+    return np.asarray(voltage[(slice(None, None, stride),) * voltage.ndim], dtype=np.float32)
+
+
+# Ring of `slots` float32 frames in shared memory. The header holds the number
+# of frames written and a closed flag; every slot carries the sequence number
+# and simulation step of the frame in it. A slot's sequence number is cleared
+# while it is rewritten, so readers can detect and discard torn frames.
+class FrameRing:
+    def __init__(self, frame_shape, slots=8, name=None):
+        self.frame_shape = tuple(frame_shape)
+        self.slots = slots
+        frame_bytes = int(np.prod(self.frame_shape)) * 4
+        size = 16 + slots * 16 + slots * frame_bytes
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.header = np.ndarray((2,), dtype=np.int64, buffer=self.shm.buf)
+        self.slot_seq = np.ndarray((slots,), dtype=np.int64, buffer=self.shm.buf, offset=16)
+        self.slot_step = np.ndarray((slots,), dtype=np.int64, buffer=self.shm.buf, offset=16 + slots * 8)
+        self.frames = np.ndarray((slots,) + self.frame_shape, dtype=np.float32, buffer=self.shm.buf,
+                                 offset=16 + slots * 16)
+        if self.owner:
+            self.header[:] = 0
+            self.slot_seq[:] = -1
+        self.last_read = -1
+        self.dropped = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def closed(self):
+        return bool(self.header[_CLOSED])
+
+    # Never blocks: the oldest slot is overwritten
+    def publish(self, step, frame):
+        seq = int(self.header[_SEQ])
+        slot = seq % self.slots
+        self.slot_seq[slot] = -1
+        self.frames[slot] = frame
+        self.slot_step[slot] = step
+        self.slot_seq[slot] = seq
+        self.header[_SEQ] = seq + 1
+
+    # Newest complete frame not seen yet as (step, frame copy), or None
+    def latest(self):
+        seq = int(self.header[_SEQ]) - 1
+        if seq <= self.last_read:
+            return None
+        slot = seq % self.slots
+        frame = self.frames[slot].copy()
+        step = int(self.slot_step[slot])
+        if self.slot_seq[slot] != seq:
+            return None  # overwritten while copying; the next tick gets a newer one
+        self.dropped += seq - self.last_read - 1
+        self.last_read = seq
+        return step, frame
+
+    def mark_closed(self):
+        self.header[_CLOSED] = 1
+
+    def close(self):
+        del self.header, self.slot_seq, self.slot_step, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# Recorder (spin_engine.run calls record(step, voltage, states, spins)) that
+# publishes every `every`-th step as a decimated frame
+class FramePublisher:
+    def __init__(self, ring, kind="slice", every=1, axis=-1, index=None, stride=1):
+        self.ring = ring
+        self.kind = kind
+        self.every = every
+        self.axis = axis
+        self.index = index
+        self.stride = stride
+
+    def record(self, step, voltage, states=None, spins=None):
+        if step % self.every:
+            return
+        frame = make_frame(voltage, states, self.kind, self.axis, self.index, self.stride,
+                           self.ring.frame_shape[0])
+        self.ring.publish(step, frame)
+
+
+# Render loop of the viewer process: polls the ring at `fps` and draws the
+# newest frame. Exits when the window is closed.
+def run_viewer(name, frame_shape, slots=8, kind="slice", fps=20, vmin=0, vmax=1):
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+
+    ring = FrameRing(frame_shape, slots, name=name)
+    fig = plt.figure()
+    if kind == "points":
+        ax = fig.add_subplot(projection="3d" if frame_shape[1] == 3 else None)
+        artist = ax.scatter(*np.zeros((frame_shape[1], 0)), s=2)
+    else:
+        ax = fig.add_subplot()
+        artist = ax.imshow(np.zeros(frame_shape), cmap=plt.get_cmap("viridis"), vmin=vmin, vmax=vmax)
+
+    def animate(_):
+        latest = ring.latest()
+        if latest is not None:
+            step, frame = latest
+            if kind == "points":
+                points = frame[~np.isnan(frame[:, 0])]
+                if frame_shape[1] == 3:
+                    artist._offsets3d = tuple(points.T)
+                else:
+                    artist.set_offsets(points[:, ::-1])
+            else:
+                artist.set_array(frame)
+            ax.set_title(f"step {step}  (dropped {ring.dropped})" + ("  [done]" if ring.closed else ""))
+        return [artist]
+
+    ani = animation.FuncAnimation(fig, animate, interval=1000 / fps, cache_frame_data=False)
+    plt.show()
+    del ani
+    ring.close()
+
+
+# Ring, publisher and viewer process together. Use as a recorder:
+#     with LiveView(voltage.shape) as view:
+#         spin_engine.run(voltage, states, spins, steps, recorder=view)
+class LiveView:
+    def __init__(self, shape, kind="slice", every=1, axis=-1, index=None, stride=1, slots=8,
+                 fps=20, max_points=4096, vmin=0, vmax=1):
+        self.ring = FrameRing(frame_shape(shape, kind, axis, stride, max_points), slots)
+        self.publisher = FramePublisher(self.ring, kind, every, axis, index, stride)
+        self.process = mp.Process(
+            target=run_viewer,
+            args=(self.ring.name, self.ring.frame_shape, slots, kind, fps, vmin, vmax),
+            daemon=True,
+        )
+        self.process.start()
+
+    def record(self, step, voltage, states=None, spins=None):
+        self.publisher.record(step, voltage, states, spins)
+
+    # Keeps the last frame on screen until the window is closed when wait=True
+    def close(self, wait=True):
+        self.ring.mark_closed()
+        if wait:
+            self.process.join()
+        else:
+            self.process.terminate()
+        self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,319 @@
+import argparse
+import copy
+import json
+import os
+
+import numpy as np
+
+import diffusion
+from checkpoint import _rng_state, restore_rng
+from domain_decomposition import _slab_flips
+from profiling import count, phase
+from spin_engine import DEFAULT_PARAMS, _flip_functions, _interior, _odd_parity, _uniforms, laplacian
+
+# Out-of-core lattices: voltage, states and spins live in raw files under a
+# directory and are stepped tile by tile, so lattices larger than RAM (e.g.
+# 1024^3 at 6 bytes per voxel) run on a workstation.
+#
+#   meta.json             shape, dtypes, step count, which buffers are current
+#                         and the rng's bit-generator state after that step
+#   voltage.{0,1}.bin     voltage, double-buffered
+#   states.{0,1}.bin      cell states (uint8), double-buffered
+#   spins.{0,1,2}.bin     spins (uint8), triple-buffered (the checkerboard's
+#                         two colours both need a buffer besides the current one)
+#
+# A tile is a slab of consecutive rows along the first axis, the contiguous
+# direction of the C-order files. Each tile maps only its rows plus a halo (one
+# row of voltage, the coupling radius of spins) through np.memmap, works on
+# in-RAM copies of that size and writes its rows to the other buffer, so the
+# next tile still reads start-of-step values; the buffers swap after the step.
+# A step only ever writes buffers meta.json does not point at, and meta.json is
+# replaced atomically with the rng state, so a run killed mid-step reopens at
+# the last completed step and continues exactly as if never interrupted. (A
+# crash inside create() leaves a half-drawn lattice; delete the directory.)
+# Nothing lattice-sized is ever allocated or kept mapped, and resident memory
+# follows tile_rows rather than the lattice size.
+#
+# The per-step uniforms are drawn tile by tile, which for a Generator yields
+# the same stream as update_grid's single draw, so a step here gives exactly
+# what update_grid(mode=...) gives on the same arrays and rng for the
+# sequential (spins updated in place, in raster order), synchronous and
+# checkerboard rules. The checkerboard's second colour replays each tile's
+# uniforms from a copy of the rng taken before its draw, so the rng must be
+# copyable (a Generator). Only the explicit integrator decomposes into tiles.
+
+META_NAME = "meta.json"
+OUT_OF_CORE_MODES = ("sequential", "synchronous", "checkerboard")
+TILE_BYTES = 64 << 20
+
+
+def _write_meta(root, meta):
+    path = os.path.join(root, META_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+
+class MemmapLattice:
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, META_NAME)) as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta["shape"])
+        self.dtypes = {field: np.dtype(name) for field, name in self.meta["dtypes"].items()}
+
+    # New lattice drawn tile by tile: voltage uniform in [0, 0.1), states 0,
+    # spins 0/1 uniformly (the distribution of initialize_grid)
+    @classmethod
+    def create(cls, root, shape, rng=None, voltage_dtype=np.float32, tile_rows=None):
+        rng = np.random.default_rng() if rng is None else rng
+        lattice = cls._allocate(root, shape, voltage_dtype)
+        tile = tile_rows or lattice.default_tile_rows()
+        for lo in range(0, shape[0], tile):
+            hi = min(lo + tile, shape[0])
+            v = _uniforms(rng, (hi - lo,) + tuple(shape[1:]), voltage_dtype)
+            v *= 0.1
+            lattice._write("voltage", lo, v)
+        for lo in range(0, shape[0], tile):
+            hi = min(lo + tile, shape[0])
+            s = rng.integers(0, 2, size=(hi - lo,) + tuple(shape[1:]), dtype=np.uint8)
+            for buffer in range(3):
+                lattice._write("spins", lo, s, buffer=buffer)
+        if hasattr(rng, "bit_generator"):
+            lattice.meta["rng"] = _rng_state(rng)
+            _write_meta(root, lattice.meta)
+        return lattice
+
+    @classmethod
+    def from_arrays(cls, root, voltage, states, spins):
+        lattice = cls._allocate(root, voltage.shape, voltage.dtype)
+        lattice._write("voltage", 0, voltage)
+        for buffer in (0, 1):
+            lattice._write("states", 0, np.asarray(states).astype(np.uint8), buffer=buffer)
+        for buffer in range(3):
+            lattice._write("spins", 0, np.asarray(spins).astype(np.uint8), buffer=buffer)
+        return lattice
+
+    @classmethod
+    def _allocate(cls, root, shape, voltage_dtype):
+        os.makedirs(root, exist_ok=True)
+        dtypes = {"voltage": np.dtype(voltage_dtype).name, "states": "uint8", "spins": "uint8"}
+        meta = {"shape": list(shape), "dtypes": dtypes, "step": 0, "voltage": 0, "states": 0, "spins": 0}
+        size = int(np.prod(shape))
+        for name, dtype in (("voltage.0", dtypes["voltage"]), ("voltage.1", dtypes["voltage"]),
+                            ("states.0", "uint8"), ("states.1", "uint8"),
+                            ("spins.0", "uint8"), ("spins.1", "uint8"), ("spins.2", "uint8")):
+            with open(os.path.join(root, name + ".bin"), "wb") as f:
+                f.truncate(size * np.dtype(dtype).itemsize)
+        _write_meta(root, meta)
+        return cls(root)
+
+    @property
+    def step_count(self):
+        return self.meta["step"]
+
+    def default_tile_rows(self):
+        row = int(np.prod(self.shape[1:]))
+        return max(1, TILE_BYTES // (32 * row))
+
+    def _path(self, field, buffer=None):
+        buffer = self.meta[field] if buffer is None else buffer
+        return os.path.join(self.root, f"{field}.{buffer}.bin")
+
+    def _map(self, field, lo, hi, mode="r", buffer=None):
+        dtype = self.dtypes[field]
+        row = int(np.prod(self.shape[1:]))
+        return np.memmap(self._path(field, buffer), dtype=dtype, mode=mode, offset=lo * row * dtype.itemsize,
+                         shape=(hi - lo,) + self.shape[1:])
+
+    # Rows [lo, hi) of a field as an in-RAM array; the mapping is dropped again
+    def _read(self, field, lo, hi, buffer=None):
+        rows = self._map(field, lo, hi, buffer=buffer)
+        out = np.array(rows)
+        del rows
+        return out
+
+    def _write(self, field, lo, data, buffer=None):
+        rows = self._map(field, lo, lo + len(data), "r+", buffer)
+        rows[...] = data
+        rows.flush()
+        del rows
+
+    # A whole field as a read-only memmap (for exporters and analysis)
+    def read(self, field):
+        return self._map(field, 0, self.shape[0])
+
+    def arrays(self):
+        return self.read("voltage"), self.read("states"), self.read("spins")
+
+    def step(self, params=None, rng=None, mode="synchronous", backend="numpy", tile_rows=None):
+        if mode not in OUT_OF_CORE_MODES:
+            raise ValueError(f"mode must be one of {OUT_OF_CORE_MODES}, got {mode!r}")
+        params = DEFAULT_PARAMS if params is None else params
+        integrator, dt = diffusion.step_settings(params)
+        if integrator != "explicit":
+            raise ValueError("MemmapLattice steps the explicit integrator only")
+        rng = np.random.default_rng() if rng is None else rng
+        tile = tile_rows or self.default_tile_rows()
+        n = self.shape[0]
+        cur_v, cur_st, cur_s = self.meta["voltage"], self.meta["states"], self.meta["spins"]
+        next_v, next_st = 1 - cur_v, 1 - cur_st
+        # The checkerboard's first colour goes to next_s, its second to last_s
+        next_s, last_s = (b for b in range(3) if b != cur_s)
+        tiles = [(lo, min(lo + tile, n - 1)) for lo in range(1, n - 1, tile)]
+
+        with phase("update_grid"):
+            # Boundary rows are copied (clipped, as update_grid does)
+            for row in (0, n - 1):
+                self._write("voltage", row, np.clip(self._read("voltage", row, row + 1, cur_v), 0, 1),
+                            buffer=next_v)
+
+            snapshots = []
+            for start, stop in tiles:
+                if mode == "checkerboard":
+                    snapshots.append(copy.deepcopy(rng))
+                with phase("rng"):
+                    u = diffusion.event_uniforms(
+                        _uniforms(rng, (stop - start,) + tuple(m - 2 for m in self.shape[1:]) + (2,),
+                                  self.dtypes["voltage"]), dt)
+                with phase("voltage"):
+                    new_voltage, barrier = self._tile_voltage(start, stop, u[..., 0], params, cur_v, cur_st,
+                                                              next_st)
+                with phase("spin_flips"):
+                    if mode == "sequential":
+                        flips = self._tile_sequential(start, stop, barrier, u[..., 1], params, backend, cur_s,
+                                                      next_s)
+                    else:
+                        color = 0 if mode == "checkerboard" else None
+                        flips = self._tile_flips(start, stop, barrier, u[..., 1], params, color, cur_s, next_s)
+                    count("spins_flipped", flips)
+                # The checkerboard's second colour still needs the unclipped voltage
+                if mode != "checkerboard":
+                    np.clip(new_voltage, 0, 1, out=new_voltage)
+                self._write("voltage", start, new_voltage, buffer=next_v)
+
+            # Second colour: from the first colour's spins into the third buffer
+            for (start, stop), replay in zip(tiles if mode == "checkerboard" else (), snapshots):
+                u = diffusion.event_uniforms(
+                    _uniforms(replay, (stop - start,) + tuple(m - 2 for m in self.shape[1:]) + (2,),
+                              self.dtypes["voltage"]), dt)
+                new_voltage = self._read("voltage", start, stop, next_v)
+                barrier = np.abs(0.5 - new_voltage[(slice(None),) + _interior(len(self.shape) - 1)])
+                with phase("spin_flips"):
+                    count("spins_flipped", self._tile_flips(start, stop, barrier, u[..., 1], params, 1,
+                                                            next_s, last_s))
+                np.clip(new_voltage, 0, 1, out=new_voltage)
+                self._write("voltage", start, new_voltage, buffer=next_v)
+            if mode == "checkerboard":
+                next_s = last_s
+
+        self.meta.update(step=self.meta["step"] + 1, voltage=next_v, states=next_st, spins=next_s)
+        if hasattr(rng, "bit_generator"):
+            self.meta["rng"] = _rng_state(rng)
+        _write_meta(self.root, self.meta)
+
+    # New voltage rows [start, stop) (unclipped, full width) and their barrier;
+    # the states of those rows are read from buffer `src` and written to `dst`
+    def _tile_voltage(self, start, stop, u_stimulus, params, buffer, src, dst):
+        block = self._read("voltage", start - 1, stop + 1, buffer)
+        inner = (slice(None),) + _interior(block.ndim - 1)
+        new_voltage = block[1:-1].copy()
+        v = block[1:-1][inner]
+        nv = new_voltage[inner]
+        with phase("laplacian"):
+            tendency = laplacian(block)
+        tendency *= params["diffusion_rate"]
+        tendency -= params["decay_rate"] * v
+        nv += diffusion.increment(tendency, params)
+        nv[u_stimulus < params["stimulus_prob"]] += params["stimulus_strength"]
+
+        threshold = params["threshold_potential"]
+        high = nv > threshold
+        low = (nv < threshold / 2) & ~high
+        states = self._read("states", start, stop, src)
+        st = states[inner]
+        st[high] = 1
+        st[low] = 0
+        self._write("states", start, states, buffer=dst)
+        return new_voltage, np.abs(0.5 - nv)
+
+    def _halo(self, params):
+        if params["long_range_coupling_strength"]:
+            return max(int(params["long_range_radius"]), 1)
+        return 1
+
+    # Synchronous (or one checkerboard colour's) flips of rows [start, stop),
+    # read from buffer `src` and written to buffer `dst`
+    def _tile_flips(self, start, stop, barrier, u_flip, params, color, src, dst):
+        halo = self._halo(params)
+        lo, hi = max(start - halo, 0), min(stop + halo, self.shape[0])
+        block = self._read("spins", lo, hi, src)
+        flip = _slab_flips(block, start - lo, stop - lo, barrier, u_flip, params)
+        if color is not None:
+            # Same colouring as spin_engine._checkerboard_flips on the full interior
+            odd = _odd_parity(barrier.shape, start - 1 + len(self.shape))
+            flip &= odd if color else ~odd
+        rows = block[start - lo:stop - lo]
+        s = rows[(slice(None),) + _interior(block.ndim - 1)]
+        s[flip] = 1 - s[flip]
+        self._write("spins", start, rows, buffer=dst)
+        return int(flip.sum())
+
+    # Raster-order flips of rows [start, stop) from buffer `src` into `dst`:
+    # the halo rows before the tile come from `dst` (this step's spins) and
+    # the rest from `src` (the previous step's), as in the full-lattice sweep.
+    # Halo rows get uniforms that never flip.
+    def _tile_sequential(self, start, stop, barrier, u_flip, params, backend, src, dst):
+        halo = self._halo(params) + 1
+        lo, hi = max(start - halo, 0), min(stop + halo, self.shape[0])
+        block = np.concatenate([self._read("spins", lo, start, dst), self._read("spins", start, hi, src)])
+        inner_shape = (hi - lo - 2,) + barrier.shape[1:]
+        rows = slice(start - lo - 1, stop - lo - 1)
+        block_barrier = np.ones(inner_shape, dtype=barrier.dtype)
+        block_u = np.full(inner_shape, 2.0, dtype=u_flip.dtype)
+        block_barrier[rows] = barrier
+        block_u[rows] = u_flip
+        flips = _flip_functions(backend, params, len(self.shape))["sequential"](block, block_barrier, block_u, params)
+        self._write("spins", start, block[start - lo:stop - lo], buffer=dst)
+        return flips
+
+    def run(self, steps, params=None, rng=None, mode="synchronous", backend="numpy", tile_rows=None,
+            recorder=None):
+        rng = np.random.default_rng() if rng is None else rng
+        for _ in range(steps):
+            self.step(params, rng, mode, backend, tile_rows)
+            if recorder is not None:
+                recorder.record(self.step_count, *self.arrays())
+        return self
+
+
+# SimulationConfig run on disk under `root`; an existing lattice is continued
+# from its last completed step with the rng state saved there
+def simulate_out_of_core(config, root, tile_rows=None, rng=None, recorder=None):
+    if os.path.exists(os.path.join(root, META_NAME)):
+        lattice = MemmapLattice(root)
+        if rng is None:
+            rng = restore_rng(lattice.meta["rng"]) if "rng" in lattice.meta else config.rng()
+    else:
+        rng = config.rng() if rng is None else rng
+        voltage_dtype = np.float32 if config.compact else np.float64
+        lattice = MemmapLattice.create(root, config.grid_size, rng, voltage_dtype, tile_rows)
+    return lattice.run(config.steps - lattice.step_count, config.params, rng, config.mode, config.backend,
+                       tile_rows, recorder)
+
+
+if __name__ == "__main__":
+    from entangled_spin_grid import SimulationConfig
+
+    parser = argparse.ArgumentParser(description="Run a spin simulation on a memory-mapped lattice")
+    parser.add_argument("root", help="Lattice directory (created if missing, continued otherwise)")
+    parser.add_argument("--size", type=int, nargs=3, default=[1024, 1024, 1024], help="Grid size (X Y Z)")
+    parser.add_argument("--steps", type=int, default=10, help="Total number of time steps")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument("--mode", choices=OUT_OF_CORE_MODES, default="synchronous")
+    parser.add_argument("--tile-rows", type=int, default=None, help="Rows per tile (default about 64 MB)")
+    args = parser.parse_args()
+
+    config = SimulationConfig(tuple(args.size), args.steps, args.seed, args.mode, compact=True)
+    lattice = simulate_out_of_core(config, args.root, args.tile_rows)
+    print(f"{lattice.step_count} steps of a {lattice.shape} lattice in {args.root}")
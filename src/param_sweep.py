@@ -0,0 +1,218 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import math
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from entangled_spin_grid import SimulationConfig, simulate
+from spin_engine import MODES, make_params
+from track_temporal_stats import lattice_stats
+
+SWEEPABLE = (
+    "diffusion_rate",
+    "decay_rate",
+    "kT",
+    "coupling_strength",
+    "long_range_coupling_strength",
+    "long_range_radius",
+    "threshold_potential",
+)
+INTEGER_PARAMS = ("long_range_radius",)
+METRICS = ("avg_voltage", "spin_ratio", "differentiated")
+# Run settings stored with every row; only rows matching the current ones are reused
+RUN_COLUMNS = ("grid_size", "steps", "mode", "root_seed")
+TEXT_COLUMNS = ("param_hash", "grid_size", "mode")
+
+
+def _check_names(names):
+    unknown = set(names) - set(SWEEPABLE)
+    if unknown:
+        raise KeyError(f"Cannot sweep {sorted(unknown)}; choose from {SWEEPABLE}")
+
+
+def _cast(name, value):
+    return int(round(value)) if name in INTEGER_PARAMS else float(value)
+
+
+# Full factorial grid: {"kT": [0.02, 0.05], "coupling_strength": [0.1, 0.2]}
+def grid_points(spec):
+    _check_names(spec)
+    names = sorted(spec)
+    return [
+        {name: _cast(name, value) for name, value in zip(names, values)}
+        for values in itertools.product(*(spec[name] for name in names))
+    ]
+
+
+# Latin hypercube over {"kT": [lo, hi], ...}: one sample per stratum on every axis
+def latin_hypercube_points(ranges, samples, seed=0):
+    _check_names(ranges)
+    rng = np.random.default_rng(seed)
+    names = sorted(ranges)
+    points = [{} for _ in range(samples)]
+    for name in names:
+        lo, hi = ranges[name]
+        strata = (rng.permutation(samples) + rng.random(samples)) / samples
+        for point, u in zip(points, strata):
+            point[name] = _cast(name, lo + u * (hi - lo))
+    return points
+
+
+def points_from_spec(spec):
+    if "grid" in spec:
+        return grid_points(spec["grid"])
+    if "lhs" in spec:
+        lhs = spec["lhs"]
+        return latin_hypercube_points(lhs["ranges"], lhs["samples"], lhs.get("seed", 0))
+    raise ValueError("Sweep spec needs a 'grid' or 'lhs' section")
+
+
+# Stable short key for a parameter point (full parameter set, defaults included)
+def param_hash(point):
+    params = make_params(**point)
+    blob = json.dumps(params, sort_keys=True).encode()
+    return hashlib.sha1(blob).hexdigest()[:12]
+
+
+# Seed stream for (point, seed index), independent of sweep order and size
+def seed_sequence(root_seed, point_hash, seed_index):
+    return np.random.SeedSequence(root_seed, spawn_key=(int(point_hash, 16), seed_index))
+
+
+def run_point(point, seed_seq, grid_size, steps, mode="sequential"):
+    config = SimulationConfig(grid_size, steps, mode=mode, params=point)
+    rng = np.random.Generator(np.random.PCG64(seed_seq))
+    voltage, states, spins = simulate(config, rng)
+    stats = lattice_stats(voltage, states, spins)
+    stats["avg_voltage"] = stats["voltage_mean"]
+    return {name: float(stats[name]) for name in METRICS}
+
+
+# Half-width of the normal-approximation confidence interval of the mean
+def ci_halfwidth(values, z=1.96):
+    n = len(values)
+    if n < 2:
+        return math.inf
+    return z * float(np.std(values, ddof=1)) / math.sqrt(n)
+
+
+def load_results(filename):
+    columns = {}
+    if not os.path.exists(filename):
+        return columns
+    with open(filename, newline="") as f:
+        for row in csv.DictReader(f):
+            for key, value in row.items():
+                columns.setdefault(key, []).append(value)
+    for key, values in columns.items():
+        if key not in TEXT_COLUMNS:
+            columns[key] = np.array(values, dtype=float)
+    return columns
+
+
+# Schedule (point, seed) jobs over a process pool and stream one row per run
+# into a CSV results table keyed by param_hash, with the run settings
+# (RUN_COLUMNS) and one column per sweepable parameter (defaults filled in) and
+# per metric. Each point gets min_seeds runs; after that more seeds are queued
+# only while the CI half-width of `metric` exceeds `tol`, up to max_seeds. Rows
+# already in the table with the same run settings are reused, so an interrupted
+# sweep picks up where it stopped; rows of other settings are left alone.
+def run_sweep(points, results="sweep_results.csv", grid_size=(30, 30, 10), steps=100,
+              min_seeds=3, max_seeds=20, metric="spin_ratio", tol=0.01,
+              root_seed=0, workers=None, mode="sequential"):
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {METRICS}, got {metric!r}")
+    fieldnames = ["param_hash", "seed_index"] + list(RUN_COLUMNS) + list(SWEEPABLE) + list(METRICS)
+    settings = {"grid_size": "x".join(str(int(n)) for n in grid_size), "steps": int(steps), "mode": mode,
+                "root_seed": int(root_seed)}
+
+    existing = load_results(results)
+    if existing and sorted(existing) != sorted(fieldnames):
+        raise ValueError(f"{results} has columns {sorted(existing)}, not those of this sweep; "
+                         "write to a new results table")
+    samples = {param_hash(point): [] for point in points}
+    done = set()
+    for i, h in enumerate(existing.get("param_hash", [])):
+        if any(existing[name][i] != value for name, value in settings.items()):
+            continue
+        done.add((h, int(existing["seed_index"][i])))
+        if h in samples:
+            samples[h].append(existing[metric][i])
+
+    def converged(h):
+        n = len(samples[h])
+        return n >= max_seeds or (n >= min_seeds and ci_halfwidth(samples[h]) <= tol)
+
+    # Next seed index per point, skipping ones already in the table
+    next_seed = {h: 0 for h in samples}
+
+    def next_seed_index(h):
+        while (h, next_seed[h]) in done:
+            next_seed[h] += 1
+        seed_index = next_seed[h]
+        next_seed[h] += 1
+        return seed_index
+
+    new_file = not os.path.exists(results)
+    with open(results, "a", newline="") as f, ProcessPoolExecutor(max_workers=workers) as pool:
+        writer = csv.DictWriter(f, fieldnames)
+        if new_file:
+            writer.writeheader()
+
+        running = {}
+
+        def submit(point, h):
+            seed_index = next_seed_index(h)
+            seq = seed_sequence(root_seed, h, seed_index)
+            future = pool.submit(run_point, point, seq, grid_size, steps, mode)
+            running[future] = (point, h, seed_index)
+
+        for point in points:
+            h = param_hash(point)
+            if converged(h):
+                continue
+            for _ in range(max(min_seeds - len(samples[h]), 1)):
+                submit(point, h)
+
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                point, h, seed_index = running.pop(future)
+                row = future.result()
+                samples[h].append(row[metric])
+                params = make_params(**point)
+                writer.writerow({"param_hash": h, "seed_index": seed_index, **settings,
+                                 **{name: params[name] for name in SWEEPABLE}, **row})
+                f.flush()
+                pending = sum(1 for _, ph, _ in running.values() if ph == h)
+                if not converged(h) and len(samples[h]) + pending < max_seeds:
+                    submit(point, h)
+
+    return load_results(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep spin simulation parameters")
+    parser.add_argument("spec", type=str, help="JSON file with a 'grid' or 'lhs' section")
+    parser.add_argument("--results", type=str, default="sweep_results.csv", help="Results table")
+    parser.add_argument("--size", type=int, nargs=3, default=[30, 30, 10], help="Grid size (X Y Z)")
+    parser.add_argument("--steps", type=int, default=100, help="Number of time steps")
+    parser.add_argument("--min-seeds", type=int, default=3, help="Seeds per point before early stopping")
+    parser.add_argument("--max-seeds", type=int, default=20, help="Maximum seeds per point")
+    parser.add_argument("--metric", choices=METRICS, default="spin_ratio", help="Metric for early stopping")
+    parser.add_argument("--tol", type=float, default=0.01, help="Target 95%% CI half-width")
+    parser.add_argument("--seed", type=int, default=0, help="Root seed")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--mode", choices=MODES, default="sequential",
+                        help="Spin update rule (see spin_engine.update_grid)")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        sweep_points = points_from_spec(json.load(f))
+    run_sweep(sweep_points, args.results, tuple(args.size), args.steps, args.min_seeds,
+              args.max_seeds, args.metric, args.tol, args.seed, args.workers, args.mode)
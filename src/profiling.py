@@ -0,0 +1,181 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Per-phase timing for the simulation loop and the export pipeline.
+#
+# Code marks phases with `with phase("name"):` or the @profiled decorator and
+# reports counters with count(). While no RunMetrics is enabled these return a
+# shared no-op object after one global check, so instrumented code runs at full
+# speed. Inside `with profile() as metrics:` every phase records wall time and,
+# with track_allocations=True, the net traced-memory change (tracemalloc, which
+# itself slows allocation-heavy code). Phases nest; the Chrome trace shows them
+# as stacked slices.
+#
+#     with profiling.profile() as metrics:
+#         run(...)
+#     print(metrics.summary())
+#     metrics.write_chrome_trace("trace.json")  # chrome://tracing or ui.perfetto.dev
+
+_metrics = None
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ("metrics", "name", "start", "memory")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.memory = tracemalloc.get_traced_memory()[0] if self.metrics.track_allocations else 0
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        alloc = tracemalloc.get_traced_memory()[0] - self.memory if self.metrics.track_allocations else 0
+        self.metrics.add(self.name, self.start, end - self.start, alloc)
+        return False
+
+
+class RunMetrics:
+    def __init__(self, track_allocations=False, max_events=1_000_000):
+        self.track_allocations = track_allocations
+        self.max_events = max_events
+        self.events = []
+        self.totals = {}
+        self.counters = {}
+        self.origin = time.perf_counter_ns()
+
+    # One finished phase: start and duration in ns, net allocated bytes
+    def add(self, name, start, duration, alloc=0):
+        total = self.totals.get(name)
+        if total is None:
+            total = self.totals[name] = [0, 0, 0]
+        total[0] += 1
+        total[1] += duration
+        total[2] += alloc
+        if len(self.events) < self.max_events:
+            self.events.append((name, start, duration, alloc, threading.get_ident()))
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        return {
+            "phases": {
+                name: {"calls": calls, "seconds": ns / 1e9, "alloc_bytes": alloc}
+                for name, (calls, ns, alloc) in self.totals.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    # Plain-text table, slowest phase first. Nested phases are included in
+    # their parent's time, so the share column can add up to more than 100%.
+    def summary(self):
+        wall = max((start + duration for _, start, duration, _, _ in self.events), default=self.origin)
+        wall = max(wall - self.origin, 1)
+        lines = [f"{'phase':<28} {'calls':>8} {'total s':>10} {'mean ms':>10} {'share':>7}"
+                 + (f" {'alloc MiB':>10}" if self.track_allocations else "")]
+        for name, (calls, ns, alloc) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            line = f"{name:<28} {calls:>8} {ns / 1e9:>10.3f} {ns / calls / 1e6:>10.3f} {ns / wall:>7.1%}"
+            if self.track_allocations:
+                line += f" {alloc / 2**20:>10.2f}"
+            lines.append(line)
+        for name, value in self.counters.items():
+            lines.append(f"{name:<28} {value:>8}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) / 1e3,
+                "dur": duration / 1e3,
+                "pid": pid,
+                "tid": tid,
+                "args": {"alloc_bytes": alloc} if self.track_allocations else {},
+            }
+            for name, start, duration, alloc, tid in self.events
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.to_dict()}
+
+    def write_chrome_trace(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        os.replace(tmp, path)
+
+
+def phase(name):
+    metrics = _metrics
+    if metrics is None:
+        return _NULL_PHASE
+    return _Phase(metrics, name)
+
+
+def count(name, n=1):
+    if _metrics is not None:
+        _metrics.count(name, n)
+
+
+def profiled(name=None):
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _metrics is None:
+                return fn(*args, **kwargs)
+            with _Phase(_metrics, label):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def enable(metrics=None, track_allocations=False):
+    global _metrics
+    _metrics = RunMetrics(track_allocations) if metrics is None else metrics
+    if _metrics.track_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _metrics
+
+
+def disable():
+    global _metrics
+    metrics, _metrics = _metrics, None
+    if metrics is not None and metrics.track_allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return metrics
+
+
+@contextmanager
+def profile(track_allocations=False):
+    previous = _metrics
+    metrics = enable(track_allocations=track_allocations)
+    try:
+        yield metrics
+    finally:
+        disable()
+        if previous is not None:
+            enable(previous)
@@ -1,19 +1,105 @@
 import argparse
-from entangled_spin_grid import initialize_grid, update_grid, create_bioelectric_graph, export_graph_data
+import os
 
-def run_sim(grid_size, steps, output):
-    voltage, states, spins = initialize_grid(grid_size)
-    for _ in range(steps):
-        voltage, states, spins = update_grid(voltage, states, spins)
-    graph = create_bioelectric_graph(voltage, states, spins)
-    export_graph_data(graph, output)
+import profiling
+from diffusion import INTEGRATORS
+from checkpoint import CheckpointRecorder, load_checkpoint, save_checkpoint
+from entangled_spin_grid import SimulationConfig, export, initial_lattice, simulate
+from spin_engine import MODES
+
+def run_sim(grid_size, steps, output, seed=None, checkpoint=None, checkpoint_every=0,
+            resume=False, params=None, mode="sequential", workers=1):
+    if workers > 1:
+        return run_decomposed_sim(grid_size, steps, output, seed, params, mode, workers, checkpoint,
+                                  checkpoint_every, resume)
+    config = SimulationConfig(grid_size, steps, seed, mode, params=params or {})
+    lattice, start = None, 0
+    if resume and checkpoint and os.path.exists(checkpoint):
+        saved = load_checkpoint(checkpoint)
+        if saved["voltage"].shape != tuple(grid_size):
+            raise ValueError(f"Checkpoint grid {saved['voltage'].shape} does not match --size {tuple(grid_size)}")
+        if isinstance(saved["rng"], list):
+            raise ValueError(f"Checkpoint was written by a run with --workers {len(saved['rng'])}; resume it the same way")
+        lattice = saved["voltage"], saved["states"], saved["spins"]
+        config.params, rng, start = saved["params"], saved["rng"], saved["step"]
+        print(f"Resuming from step {start} of {steps}")
+    else:
+        rng = config.rng()
+
+    recorder = None
+    if checkpoint and checkpoint_every:
+        recorder = CheckpointRecorder(checkpoint, checkpoint_every, config.params, rng)
+    lattice = simulate(config, rng, lattice, start, recorder)
+    export(lattice, output, fmt="graph")
+
+
+# One lattice split into slabs stepped by `workers` processes (see
+# domain_decomposition); synchronous or checkerboard updates only. Checkpoints
+# hold the lattice and every slab's rng state, so --resume continues exactly,
+# with the same number of workers.
+def run_decomposed_sim(grid_size, steps, output, seed=None, params=None, mode="synchronous",
+                       workers=2, checkpoint=None, checkpoint_every=0, resume=False):
+    from domain_decomposition import DECOMPOSED_MODES, DecomposedLattice
+
+    if mode not in DECOMPOSED_MODES:
+        raise ValueError(f"--workers > 1 needs --mode in {DECOMPOSED_MODES}, got {mode!r}")
+    config = SimulationConfig(grid_size, steps, seed, mode, params=params or {})
+    start, rng_states = 0, None
+    if resume and checkpoint and os.path.exists(checkpoint):
+        saved = load_checkpoint(checkpoint)
+        if saved["voltage"].shape != tuple(grid_size):
+            raise ValueError(f"Checkpoint grid {saved['voltage'].shape} does not match --size {tuple(grid_size)}")
+        if not isinstance(saved["rng"], list):
+            raise ValueError("Checkpoint was written by a single-process run; resume it without --workers")
+        lattice = saved["voltage"], saved["states"], saved["spins"]
+        config.params, start = saved["params"], saved["step"]
+        rng_states = [rng.bit_generator.state for rng in saved["rng"]]
+        print(f"Resuming from step {start} of {steps}")
+    else:
+        lattice = initial_lattice(config)
+
+    with DecomposedLattice(*lattice, config.params, workers, seed, mode, rng_states) as decomposed:
+        step = start
+        while step < steps:
+            chunk = steps - step
+            if checkpoint and checkpoint_every:
+                chunk = min(chunk, checkpoint_every - step % checkpoint_every)
+            decomposed.step(chunk)
+            step += chunk
+            if checkpoint and checkpoint_every and step % checkpoint_every == 0:
+                save_checkpoint(checkpoint, step, decomposed.voltage, decomposed.states, decomposed.spins,
+                                config.params, decomposed.rng_states)
+    export((decomposed.voltage, decomposed.states, decomposed.spins), output, fmt="graph")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run Bioelectric Spin Simulation")
     parser.add_argument("--size", type=int, nargs=3, default=[30, 30, 10], help="Grid size (X Y Z)")
     parser.add_argument("--steps", type=int, default=100, help="Number of time steps")
     parser.add_argument("--output", type=str, default="bioelectric_graph.gexf", help="Output file for graph data")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument("--checkpoint", type=str, default="simulation_checkpoint.npz", help="Checkpoint file")
+    parser.add_argument("--checkpoint-every", type=int, default=0, help="Steps between checkpoints (0 = never)")
+    parser.add_argument("--resume", action="store_true", help="Continue from --checkpoint if it exists")
+    parser.add_argument("--dt", type=float, default=1.0, help="Time step (larger steps need an implicit integrator)")
+    parser.add_argument("--integrator", choices=INTEGRATORS, default="explicit",
+                        help="Voltage diffusion scheme (see diffusion.py)")
+    parser.add_argument("--mode", choices=MODES, default="sequential",
+                        help="Spin update rule (see spin_engine.update_grid)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes stepping one domain-decomposed lattice "
+                             "(needs --mode synchronous or checkerboard)")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="Write a Chrome-trace JSON of the run's phases here and print a summary")
+    parser.add_argument("--profile-memory", action="store_true", help="Also record allocation deltas per phase")
     args = parser.parse_args()
+    params = {"dt": args.dt, "integrator": args.integrator}
 
-    run_sim(tuple(args.size), args.steps, args.output)
-
+    if args.profile:
+        with profiling.profile(track_allocations=args.profile_memory) as metrics:
+            run_sim(tuple(args.size), args.steps, args.output, args.seed, args.checkpoint,
+                    args.checkpoint_every, args.resume, params, args.mode, args.workers)
+        print(metrics.summary())
+        metrics.write_chrome_trace(args.profile)
+    else:
+        run_sim(tuple(args.size), args.steps, args.output, args.seed, args.checkpoint,
+                args.checkpoint_every, args.resume, params, args.mode, args.workers)
@@ -0,0 +1,349 @@
+import warnings
+
+import numpy as np
+
+import coupling
+import diffusion
+import kmc
+from profiling import count, phase, profiled
+
+# Default physical constants (same values as the spin scripts)
+DEFAULT_PARAMS = {
+    "diffusion_rate": 0.2,
+    "decay_rate": 0.05,
+    "stimulus_strength": 1.0,
+    "stimulus_prob": 0.01,
+    "threshold_potential": 0.6,
+    "kT": 0.05,
+    "coupling_strength": 0.1,
+    "long_range_coupling_strength": 0.05,
+    "long_range_radius": 3,
+    "long_range_kernel": "box",  # see coupling.KERNELS
+    "long_range_sigma": None,  # gaussian width, defaults to radius / 2
+    "dt": 1.0,  # time step; stimulus and tunneling probabilities are per unit time
+    "integrator": "explicit",  # see diffusion.INTEGRATORS
+}
+
+MODES = ("sequential", "synchronous", "checkerboard", "kmc")
+BACKENDS = ("numpy", "numba", "auto")
+
+
+def make_params(**overrides):
+    unknown = set(overrides) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise KeyError(f"Unknown simulation parameters: {sorted(unknown)}")
+    params = dict(DEFAULT_PARAMS)
+    params.update(overrides)
+    return params
+
+
+# Initialize voltage grid, cell states, and spin states. The defaults reproduce
+# the scripts (float64 voltage/states, int64 spins, same RNG draws); compact
+# dtypes (float32, uint8) are drawn and stored directly at that width.
+def initialize_grid(size, rng=None, voltage_dtype=np.float64, state_dtype=np.float64,
+                    spin_dtype=None):
+    rng = np.random if rng is None else rng
+    voltage = _uniforms(rng, size, voltage_dtype)
+    voltage *= 0.1
+    cell_state = np.zeros(size, dtype=state_dtype)  # 0 = undifferentiated, 1 = differentiated
+    if spin_dtype is None:
+        spin_state = rng.choice([0, 1], size=size)  # |0> or |1> spin state
+    elif isinstance(rng, np.random.Generator):
+        spin_state = rng.integers(0, 2, size=size, dtype=spin_dtype)
+    else:
+        spin_state = rng.randint(0, 2, size=size, dtype=spin_dtype)
+    return voltage, cell_state, spin_state
+
+
+# Uniform draws in [0, 1); Generators can draw float32 directly, which halves
+# the per-step random buffer for float32 lattices
+def _uniforms(rng, shape, dtype=np.float64):
+    if np.dtype(dtype) == np.float32 and isinstance(rng, np.random.Generator):
+        return rng.random(shape, dtype=np.float32)
+    return rng.random(shape).astype(dtype, copy=False)
+
+
+# Interior of an ndim-dimensional lattice behind `batch` leading axes
+def _interior(ndim, batch=0):
+    return (slice(None),) * batch + (slice(1, -1),) * ndim
+
+
+def _shifted(a, axis, offset, batch=0):
+    index = list(_interior(a.ndim - batch, batch))
+    index[axis] = slice(1 + offset, a.shape[axis] - 1 + offset)
+    return a[tuple(index)]
+
+
+# Nearest-neighbour Laplacian of the interior, summed in the same order as the
+# reference loop (x-, x+, y-, y+, z-, z+) so results match bit for bit.
+# Throughout this module, `batch` leading axes hold independent lattices
+# (ensemble replicas) stepped by the same operations.
+def laplacian(voltage, batch=0):
+    total = None
+    for axis in range(batch, voltage.ndim):
+        for offset in (-1, 1):
+            term = _shifted(voltage, axis, offset, batch)
+            if total is None:
+                total = term.copy()
+            else:
+                total += term
+    total -= 2 * (voltage.ndim - batch) * voltage[_interior(voltage.ndim - batch, batch)]
+    return total
+
+
+# Sum of the 2*ndim neighbour spins for every interior voxel (full-shape array,
+# boundary entries are left at zero and never read)
+@profiled("coupling.neighbors")
+def neighbor_spin_sum(spins, batch=0):
+    total = np.zeros(spins.shape, dtype=np.int8)
+    inner = total[_interior(spins.ndim - batch, batch)]
+    for axis in range(batch, spins.ndim):
+        for offset in (-1, 1):
+            inner += _shifted(spins, axis, offset, batch)
+    return total
+
+
+# Spin sum and normaliser of the long-range window around every voxel (exact
+# integer sums and voxel counts for the default box kernel). The normaliser
+# has the shape of one lattice; batched box sums run over the lattice axes at
+# once, other kernels lattice by lattice.
+@profiled("coupling.long_range")
+def window_spin_sum(spins, params, batch=0):
+    radius, kernel, sigma = params["long_range_radius"], params["long_range_kernel"], params["long_range_sigma"]
+    if not batch:
+        return coupling.long_range_field(spins, radius, kernel, sigma)
+    if kernel == "box":
+        return (coupling.box_sum(spins, radius, axes=range(batch, spins.ndim)),
+                coupling.window_count(spins.shape[batch:], radius))
+    lattices = spins.reshape((-1,) + spins.shape[batch:])
+    fields = [coupling.long_range_field(s, radius, kernel, sigma) for s in lattices]
+    return np.stack([f[0] for f in fields]).reshape(spins.shape), fields[0][1]
+
+
+# Voltage diffusion/decay (one diffusion.increment step), stochastic stimulus
+# and bistable state threshold. Returns the unclipped new voltage; states are
+# updated in place.
+def _voltage_and_states(voltage, states, u_stimulus, params, batch=0):
+    inner = _interior(voltage.ndim - batch, batch)
+    new_voltage = voltage.copy()
+    v = voltage[inner]
+    nv = new_voltage[inner]
+    with phase("laplacian"):
+        tendency = laplacian(voltage, batch)
+    tendency *= params["diffusion_rate"]
+    tendency -= params["decay_rate"] * v
+    nv += diffusion.increment(tendency, params, batch=batch)
+    stimulus = u_stimulus < params["stimulus_prob"]
+    nv[stimulus] += np.broadcast_to(params["stimulus_strength"], nv.shape)[stimulus]
+
+    threshold = params["threshold_potential"]
+    high = nv > threshold
+    low = (nv < threshold / 2) & ~high
+    st = states[inner]
+    st[high] = 1
+    st[low] = 0
+    return new_voltage
+
+
+# strength * (1 - |s - average|) computed in place in `average`
+def _coupling_term(average, s, strength):
+    average -= s
+    np.abs(average, out=average)
+    np.subtract(1, average, out=average)
+    average *= strength
+    return average
+
+
+# Tunneling probability of the spins at `inner` (the interior by default) from
+# the current configuration. Temporaries take the dtype of `barrier` and are
+# reused in place, so a float32 lattice steps without float64 lattice arrays.
+def _flip_probability(spins, barrier, params, inner=None, batch=0):
+    ndim = spins.ndim - batch
+    inner = _interior(ndim, batch) if inner is None else inner
+    s = spins[inner]
+    influence = neighbor_spin_sum(spins, batch)[inner].astype(barrier.dtype)
+    influence /= 2 * ndim
+    _coupling_term(influence, s, params["coupling_strength"])
+    if np.any(params["long_range_coupling_strength"]):
+        win_sum, win_count = window_spin_sum(spins, params, batch)
+        long_range = win_sum[inner].astype(barrier.dtype)
+        del win_sum
+        np.divide(long_range, win_count[inner[batch:]], out=long_range)
+        influence += _coupling_term(long_range, s, params["long_range_coupling_strength"])
+        del long_range
+    np.subtract(barrier, influence, out=influence)
+    np.maximum(influence, 0, out=influence)
+    influence /= -params["kT"]
+    return np.exp(influence, out=influence)
+
+
+# Flip every spin (or every spin in `mask`) from the current configuration
+def _synchronous_flips(spins, barrier, u_flip, params, mask=None, batch=0):
+    s = spins[_interior(spins.ndim - batch, batch)]
+    flip = u_flip < _flip_probability(spins, barrier, params, batch=batch)
+    if mask is not None:
+        flip &= mask
+    s[flip] = 1 - s[flip]
+    return int(flip.sum())
+
+
+# Boolean array marking the voxels of `shape` whose index sum plus `offset` is
+# odd (1 byte per voxel instead of the integer index grids of np.indices)
+def _odd_parity(shape, offset=0):
+    odd = np.full(shape, offset % 2 == 1)
+    for axis, n in enumerate(shape):
+        view = [1] * len(shape)
+        view[axis] = n
+        odd ^= (np.arange(n) % 2 == 1).reshape(view)
+    return odd
+
+
+# Red-black sweep: voxels with even i + j + k first, then odd ones, each colour
+# updated at once from the configuration left by the previous colour
+def _checkerboard_flips(spins, barrier, u_flip, params, batch=0):
+    odd = _odd_parity(barrier.shape[batch:], spins.ndim - batch)
+    return (_synchronous_flips(spins, barrier, u_flip, params, ~odd, batch)
+            + _synchronous_flips(spins, barrier, u_flip, params, odd, batch))
+
+
+# Exact raster-order sweep: each voxel sees the flips made earlier in the same
+# sweep. Only voxels whose draw could succeed at the maximum possible coupling
+# influence are visited; neighbour and window sums are patched after each flip.
+def _sequential_flips(spins, barrier, u_flip, params):
+    cs = params["coupling_strength"]
+    lcs = params["long_range_coupling_strength"]
+    radius = params["long_range_radius"]
+    kT = params["kT"]
+
+    max_influence = max(cs, 0) + max(lcs, 0)
+    bound = np.exp(-np.maximum(barrier - max_influence, 0) / kT)
+    candidates = np.flatnonzero(u_flip < bound * (1 + 1e-9))
+    if candidates.size == 0:
+        return 0
+
+    ndim = spins.ndim
+    n_neighbors = 2 * ndim
+    nbr_sum = neighbor_spin_sum(spins)
+    if lcs:
+        win_sum, win_count = window_spin_sum(spins, params)
+        weights = None
+        if params["long_range_kernel"] != "box":
+            weights = coupling.make_kernel(
+                params["long_range_kernel"], radius, ndim, params["long_range_sigma"]
+            )
+
+    coords = np.unravel_index(candidates, barrier.shape)
+    coords = np.stack(coords, axis=1) + 1
+    flat_barrier = barrier.ravel()[candidates].tolist()
+    flat_u = u_flip.ravel()[candidates].tolist()
+
+    flips = 0
+    for p, b, u in zip(map(tuple, coords.tolist()), flat_barrier, flat_u):
+        s = int(spins[p])
+        influence = cs * (1 - abs(s - nbr_sum[p] / n_neighbors))
+        if lcs:
+            influence = influence + lcs * (1 - abs(s - win_sum[p] / win_count[p]))
+        energy_barrier = b - influence
+        if not u < np.exp(-max(energy_barrier, 0) / kT):
+            continue
+
+        spins[p] = 1 - s
+        delta = 1 - 2 * s
+        flips += 1
+        for axis in range(ndim):
+            for offset in (-1, 1):
+                q = list(p)
+                q[axis] += offset
+                nbr_sum[tuple(q)] += delta
+        if lcs:
+            coupling.add_stamp(win_sum, p, delta, radius, weights)
+    return flips
+
+
+# Flip functions for `backend` on an ndim-dimensional lattice stepped with
+# `params`. "auto" falls back to NumPy where the compiled sweeps do not apply
+# (not 3D, or a weighted long-range kernel); "numba" raises there instead.
+def _flip_functions(backend, params=None, ndim=3):
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+    if backend != "numpy":
+        import spin_jit
+
+        if not spin_jit.supports(ndim, DEFAULT_PARAMS if params is None else params):
+            if backend == "numba":
+                raise ValueError("The numba backend supports 3D lattices with the box "
+                                 "long-range kernel only")
+        elif spin_jit.HAVE_NUMBA:
+            return {
+                "sequential": spin_jit.sequential_flips,
+                "synchronous": _synchronous_flips,
+                "checkerboard": spin_jit.checkerboard_flips,
+                "kmc": spin_jit.kmc_flips,
+            }
+        if backend == "numba":
+            warnings.warn("numba is not installed; using the NumPy backend", RuntimeWarning)
+    return {
+        "sequential": _sequential_flips,
+        "synchronous": _synchronous_flips,
+        "checkerboard": _checkerboard_flips,
+        "kmc": kmc.kmc_flips,
+    }
+
+
+# Whole-lattice update of voltage, differentiation and spin state.
+#   mode="sequential"   reproduces the in-place raster sweep of the scripts
+#                       exactly (same RNG stream, same floating-point results)
+#   mode="synchronous"  flips every spin from the start-of-step configuration
+#   mode="checkerboard" red-black sweep, each colour updated at once
+#   mode="kmc"          continuous-time kinetic Monte Carlo over the step (kmc),
+#                       drawing random numbers per event instead of per voxel
+# A single batched draw supplies the stimulus and tunneling uniforms for the
+# step, interleaved per voxel in the order the reference loop consumed them.
+# backend="numba" runs the sequential and checkerboard sweeps and the kmc event
+# loop compiled (spin_jit); "auto" uses numba when it is installed. params["dt"] and
+# params["integrator"] select the step length and diffusion scheme (diffusion);
+# the uniforms are rescaled so event probabilities stay per unit time.
+def update_grid(voltage, states, spins, params=None, rng=None, mode="sequential",
+                backend="numpy"):
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+    params = DEFAULT_PARAMS if params is None else params
+    flip_spins = _flip_functions(backend, params, voltage.ndim).get(mode)
+    _, dt = diffusion.step_settings(params)
+    rng = np.random if rng is None else rng
+
+    with phase("update_grid"):
+        inner_shape = tuple(n - 2 for n in voltage.shape)
+        with phase("rng"):
+            draws = 1 if mode == "kmc" else 2
+            u = diffusion.event_uniforms(_uniforms(rng, inner_shape + (draws,), voltage.dtype), dt)
+        with phase("voltage"):
+            new_voltage = _voltage_and_states(voltage, states, u[..., 0], params)
+            barrier = np.subtract(0.5, new_voltage[_interior(voltage.ndim)])
+            np.abs(barrier, out=barrier)
+
+        with phase("spin_flips"):
+            if mode == "kmc":
+                count("spins_flipped", flip_spins(spins, barrier, rng, params, dt))
+            else:
+                count("spins_flipped", flip_spins(spins, barrier, u[..., 1], params))
+
+        np.clip(new_voltage, 0, 1, out=new_voltage)
+    return new_voltage, states, spins
+
+
+# Step a lattice_state.LatticeState in place, keeping its dtypes
+def update_state(lattice, params=None, rng=None, mode="sequential", backend="numpy"):
+    lattice.voltage, lattice.states, lattice.spins = update_grid(*lattice, params, rng, mode, backend)
+    return lattice
+
+
+# Advance `steps` steps; a recorder (e.g. trajectory.TrajectoryRecorder) is
+# handed the lattice after every step and decides itself what to keep
+def run(voltage, states, spins, steps, params=None, rng=None, mode="sequential", recorder=None,
+        backend="numpy"):
+    for step in range(steps):
+        voltage, states, spins = update_grid(voltage, states, spins, params, rng, mode, backend)
+        if recorder is not None:
+            recorder.record(step + 1, voltage, states, spins)
+    return voltage, states, spins
@@ -0,0 +1,245 @@
+import numpy as np
+
+import coupling
+import kmc
+from spin_engine import neighbor_spin_sum
+
+# Numba-compiled spin flip sweeps for 3D lattices with the box long-range
+# kernel. spin_engine uses these when backend="numba" (or "auto" with numba
+# installed) and otherwise keeps its NumPy path, so numba stays optional.
+#
+#   sequential:   the exact raster-order sweep of the scripts. Neighbour and
+#                 window sums are patched after every flip, as in the NumPy
+#                 engine; exp comes from libm rather than NumPy's SIMD loop.
+#   checkerboard: red-black sweep, one colour at a time, voxels of a colour in
+#                 parallel threads. Nearest neighbours always have the other
+#                 colour; the long-range field is refreshed between colours.
+#   kmc:          the event loop of kmc.kmc_flips over the spins it tracks;
+#                 the per-step setup stays vectorized NumPy.
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+
+def _jit(parallel=False):
+    if numba is None:
+        return lambda fn: fn
+    return numba.njit(cache=True, parallel=parallel)
+
+
+prange = numba.prange if HAVE_NUMBA else range
+
+
+@_jit()
+def _sequential_kernel(spins, barrier, u, nbr_sum, win_sum, win_count, cs, lcs, radius, kT):
+    nx, ny, nz = spins.shape
+    flips = 0
+    for i in range(1, nx - 1):
+        for j in range(1, ny - 1):
+            for k in range(1, nz - 1):
+                s = spins[i, j, k]
+                influence = cs * (1 - abs(s - nbr_sum[i, j, k] / 6))
+                if lcs != 0:
+                    influence = influence + lcs * (1 - abs(s - win_sum[i, j, k] / win_count[i, j, k]))
+                energy_barrier = barrier[i - 1, j - 1, k - 1] - influence
+                if not u[i - 1, j - 1, k - 1] < np.exp(-max(energy_barrier, 0.0) / kT):
+                    continue
+
+                spins[i, j, k] = 1 - s
+                delta = 1 - 2 * np.int64(s)
+                flips += 1
+                nbr_sum[i - 1, j, k] += delta
+                nbr_sum[i + 1, j, k] += delta
+                nbr_sum[i, j - 1, k] += delta
+                nbr_sum[i, j + 1, k] += delta
+                nbr_sum[i, j, k - 1] += delta
+                nbr_sum[i, j, k + 1] += delta
+                if lcs != 0:
+                    for a in range(max(i - radius, 0), min(i + radius + 1, nx)):
+                        for b in range(max(j - radius, 0), min(j + radius + 1, ny)):
+                            for c in range(max(k - radius, 0), min(k + radius + 1, nz)):
+                                win_sum[a, b, c] += delta
+    return flips
+
+
+@_jit(parallel=True)
+def _color_kernel(spins, barrier, u, win_sum, win_count, cs, lcs, kT, color):
+    nx, ny, nz = spins.shape
+    flips = np.zeros(nx, dtype=np.int64)
+    for i in prange(1, nx - 1):
+        for j in range(1, ny - 1):
+            for k in range(1 + (i + j + 1 + color) % 2, nz - 1, 2):
+                s = spins[i, j, k]
+                nbr = (np.int64(spins[i - 1, j, k]) + spins[i + 1, j, k]
+                       + spins[i, j - 1, k] + spins[i, j + 1, k]
+                       + spins[i, j, k - 1] + spins[i, j, k + 1])
+                influence = cs * (1 - abs(s - nbr / 6))
+                if lcs != 0:
+                    influence = influence + lcs * (1 - abs(s - win_sum[i, j, k] / win_count[i, j, k]))
+                energy_barrier = barrier[i - 1, j - 1, k - 1] - influence
+                if u[i - 1, j - 1, k - 1] < np.exp(-max(energy_barrier, 0.0) / kT):
+                    spins[i, j, k] = 1 - s
+                    flips[i] += 1
+    return flips.sum()
+
+
+# kmc._events compiled; see there for the arguments
+@_jit()
+def _kmc_kernel(rng, dt, times, picks, threshold, s, nbr, win, norm, barrier, hot, rates, saturated,
+                coords, slot, shape, offsets, nbr_stamp, win_stamp, leaves, sums, bucket, cs, lcs, kT):
+    ndim = len(shape)
+    n = len(times)
+    n_sat = 0
+    for k in range(len(saturated)):
+        if saturated[k]:
+            n_sat += 1
+
+    t, flips, i = 0.0, 0, 0
+    total = sums.sum()
+    t_hot = t + rng.standard_exponential() / total if total > 0 else np.inf
+    while True:
+        if n_sat:
+            j = min(int(rng.random() * n_sat), n_sat - 1)
+            k = 0
+            while not saturated[k] or j:
+                if saturated[k]:
+                    j -= 1
+                k += 1
+        else:
+            t_cold = times[i] if i < n else np.inf
+            if min(t_cold, t_hot) > dt:
+                break
+            if t_cold <= t_hot:
+                k = picks[i]
+                i += 1
+                # Flipped spins keep rate 0
+                if not threshold[i - 1] < rates[k]:
+                    continue
+                t = t_cold
+            else:
+                t = t_hot
+                k = _kmc_sample(leaves, sums, bucket, rng.random())
+
+        delta = 1 - 2 * int(s[k])
+        s[k] = 1 - s[k]
+        flips += 1
+        flat = 0
+        for axis in range(ndim):
+            flat = flat * shape[axis] + coords[k, axis]
+        slot[flat] = -1
+        rates[k] = 0
+        if saturated[k]:
+            n_sat -= 1
+        saturated[k] = False
+        _kmc_leaf(leaves, sums, bucket, k, 0.0)
+
+        # Patch the fields and rates of the tracked spins within coupling range
+        for w in range(len(offsets)):
+            flat = 0
+            for axis in range(ndim):
+                c = coords[k, axis] + offsets[w, axis]
+                if c < 0 or c >= shape[axis]:
+                    flat = -1
+                    break
+                flat = flat * shape[axis] + c
+            if flat < 0 or slot[flat] < 0:
+                continue
+            m = slot[flat]
+            nbr[m] += delta * nbr_stamp[w]
+            win[m] += delta * win_stamp[w]
+            influence = cs * (1 - abs(s[m] - nbr[m] / (2 * ndim)))
+            if lcs != 0:
+                influence += lcs * (1 - abs(s[m] - win[m] / norm[m]))
+            p = np.exp(-max(barrier[m] - influence, 0.0) / kT)
+            rates[m] = np.inf if p == 1 else -np.log1p(-p)
+            if saturated[m] != (p == 1):
+                n_sat += 1 if p == 1 else -1
+            saturated[m] = p == 1
+            _kmc_leaf(leaves, sums, bucket, m, rates[m] if hot[m] and p != 1 else 0.0)
+        total = sums.sum()
+        t_hot = t + rng.standard_exponential() / total if total > 0 else np.inf
+    return flips
+
+
+@_jit()
+def _kmc_leaf(leaves, sums, bucket, k, rate):
+    leaves[k] = rate
+    b = k // bucket
+    sums[b] = leaves[b * bucket:(b + 1) * bucket].sum()
+
+
+@_jit()
+def _kmc_sample(leaves, sums, bucket, u):
+    cumulative = np.cumsum(sums)
+    target = u * cumulative[-1]
+    b = min(np.searchsorted(cumulative, target, side="right"), len(sums) - 1)
+    lo = cumulative[b - 1] if b else 0.0
+    rates = leaves[b * bucket:(b + 1) * bucket]
+    i = np.searchsorted(np.cumsum(rates), target - lo, side="right")
+    if i == bucket or rates[i] == 0:
+        # Rounding at the top end: the last positive rate
+        i = len(leaves) - 1
+        while leaves[i] == 0:
+            i -= 1
+        return i
+    return b * bucket + i
+
+
+# Lattices the compiled sweeps handle
+def supports(ndim, params):
+    return ndim == 3 and params["long_range_kernel"] == "box"
+
+
+def _check(spins, params):
+    if spins.ndim != 3:
+        raise ValueError("The numba backend supports 3D lattices only")
+    if params["long_range_kernel"] != "box":
+        raise ValueError("The numba backend supports the box long-range kernel only")
+
+
+def _scalars(params):
+    return (float(params["coupling_strength"]), float(params["long_range_coupling_strength"]))
+
+
+def _window(spins, radius, lcs):
+    if not lcs:
+        dummy = np.ones((1, 1, 1), dtype=np.int32)
+        return dummy, dummy
+    return coupling.box_sum(spins, radius), coupling.window_count(spins.shape, radius)
+
+
+def sequential_flips(spins, barrier, u_flip, params):
+    _check(spins, params)
+    cs, lcs = _scalars(params)
+    radius = int(params["long_range_radius"])
+    nbr_sum = neighbor_spin_sum(spins)
+    win_sum, win_count = _window(spins, radius, lcs)
+    return _sequential_kernel(spins, np.ascontiguousarray(barrier), np.ascontiguousarray(u_flip),
+                              nbr_sum, win_sum, win_count, cs, lcs, radius, float(params["kT"]))
+
+
+# Colour 0 holds voxels with even i + j + k
+def checkerboard_flips(spins, barrier, u_flip, params):
+    _check(spins, params)
+    cs, lcs = _scalars(params)
+    radius = int(params["long_range_radius"])
+    barrier = np.ascontiguousarray(barrier)
+    u_flip = np.ascontiguousarray(u_flip)
+    flips = 0
+    for color in (0, 1):
+        win_sum, win_count = _window(spins, radius, lcs)
+        flips += _color_kernel(spins, barrier, u_flip, win_sum, win_count, cs, lcs,
+                               float(params["kT"]), color)
+    return int(flips)
+
+
+# Kinetic Monte Carlo over a step with the event loop compiled; legacy
+# RandomState streams keep the NumPy loop
+def kmc_flips(spins, barrier, rng, params, dt=1.0):
+    _check(spins, params)
+    events = _kmc_kernel if HAVE_NUMBA and isinstance(rng, np.random.Generator) else None
+    return kmc.kmc_flips(spins, barrier, rng, params, dt, events)
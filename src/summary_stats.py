@@ -1,6 +1,19 @@
-import networkx as nx
+import numpy as np
 
+from lattice_graph import LatticeGraph
+
+
+# A LatticeGraph is summarised straight from its arrays
 def print_summary(graph):
+    if isinstance(graph, LatticeGraph):
+        spin_ones = int(np.count_nonzero(graph.spins))
+        print(f"Total nodes: {graph.num_nodes}")
+        print(f"Avg voltage: {graph.voltage.mean():.4f}")
+        print(f"Spin |0⟩ count: {graph.num_nodes - spin_ones}")
+        print(f"Spin |1⟩ count: {spin_ones}")
+        print(f"Differentiated cells: {int(graph.states.sum())}")
+        return
+
     voltages = [data["voltage"] for _, data in graph.nodes(data=True)]
     spins = [data["spin"] for _, data in graph.nodes(data=True)]
     states = [data["state"] for _, data in graph.nodes(data=True)]
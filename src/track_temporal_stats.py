@@ -1,3 +1,10 @@
+import functools
+import os
+import struct
+
+import numpy as np
+
+
 def log_stats(step, voltage_grid, spin_grid, cell_state, stats_list):
     avg_voltage = voltage_grid.mean()
     spin_ratio = spin_grid.sum() / spin_grid.size
@@ -17,3 +24,190 @@ def save_stats_csv(stats_list, filename="simulation_stats.csv"):
         writer.writeheader()
         writer.writerows(stats_list)
 
+
+# Streaming per-step statistics on the raw lattice arrays.
+#
+# StatsAccumulator is a recorder (record(step, voltage, states, spins), as used
+# by spin_engine.run and entangled_spin_grid.simulate). Every call computes, with
+# vectorized numpy and no graph:
+#   voltage_mean, voltage_var   over all voxels
+#   magnetization               mean of sigma = 2 * spin - 1, in [-1, 1]
+#   spin_ratio                  fraction of spins in |1>
+#   differentiated              fraction of differentiated cells
+#   flip_rate                   fraction of spins changed per step since the
+#                               previous record (NaN on the first)
+#   spin_corr[r]                connected sigma-sigma correlation at distance r
+#                               = 0..max_r voxels, from an FFT autocorrelation
+#                               (NaN on records skipped by corr_every)
+# Rows go into a preallocated structured array of `chunk` records. A full chunk
+# is appended to `path`, a .npy file whose header is rewritten with the row
+# count on every flush, so np.load(path) (or load_stats) reads the rows written
+# so far; without a path the chunks are kept in memory. result() returns all
+# rows as one structured array.
+
+STATS_FIELDS = ("voltage_mean", "voltage_var", "magnetization", "spin_ratio", "differentiated", "flip_rate")
+
+
+
+def stats_dtype(max_r=8):
+    return np.dtype([("step", np.int64)] + [(name, np.float64) for name in STATS_FIELDS]
+                    + [("spin_corr", np.float64, (max_r + 1,))])
+
+
+# sigma autocorrelation lags within max_r of the origin: the flat indices into
+# the padded FFT grid, the number of voxel pairs at each lag and the radial bin
+@functools.lru_cache(maxsize=16)
+def _correlation_lags(shape, max_r):
+    padded = tuple(n + max_r for n in shape)
+    offsets = np.meshgrid(*(np.arange(-min(max_r, n - 1), min(max_r, n - 1) + 1) for n in shape),
+                          indexing="ij")
+    offsets = [o.ravel() for o in offsets]
+    radius = np.sqrt(sum(o.astype(np.float64) ** 2 for o in offsets))
+    bins = np.rint(radius).astype(np.int64)
+    keep = bins <= max_r
+    offsets = [o[keep] for o in offsets]
+    index = np.ravel_multi_index(tuple(o % p for o, p in zip(offsets, padded)), padded)
+    pairs = np.prod([n - np.abs(o) for o, n in zip(offsets, shape)], axis=0).astype(np.float64)
+    return padded, index, pairs, bins[keep]
+
+
+# Connected correlation C(r) = <sigma_x sigma_y> - <sigma>^2 averaged over voxel
+# pairs at rounded distance r; the lattice is zero-padded, not periodic
+def spin_correlation(spins, max_r=8):
+    sigma = 2.0 * np.asarray(spins, dtype=np.float64) - 1.0
+    padded, index, pairs, bins = _correlation_lags(sigma.shape, max_r)
+    axes = tuple(range(sigma.ndim))
+    f = np.fft.rfftn(sigma, padded, axes)
+    auto = np.fft.irfftn(f.real ** 2 + f.imag ** 2, padded, axes).ravel()[index] / pairs
+    corr = np.bincount(bins, weights=auto, minlength=max_r + 1)
+    counts = np.bincount(bins, minlength=max_r + 1)
+    with np.errstate(invalid="ignore"):
+        return corr / counts - sigma.mean() ** 2
+
+
+# The scalar statistics of one lattice snapshot as a dict
+def lattice_stats(voltage, states, spins):
+    n = voltage.size
+    spin_ratio = float(np.count_nonzero(spins) / n)
+    return {
+        "voltage_mean": float(voltage.mean()),
+        "voltage_var": float(voltage.var()),
+        "magnetization": 2.0 * spin_ratio - 1.0,
+        "spin_ratio": spin_ratio,
+        "differentiated": float(np.count_nonzero(states) / n),
+    }
+
+
+def _npy_header(dtype, rows):
+    return "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(dtype), rows)
+
+
+# Fixed .npy header size, so the row count can be rewritten in place: room for
+# a 20-digit count (any int64), rounded up to the 64 bytes .npy aligns to
+def _header_size(dtype):
+    size = 10 + len(_npy_header(dtype, 10 ** 19)) + 1
+    return -(-size // 64) * 64
+
+
+def _write_npy_header(f, dtype, rows):
+    size = _header_size(dtype)
+    header = _npy_header(dtype, rows)
+    assert len(header) + 11 <= size
+    header = header.ljust(size - 11) + "\n"
+    f.seek(0)
+    f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+
+class StatsAccumulator:
+    def __init__(self, path=None, every=1, chunk=1024, max_r=8, corr_every=1):
+        self.path = path
+        self.every = every
+        self.max_r = max_r
+        self.corr_every = corr_every
+        self.dtype = stats_dtype(max_r)
+        self.rows = 0
+        self._buffer = np.zeros(chunk, dtype=self.dtype)
+        self._filled = 0
+        self._chunks = []
+        self._previous = None
+        self._file = None
+        if path is not None:
+            self._file = open(path, "w+b")
+            _write_npy_header(self._file, self.dtype, 0)
+            self._file.flush()
+
+    def record(self, step, voltage, states, spins):
+        if step % self.every:
+            return
+        spins = np.asarray(spins)
+        row = self._buffer[self._filled]
+        row["step"] = step
+        for name, value in lattice_stats(np.asarray(voltage), np.asarray(states), spins).items():
+            row[name] = value
+
+        flipped = spins > 0
+        if self._previous is None:
+            row["flip_rate"] = np.nan
+        else:
+            previous_step, previous = self._previous
+            changed = np.count_nonzero(flipped != previous)
+            row["flip_rate"] = changed / flipped.size / max(step - previous_step, 1)
+        self._previous = step, flipped
+
+        if (self.rows + self._filled) % self.corr_every == 0:
+            row["spin_corr"] = spin_correlation(flipped, self.max_r)
+        else:
+            row["spin_corr"] = np.nan
+
+        self._filled += 1
+        if self._filled == self._buffer.size:
+            self.flush()
+
+    def flush(self):
+        if not self._filled:
+            return
+        rows = self._buffer[:self._filled]
+        if self._file is None:
+            self._chunks.append(rows.copy())
+        else:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(rows.tobytes())
+            _write_npy_header(self._file, self.dtype, self.rows + self._filled)
+            self._file.flush()
+        self.rows += self._filled
+        self._filled = 0
+
+    # Every row recorded so far as one structured array
+    def result(self):
+        self.flush()
+        if self._file is None:
+            return np.concatenate(self._chunks) if self._chunks else np.zeros(0, dtype=self.dtype)
+        return load_stats(self.path)
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_stats(path, mmap=True):
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+# Scalar columns of a stats array as a CSV, one row per record
+def save_stats_array_csv(stats, filename="simulation_stats.csv"):
+    import csv
+
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("step",) + STATS_FIELDS)
+        for row in stats:
+            writer.writerow([int(row["step"])] + [float(row[name]) for name in STATS_FIELDS])
@@ -0,0 +1,182 @@
+import json
+import os
+
+import numpy as np
+
+# Chunked, compressed trajectory store.
+#
+# A trajectory is a directory with meta.json and one compressed .npz file per
+# chunk. A chunk holds `chunk_frames` consecutive snapshots of one slab of
+# `slab_size` planes along X, so a time slice or a spatial sub-block is read
+# from the chunks it overlaps only. A chunk closed early by flush() holds fewer
+# frames; meta.json lists the first frame of every chunk. Voltage is stored as float32 (or the dtype
+# given); states and spins are thresholded to 0/1 and bit-packed. The recorder
+# buffers a single chunk of frames, and every chunk file and the metadata are
+# written atomically, so a crash loses at most the frames still in the buffer.
+# A recorder opened on an existing trajectory appends to it (keeping its slab
+# size and voltage dtype) and skips steps that are already stored, so a run
+# resumed from a checkpoint records into the same directory.
+
+FIELDS = ("voltage", "states", "spins")
+PACKED_FIELDS = ("states", "spins")
+META_NAME = "meta.json"
+
+
+def _write_atomic(path, write):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _chunk_name(chunk, slab):
+    return f"chunk_{chunk:06d}_{slab:04d}.npz"
+
+
+# First frame of every chunk; trajectories written before chunks could be
+# short have full chunks only
+def _chunk_starts(meta):
+    if "chunk_starts" in meta:
+        return meta["chunk_starts"]
+    return [chunk * meta["chunk_frames"] for chunk in range(meta["num_chunks"])]
+
+
+def _slabs(nx, slab_size):
+    return [(x0, min(x0 + slab_size, nx)) for x0 in range(0, nx, slab_size)]
+
+
+class TrajectoryRecorder:
+    def __init__(self, path, shape, every=1, chunk_frames=16, slab_size=None,
+                 voltage_dtype=np.float32):
+        self.path = path
+        self.shape = tuple(shape)
+        self.every = every
+        self.chunk_frames = chunk_frames
+        self.slab_size = self.shape[0] if slab_size is None else slab_size
+        self.voltage_dtype = np.dtype(voltage_dtype)
+        self.steps = []
+        self.chunk_starts = []
+        self._buffer = {field: [] for field in FIELDS}
+        self._buffer_steps = []
+        meta_path = os.path.join(path, META_NAME)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if tuple(meta["shape"]) != self.shape:
+                raise ValueError(f"Trajectory in {path} has shape {tuple(meta['shape'])}, not {self.shape}")
+            self.slab_size = meta["slab_size"]
+            self.voltage_dtype = np.dtype(meta["voltage_dtype"])
+            self.steps = meta["steps"]
+            self.chunk_starts = _chunk_starts(meta)
+        os.makedirs(path, exist_ok=True)
+        self._write_meta()
+
+    @property
+    def num_chunks(self):
+        return len(self.chunk_starts)
+
+    def _write_meta(self):
+        meta = {
+            "shape": list(self.shape),
+            "every": self.every,
+            "chunk_frames": self.chunk_frames,
+            "slab_size": self.slab_size,
+            "voltage_dtype": self.voltage_dtype.str,
+            "num_chunks": self.num_chunks,
+            "chunk_starts": self.chunk_starts,
+            "steps": self.steps,
+        }
+        _write_atomic(os.path.join(self.path, META_NAME),
+                      lambda f: f.write(json.dumps(meta).encode()))
+
+    # Call once per step; only every `every`-th step is stored
+    def record(self, step, voltage, states, spins):
+        if step % self.every or (self.steps and step <= self.steps[-1]):
+            return
+        self._buffer["voltage"].append(np.asarray(voltage, dtype=self.voltage_dtype).copy())
+        self._buffer["states"].append(np.asarray(states) > 0)
+        self._buffer["spins"].append(np.asarray(spins) > 0)
+        self._buffer_steps.append(int(step))
+        if len(self._buffer_steps) == self.chunk_frames:
+            self.flush()
+
+    # Write the buffered frames as a chunk, full or not
+    def flush(self):
+        if not self._buffer_steps:
+            return
+        frames = {field: np.stack(self._buffer[field]) for field in FIELDS}
+        n = len(self._buffer_steps)
+        for slab, (x0, x1) in enumerate(_slabs(self.shape[0], self.slab_size)):
+            arrays = {"voltage": frames["voltage"][:, x0:x1]}
+            for field in PACKED_FIELDS:
+                arrays[field] = np.packbits(frames[field][:, x0:x1].reshape(n, -1), axis=1)
+            name = os.path.join(self.path, _chunk_name(self.num_chunks, slab))
+            _write_atomic(name, lambda f: np.savez_compressed(f, **arrays))
+        self.chunk_starts.append(len(self.steps))
+        self.steps.extend(self._buffer_steps)
+        self._buffer = {field: [] for field in FIELDS}
+        self._buffer_steps = []
+        self._write_meta()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrajectoryReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_NAME)) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta["shape"])
+        self.chunk_frames = meta["chunk_frames"]
+        self.slab_size = meta["slab_size"]
+        self.voltage_dtype = np.dtype(meta["voltage_dtype"])
+        self.steps = np.array(meta["steps"], dtype=np.int64)
+        self.num_frames = len(self.steps)
+        self.chunk_starts = np.array(_chunk_starts(meta), dtype=np.int64)
+
+    # Snapshots of one field as a (frames, *region) array. `frames` is a slice or
+    # int over frame index (see .steps for the step numbers); `region` is a tuple
+    # of slices over the lattice axes.
+    def read(self, field, frames=slice(None), region=None):
+        if field not in FIELDS:
+            raise ValueError(f"field must be one of {FIELDS}, got {field!r}")
+        single = isinstance(frames, (int, np.integer))
+        requested = np.atleast_1d(np.arange(self.num_frames)[frames])
+        frame_ids = np.unique(requested)
+        region = tuple(region or ()) + (slice(None),) * (len(self.shape) - len(region or ()))
+        xs = np.arange(self.shape[0])[region[0]]
+        rest = region[1:]
+
+        dtype = self.voltage_dtype if field == "voltage" else np.uint8
+        parts = []
+        chunk_ids = np.searchsorted(self.chunk_starts, frame_ids, side="right") - 1
+        for chunk in np.unique(chunk_ids):
+            in_chunk = frame_ids[chunk_ids == chunk] - self.chunk_starts[chunk]
+            slab_parts = []
+            for slab, (x0, x1) in enumerate(_slabs(self.shape[0], self.slab_size)):
+                local_x = xs[(xs >= x0) & (xs < x1)] - x0
+                if local_x.size == 0:
+                    continue
+                data = self._load(chunk, slab, field, x1 - x0)[in_chunk]
+                slab_parts.append(data[(slice(None), local_x) + rest])
+            parts.append(np.concatenate(slab_parts, axis=1) if slab_parts
+                         else np.empty((len(in_chunk), 0), dtype=dtype))
+        out = np.concatenate(parts, axis=0).astype(dtype, copy=False)
+        out = out[np.searchsorted(frame_ids, requested)]
+        return out[0] if single else out
+
+    def _load(self, chunk, slab, field, width):
+        with np.load(os.path.join(self.path, _chunk_name(chunk, slab))) as npz:
+            data = npz[field]
+        if field in PACKED_FIELDS:
+            slab_shape = (width,) + self.shape[1:]
+            data = np.unpackbits(data, axis=1, count=int(np.prod(slab_shape)))
+            data = data.reshape((len(data),) + slab_shape)
+        return data
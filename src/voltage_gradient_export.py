@@ -1,7 +1,17 @@
-import networkx as nx
 import csv
+import io
+import struct
+import zipfile
+import zlib
+
+import numpy as np
+
+from lattice_graph import LatticeGraph
 
 def export_voltage_gradients(graph, filename="voltage_gradients.csv"):
+    if isinstance(graph, LatticeGraph):
+        export_lattice_gradients(graph.voltage, filename, fmt="csv")
+        return
     with open(filename, "w", newline="") as f:
         writer = csv.writer(f)
         writer.writerow(["node_u", "node_v", "voltage_u", "voltage_v", "gradient"])
@@ -11,3 +21,201 @@ def export_voltage_gradients(graph, filename="voltage_gradients.csv"):
             gradient = abs(v_u - v_v)
             writer.writerow([u, v, v_u, v_v, gradient])
 
+
+# Integer node ids (C-order voxel index) of every lattice edge, grouped by axis:
+# all x-edges, then y-edges, then z-edges
+def gradient_edges(shape):
+    ids = np.arange(int(np.prod(shape)), dtype=np.int64).reshape(shape)
+    u, v = [], []
+    for axis in range(len(shape)):
+        lo = [slice(None)] * len(shape)
+        hi = [slice(None)] * len(shape)
+        lo[axis] = slice(None, -1)
+        hi[axis] = slice(1, None)
+        u.append(ids[tuple(lo)].ravel())
+        v.append(ids[tuple(hi)].ravel())
+    return np.concatenate(u), np.concatenate(v)
+
+
+# |V_u - V_v| for every edge, in gradient_edges order, from one slice
+# difference per axis
+def voltage_gradients(voltage):
+    parts = [np.abs(np.diff(voltage, axis=axis)).ravel() for axis in range(voltage.ndim)]
+    return np.concatenate(parts)
+
+
+# One snapshot: .npz (default) with node_u, node_v, voltage_u, voltage_v and
+# gradient columns, or the same columns as CSV with integer node ids
+def export_lattice_gradients(voltage, filename="voltage_gradients.npz", fmt="npz"):
+    u, v = gradient_edges(voltage.shape)
+    flat = voltage.ravel()
+    columns = {
+        "node_u": u,
+        "node_v": v,
+        "voltage_u": flat[u],
+        "voltage_v": flat[v],
+        "gradient": voltage_gradients(voltage),
+    }
+    if fmt == "npz":
+        np.savez(filename, **columns)
+    elif fmt == "csv":
+        with open(filename, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(list(columns))
+            writer.writerows(zip(*(col.tolist() for col in columns.values())))
+    else:
+        raise ValueError(f"fmt must be 'npz' or 'csv', got {fmt!r}")
+
+
+def _write_member(zf, name, array):
+    with zf.open(name + ".npy", "w", force_zip64=True) as f:
+        np.lib.format.write_array(f, np.asarray(array), allow_pickle=False)
+
+
+# Streams gradients for many time steps into one .npz file. Edge ids and the
+# chunk length are stored up front; per-step gradients are buffered
+# `chunk_steps` at a time and written as gradient_<n> members together with a
+# steps_<n> member holding their step indices, so memory stays bounded and
+# every finished chunk is self-describing. read_gradient_stream() returns
+# node_u, node_v, steps and the stacked (steps, edges) gradient array, also for
+# a file whose writer was killed before close().
+class GradientStreamWriter:
+    def __init__(self, filename, shape, chunk_steps=64, dtype=np.float32):
+        self.zf = zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED, allowZip64=True)
+        self.chunk_steps = chunk_steps
+        self.dtype = dtype
+        self.steps = []
+        self.num_chunks = 0
+        self._buffer = []
+        u, v = gradient_edges(shape)
+        _write_member(self.zf, "node_u", u)
+        _write_member(self.zf, "node_v", v)
+        _write_member(self.zf, "chunk_steps", np.array(chunk_steps))
+
+    def write(self, step, voltage):
+        self._buffer.append(voltage_gradients(voltage).astype(self.dtype))
+        self.steps.append(step)
+        if len(self._buffer) == self.chunk_steps:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            n = len(self._buffer)
+            _write_member(self.zf, f"gradient_{self.num_chunks:06d}", np.stack(self._buffer))
+            _write_member(self.zf, f"steps_{self.num_chunks:06d}",
+                          np.array(self.steps[-n:], dtype=np.int64))
+            self.zf.fp.flush()
+            self.num_chunks += 1
+            self._buffer = []
+
+    def close(self):
+        self._flush()
+        _write_member(self.zf, "steps", np.array(self.steps, dtype=np.int64))
+        self.zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+# The complete members of a stream whose central directory was never written
+# (the writer was killed before close). Stored members are found by walking the
+# local file headers, which zipfile rewrites with the real size and CRC once a
+# member is finished; the walk stops at the first unfinished or damaged one.
+class _RecoveredStream:
+    def __init__(self, filename):
+        self.filename = filename
+        self.members = {}
+        with open(filename, "rb") as f:
+            while True:
+                header = f.read(_LOCAL_HEADER.size)
+                if len(header) < _LOCAL_HEADER.size:
+                    break
+                sig, _, _, method, _, _, crc, size, _, name_len, extra_len = _LOCAL_HEADER.unpack(header)
+                if sig != b"PK\x03\x04" or method != zipfile.ZIP_STORED:
+                    break
+                name = f.read(name_len).decode()
+                extra = f.read(extra_len)
+                if size == 0xFFFFFFFF:
+                    size = _zip64_size(extra)
+                offset = f.tell()
+                data = f.read(size) if size else b""
+                if not size or len(data) < size or zlib.crc32(data) != crc:
+                    break
+                self.members[name[:-4] if name.endswith(".npy") else name] = (offset, size)
+        self.files = list(self.members)
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __getitem__(self, name):
+        offset, size = self.members[name]
+        with open(self.filename, "rb") as f:
+            f.seek(offset)
+            return np.lib.format.read_array(io.BytesIO(f.read(size)), allow_pickle=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+# Compressed size from a zip64 extra field (the local header holds the
+# uncompressed then the compressed size)
+def _zip64_size(extra):
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, length = struct.unpack_from("<2H", extra, pos)
+        if tag == 1:
+            return struct.unpack_from("<2Q", extra, pos + 4)[1]
+        pos += 4 + length
+    return 0
+
+
+def _open_stream(filename):
+    try:
+        return np.load(filename)
+    except zipfile.BadZipFile:
+        return _RecoveredStream(filename)
+
+
+# Step indices and first-row offsets of the chunks. Files from before steps_<n>
+# existed hold one steps member and fixed-length chunks.
+def _chunk_index(data):
+    per_chunk = []
+    while f"steps_{len(per_chunk):06d}" in data and f"gradient_{len(per_chunk):06d}" in data:
+        per_chunk.append(data[f"steps_{len(per_chunk):06d}"])
+    if per_chunk:
+        sizes = [len(s) for s in per_chunk]
+        return np.concatenate(per_chunk), np.cumsum([0] + sizes[:-1])
+    if "steps" in data:
+        all_steps = data["steps"]
+        chunk_steps = int(data["chunk_steps"])
+        return all_steps, np.arange(0, all_steps.size, chunk_steps)
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+
+# Only the gradient chunks overlapping the requested step indices are loaded
+def read_gradient_stream(filename, steps=slice(None)):
+    with _open_stream(filename) as data:
+        all_steps, starts = _chunk_index(data)
+        wanted = np.atleast_1d(np.arange(all_steps.size)[steps])
+        unique = np.unique(wanted)
+        chunk_of = np.searchsorted(starts, unique, side="right") - 1
+        rows = []
+        for chunk in np.unique(chunk_of):
+            block = data[f"gradient_{chunk:06d}"]
+            rows.append(block[unique[chunk_of == chunk] - starts[chunk]])
+        gradient = np.concatenate(rows)[np.searchsorted(unique, wanted)] if rows else None
+        return {
+            "node_u": data["node_u"],
+            "node_v": data["node_v"],
+            "steps": all_steps[wanted],
+            "gradient": gradient,
+        }
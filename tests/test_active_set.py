@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from active_set import ActiveSetStepper
+from spin_engine import _flip_probability, _voltage_and_states, initialize_grid, make_params
+
+
+# With tol=0 every block keeps moving, so the voltage follows synchronous mode
+# exactly, through the stacked blocks as well as the full-step fallback
+@pytest.mark.parametrize("full_step_fraction", [0.5, 2.0])
+def test_zero_tolerance_matches_synchronous_voltage(full_step_fraction):
+    params = make_params(stimulus_prob=0.0)
+    rng = np.random.default_rng(0)
+    voltage = rng.random((30, 27))
+    expected = voltage.copy()
+    stepper = ActiveSetStepper(voltage.shape, params, block=8, tol=0, rng=rng,
+                               full_step_fraction=full_step_fraction)
+    for _ in range(20):
+        stepper.step(voltage)
+        states = np.zeros_like(expected)
+        expected = np.clip(_voltage_and_states(expected, states, np.ones((28, 25)), params), 0, 1)
+    assert np.array_equal(voltage, expected)
+
+
+# The per-voxel flip probability of thinned candidates is spin_engine's
+def test_candidate_probability_matches_engine():
+    params = make_params(kT=0.1)
+    rng = np.random.RandomState(5)
+    voltage, _, spins = initialize_grid((11, 12, 10), rng, spin_dtype=np.uint8)
+    barrier = np.abs(0.5 - voltage[1:-1, 1:-1, 1:-1])
+    stepper = ActiveSetStepper(voltage.shape, params)
+    inner = np.indices(barrier.shape).reshape(3, -1) + 1
+    flat = np.ravel_multi_index(tuple(inner), voltage.shape)
+    prob = stepper._probability(spins, flat, barrier.ravel())
+    assert np.allclose(prob, _flip_probability(spins, barrier, params).ravel())
+
+
+# Diffusion across the edge of the update set must not lose voltage: with no
+# decay or stimulus, and before anything reaches the fixed boundary, the total
+# is conserved
+def test_sparse_steps_conserve_voltage():
+    params = make_params(stimulus_prob=0.0, decay_rate=0.0, diffusion_rate=0.1)
+    voltage = np.zeros((34, 34, 34))
+    voltage[16, 16, 16] = 1.0
+    stepper = ActiveSetStepper(voltage.shape, params, tol=1e-4, rng=np.random.default_rng(0))
+    stepper.active[...] = False
+    stepper.active[2, 2, 2] = True
+    for _ in range(14):
+        stepper.step(voltage)
+        assert stepper.active.mean() < 0.5
+    assert voltage.sum() == pytest.approx(1.0, abs=1e-12)
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from batch_sim_runner import load_manifest, run_batch, run_output_path
+
+SETTINGS = dict(grid_size=(5, 5, 4), steps=2, seed=3, workers=1)
+
+
+def test_resume_skips_runs_with_the_same_settings(tmp_path):
+    out_dir = str(tmp_path)
+    run_batch(2, out_dir=out_dir, **SETTINGS)
+    os.remove(run_output_path(out_dir, 1))
+    mtime = os.path.getmtime(run_output_path(out_dir, 0))
+    run_batch(3, out_dir=out_dir, **SETTINGS)
+    assert os.path.getmtime(run_output_path(out_dir, 0)) == mtime
+    manifest = load_manifest(out_dir)
+    assert sorted(manifest) == [0, 1, 2]
+    assert all(entry["mode"] == "sequential" and entry["steps"] == 2 for entry in manifest.values())
+
+
+# Existing outputs of another configuration are never counted as this batch's
+@pytest.mark.parametrize("changed", [{"seed": 4}, {"steps": 3}, {"grid_size": (6, 5, 4)},
+                                     {"mode": "synchronous"}, {"params": {"kT": 0.1}}])
+def test_resume_with_changed_settings_raises(tmp_path, changed):
+    run_batch(1, out_dir=str(tmp_path), **SETTINGS)
+    with pytest.raises(ValueError):
+        run_batch(1, out_dir=str(tmp_path), **dict(SETTINGS, **changed))
+
+
+def test_untracked_output_raises(tmp_path):
+    open(run_output_path(str(tmp_path), 0), "wb").close()
+    with pytest.raises(ValueError):
+        run_batch(1, out_dir=str(tmp_path), **SETTINGS)
+    assert load_manifest(str(tmp_path)) == {}
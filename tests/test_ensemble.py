@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from ensemble import simulate_ensemble
+from entangled_spin_grid import SimulationConfig, simulate
+
+
+# Replicas with their own seeds and parameters (one without long-range
+# coupling) end bit for bit where lone runs of the same configs do
+@pytest.mark.parametrize("mode", ["synchronous", "checkerboard", "sequential", "kmc"])
+@pytest.mark.parametrize("extra", [{}, {"integrator": "crank_nicolson", "dt": 2.0},
+                                   {"long_range_kernel": "gaussian"}])
+def test_replicas_match_update_grid(mode, extra):
+    configs = [SimulationConfig((10, 9, 8), 4, seed=s, mode=mode,
+                                params=dict(extra, kT=0.03 + 0.01 * s, long_range_coupling_strength=0.05 * s))
+               for s in range(3)]
+    for replica, config in zip(simulate_ensemble(configs), configs):
+        for a, b in zip(replica, simulate(config)):
+            np.testing.assert_array_equal(a, b)
+
+
+def test_compact_replicas_match_update_grid():
+    configs = [SimulationConfig((10, 9, 8), 4, seed=s, mode="synchronous", compact=True) for s in range(2)]
+    for replica, config in zip(simulate_ensemble(configs), configs):
+        for a, b in zip(replica, simulate(config)):
+            assert a.dtype == b.dtype
+            np.testing.assert_array_equal(a, b)
@@ -0,0 +1,24 @@
+import json
+
+import numpy as np
+
+from entangled_spin_grid import SimulationConfig, initial_lattice
+from lattice_state import BINARY_DTYPE
+
+
+# Batch runners hand out spawned seeds; the JSON round trip must keep their
+# stream, and further spawns from it
+def test_config_round_trip_keeps_spawned_seed():
+    seed = np.random.SeedSequence(0).spawn(3)[2]
+    seed.spawn(2)
+    config = SimulationConfig(grid_size=(5, 4, 3), seed=seed)
+    restored = SimulationConfig.from_dict(json.loads(json.dumps(config.to_dict())))
+    assert restored.rng().random() == config.rng().random()
+    assert restored.seed.spawn(1)[0].spawn_key == seed.spawn(1)[0].spawn_key
+    assert restored.to_dict() == config.to_dict()
+
+
+def test_compact_config_uses_lattice_state_dtypes():
+    voltage, states, spins = initial_lattice(SimulationConfig(grid_size=(5, 4, 3), seed=1, compact=True))
+    assert voltage.dtype == np.float32
+    assert states.dtype == spins.dtype == BINARY_DTYPE
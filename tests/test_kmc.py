@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import kmc
+import spin_jit
+from spin_engine import DEFAULT_PARAMS, _synchronous_flips, initialize_grid, make_params, update_grid
+
+
+# Without coupling every spin flips on its own: with probability
+# 1 - (1 - p)^dt over a step, and surely once saturated (barrier 0, p = 1)
+def test_isolated_flip_probability():
+    params = dict(DEFAULT_PARAMS, coupling_strength=0.0, long_range_coupling_strength=0.0)
+    barrier = np.full((10, 10, 10), -params["kT"] * np.log(0.3))
+    barrier[:5] = 0.0
+    dt, runs = 0.5, 200
+    flipped = np.zeros(barrier.shape)
+    rng = np.random.default_rng(0)
+    for _ in range(runs):
+        spins = np.zeros((12, 12, 12), dtype=np.int64)
+        flips = kmc.kmc_flips(spins, barrier, rng, params, dt)
+        assert flips == spins.sum()
+        flipped += spins[1:-1, 1:-1, 1:-1]
+    assert (flipped[:5] == runs).all()
+    expected = 1 - 0.7 ** dt
+    assert abs(flipped[5:].mean() / runs - expected) < 4 * np.sqrt(expected * (1 - expected) / (500 * runs))
+
+
+# At low kT most flips are of saturated spins, which the per-step modes flip
+# with certainty; kmc must flip as many
+@pytest.mark.parametrize("kT", [0.01, 0.05])
+def test_flip_count_matches_synchronous(kT):
+    params = make_params(kT=kT, diffusion_rate=0.1)
+    rng = np.random.default_rng(1)
+    lattice = initialize_grid((24, 24, 24), rng)
+    for _ in range(10):
+        lattice = update_grid(*lattice, params, rng, mode="synchronous")
+    voltage, _, spins = lattice
+    barrier = np.abs(0.5 - voltage[1:-1, 1:-1, 1:-1])
+    counts = {"kmc": [], "synchronous": []}
+    for seed in range(20):
+        rng = np.random.default_rng(seed)
+        counts["kmc"].append(kmc.kmc_flips(spins.copy(), barrier, rng, params))
+        counts["synchronous"].append(_synchronous_flips(spins.copy(), barrier, rng.random(barrier.shape), params))
+    assert np.mean(counts["synchronous"]) > 20
+    assert np.mean(counts["kmc"]) == pytest.approx(np.mean(counts["synchronous"]), rel=0.1)
+
+
+@pytest.mark.skipif(not spin_jit.HAVE_NUMBA, reason="numba is not installed")
+def test_compiled_event_loop_matches():
+    params = make_params(kT=0.05, diffusion_rate=0.1)
+    rng = np.random.default_rng(2)
+    lattice = initialize_grid((20, 20, 20), rng)
+    for _ in range(10):
+        lattice = update_grid(*lattice, params, rng, mode="synchronous")
+    voltage, _, spins = lattice
+    barrier = np.abs(0.5 - voltage[1:-1, 1:-1, 1:-1])
+    expected, actual = spins.copy(), spins.copy()
+    n = kmc.kmc_flips(expected, barrier, np.random.default_rng(3), params)
+    assert spin_jit.kmc_flips(actual, barrier, np.random.default_rng(3), params) == n
+    np.testing.assert_array_equal(actual, expected)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from live_view import FramePublisher, FrameRing, frame_shape, make_frame
+
+
+@pytest.fixture
+def rings():
+    writer = FrameRing((4, 3), slots=3)
+    reader = FrameRing((4, 3), slots=3, name=writer.name)  # as the viewer process attaches
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def _frame(step):
+    return np.full((4, 3), step, dtype=np.float32)
+
+
+# A slow reader gets the newest frame and counts the ones it skipped
+def test_reader_drops_to_newest_frame(rings):
+    writer, reader = rings
+    assert reader.latest() is None
+    for step in range(1, 6):
+        writer.publish(step, _frame(step))
+    step, frame = reader.latest()
+    assert step == 5
+    np.testing.assert_array_equal(frame, _frame(5))
+    assert reader.dropped == 4
+    assert reader.latest() is None
+    writer.publish(6, _frame(6))
+    assert reader.latest()[0] == 6
+    assert reader.dropped == 4
+
+
+# Publishing never waits: the ring wraps over its oldest slots
+def test_ring_wraps_over_oldest_slots(rings):
+    writer, reader = rings
+    for step in range(7):
+        writer.publish(step * 10, _frame(step))
+    np.testing.assert_array_equal(reader.slot_step, [60, 40, 50])
+    np.testing.assert_array_equal(reader.slot_seq, [6, 4, 5])
+    np.testing.assert_array_equal(reader.frames[0], _frame(6))
+
+
+# A frame whose slot is being rewritten is skipped, not returned torn
+def test_torn_frame_is_skipped(rings):
+    writer, reader = rings
+    writer.publish(1, _frame(1))
+    reader.slot_seq[0] = -1
+    assert reader.latest() is None
+    writer.publish(2, _frame(2))
+    assert reader.latest()[0] == 2
+
+
+def test_publisher_decimates_frames():
+    voltage = np.arange(6 * 5 * 4, dtype=np.float64).reshape(6, 5, 4)
+    ring = FrameRing(frame_shape(voltage.shape, stride=2))
+    try:
+        publisher = FramePublisher(ring, every=3, stride=2)
+        for step in range(1, 8):
+            publisher.record(step, voltage + step)
+        assert ring.header[0] == 2
+        step, frame = ring.latest()
+        assert step == 6
+        np.testing.assert_array_equal(frame, make_frame(voltage + 6, stride=2))
+        assert frame.shape == (3, 3)
+        assert not ring.closed
+        ring.mark_closed()
+        assert ring.closed
+    finally:
+        ring.close()
@@ -0,0 +1,36 @@
+import csv
+
+import numpy as np
+import pytest
+
+from param_sweep import load_results, run_sweep
+
+
+def _sweep(results, **settings):
+    kwargs = dict(grid_size=(6, 6, 6), steps=2, min_seeds=2, max_seeds=2, workers=1)
+    kwargs.update(settings)
+    return run_sweep([{"kT": 0.05}], str(results), **kwargs)
+
+
+# Rows are reused only by a sweep with the same run settings
+def test_rows_are_reused_only_for_the_same_settings(tmp_path):
+    results = tmp_path / "sweep.csv"
+    first = _sweep(results)
+    assert len(first["param_hash"]) == 2
+    assert len(_sweep(results)["param_hash"]) == 2
+    for changed in ({"steps": 3}, {"grid_size": (7, 6, 6)}, {"root_seed": 1}, {"mode": "synchronous"}):
+        before = len(load_results(str(results))["param_hash"])
+        assert len(_sweep(results, **changed)["param_hash"]) == before + 2
+    table = load_results(str(results))
+    assert set(table["mode"]) == {"sequential", "synchronous"}
+    np.testing.assert_array_equal(np.sort(table["seed_index"].reshape(5, 2)), [[0, 1]] * 5)
+
+
+def test_table_without_run_settings_is_refused(tmp_path):
+    results = tmp_path / "old.csv"
+    with open(results, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["param_hash", "seed_index", "kT", "spin_ratio"])
+        writer.writerow(["abc", 0, 0.05, 0.5])
+    with pytest.raises(ValueError):
+        _sweep(results)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import spin_domain_analysis
+from spin_domain_analysis import SpinDomainTracker, label_spin_domains
+
+
+def _same_partition(a, b):
+    a, b = a.ravel(), b.ravel()
+    pairs = np.unique(np.stack([a, b]), axis=1)
+    return pairs.shape[1] == np.unique(a).size == np.unique(b).size
+
+
+@pytest.mark.parametrize("rebuild", [False, True])
+def test_tracker_matches_full_labelling(monkeypatch, rebuild):
+    monkeypatch.setattr(spin_domain_analysis, "REBUILD_FRACTION", 0.0 if rebuild else 1.0)
+    rng = np.random.default_rng(0)
+    for shape in [(9, 8, 7), (12, 11), (5, 5, 5)]:
+        spins = rng.integers(0, 2, shape).astype(np.uint8)
+        tracker = SpinDomainTracker(spins)
+        for step in range(25):
+            flipped = rng.choice(spins.size, rng.integers(1, spins.size // 4), replace=False)
+            spins.flat[flipped] ^= 1
+            labels = tracker.update(spins, flipped if step % 2 else None)
+            expected = label_spin_domains(spins)
+            assert _same_partition(labels, expected)
+
+            sizes = np.bincount(expected.ravel())[np.unique(expected[spins == 1])]
+            tracker.record(step)
+            assert tracker.history["count"][-1] == sizes.size
+            assert tracker.history["largest"][-1] == sizes.max()
+            np.testing.assert_array_equal(np.sort(tracker.domain_sizes()), np.sort(sizes))
+
+
+# The array path returns the same domains as connected components of the graph
+@pytest.mark.parametrize("spin_value", [0, 1])
+def test_get_spin_domains_matches_networkx(spin_value):
+    pytest.importorskip("networkx")
+    from lattice_graph import LatticeGraph
+
+    rng = np.random.default_rng(3)
+    for shape in [(9, 8, 7), (12, 11)]:
+        spins = rng.integers(0, 2, shape).astype(np.uint8)
+        graph = LatticeGraph(rng.random(shape), np.zeros(shape, np.uint8), spins)
+        domains = spin_domain_analysis.get_spin_domains(graph, spin_value)
+        expected = spin_domain_analysis.get_spin_domains(graph.to_networkx(), spin_value)
+        assert sorted(map(sorted, domains)) == sorted(map(sorted, expected))
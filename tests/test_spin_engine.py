@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import spin_jit
+from spin_engine import DEFAULT_PARAMS, _checkerboard_flips, _flip_functions, initialize_grid, update_grid
+
+
+# The per-voxel loop of bioelectricity-spin.py, drawing from `rng` instead of
+# the global np.random state
+def reference_update_grid(voltage, states, spins, rng, p=DEFAULT_PARAMS):
+    radius = p["long_range_radius"]
+    new_voltage = voltage.copy()
+    for i in range(1, voltage.shape[0] - 1):
+        for j in range(1, voltage.shape[1] - 1):
+            for k in range(1, voltage.shape[2] - 1):
+                laplacian = (
+                    voltage[i-1, j, k] + voltage[i+1, j, k] +
+                    voltage[i, j-1, k] + voltage[i, j+1, k] +
+                    voltage[i, j, k-1] + voltage[i, j, k+1] -
+                    6 * voltage[i, j, k]
+                )
+                new_voltage[i, j, k] += p["diffusion_rate"] * laplacian - p["decay_rate"] * voltage[i, j, k]
+                if rng.rand() < p["stimulus_prob"]:
+                    new_voltage[i, j, k] += p["stimulus_strength"]
+                if new_voltage[i, j, k] > p["threshold_potential"]:
+                    states[i, j, k] = 1
+                elif new_voltage[i, j, k] < p["threshold_potential"] / 2:
+                    states[i, j, k] = 0
+
+                neighbor_avg = np.mean([spins[i-1, j, k], spins[i+1, j, k], spins[i, j-1, k],
+                                        spins[i, j+1, k], spins[i, j, k-1], spins[i, j, k+1]])
+                region = spins[max(i - radius, 0):i + radius + 1, max(j - radius, 0):j + radius + 1,
+                               max(k - radius, 0):k + radius + 1]
+                influence = (p["coupling_strength"] * (1 - abs(spins[i, j, k] - neighbor_avg)) +
+                             p["long_range_coupling_strength"] * (1 - abs(spins[i, j, k] - np.mean(region))))
+                barrier = abs(0.5 - new_voltage[i, j, k]) - influence
+                if rng.rand() < np.exp(-max(barrier, 0) / p["kT"]):
+                    spins[i, j, k] = 1 - spins[i, j, k]
+    return np.clip(new_voltage, 0, 1), states, spins
+
+
+@pytest.mark.parametrize("kT", [0.05, 0.3])
+def test_sequential_matches_reference_loop(kT):
+    params = dict(DEFAULT_PARAMS, kT=kT)
+    expected = initialize_grid((9, 8, 7), np.random.RandomState(3))
+    actual = tuple(a.copy() for a in expected)
+    rng_ref, rng = np.random.RandomState(11), np.random.RandomState(11)
+    for _ in range(3):
+        expected = reference_update_grid(*expected, rng_ref, params)
+        actual = update_grid(*actual, params, rng, mode="sequential")
+    for a, b in zip(actual, expected):
+        np.testing.assert_array_equal(a, b)
+    assert rng.rand() == rng_ref.rand()
+
+
+
+# A compact step allocates float32-sized temporaries only: the two uniforms
+# per voxel, the new voltage and a few interior-sized work arrays
+@pytest.mark.parametrize("mode", ["synchronous", "checkerboard", "sequential"])
+def test_compact_step_memory(mode):
+    import tracemalloc
+
+    from lattice_state import LatticeState
+    from spin_engine import update_state
+
+    lattice = LatticeState.initialize((40, 40, 40), np.random.default_rng(0))
+    rng = np.random.default_rng(1)
+    update_state(lattice, rng=rng, mode=mode)
+    tracemalloc.start()
+    try:
+        update_state(lattice, rng=rng, mode=mode)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert lattice.voltage.dtype == np.float32 and lattice.states.dtype == np.uint8
+    assert peak < 7 * lattice.nbytes
+
+
+# "auto" must fall back to NumPy where the compiled sweeps do not apply, and
+# only an explicit "numba" may refuse
+@pytest.mark.parametrize("kernel, ndim", [("gaussian", 3), ("box", 2)])
+def test_auto_backend_falls_back(monkeypatch, kernel, ndim):
+    monkeypatch.setattr(spin_jit, "HAVE_NUMBA", True)
+    params = dict(DEFAULT_PARAMS, long_range_kernel=kernel)
+    assert _flip_functions("auto", params, ndim)["checkerboard"] is _checkerboard_flips
+    with pytest.raises(ValueError):
+        _flip_functions("numba", params, ndim)
+    assert _flip_functions("auto", DEFAULT_PARAMS, 3)["checkerboard"] is spin_jit.checkerboard_flips
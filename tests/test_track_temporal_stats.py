@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from spin_engine import initialize_grid
+from track_temporal_stats import StatsAccumulator, lattice_stats, load_stats, spin_correlation
+
+
+# Many flushes (and a row count past the old fixed header's room) still leave a
+# .npy file np.load reads back whole
+@pytest.mark.parametrize("max_r", [2, 8, 40])
+def test_file_round_trip(tmp_path, max_r):
+    path = str(tmp_path / "stats.npy")
+    rng = np.random.default_rng(0)
+    voltage, states, spins = initialize_grid((6, 5, 4), rng)
+    memory = StatsAccumulator(chunk=16, max_r=max_r, corr_every=7)
+    with StatsAccumulator(path, chunk=16, max_r=max_r, corr_every=7) as disk:
+        for step in range(1000):
+            spins = rng.integers(0, 2, size=spins.shape)
+            disk.record(step, voltage, states, spins)
+            memory.record(step, voltage, states, spins)
+    loaded = np.load(path)
+    assert loaded.shape == (1000,)
+    np.testing.assert_array_equal(loaded["step"], np.arange(1000))
+    expected = memory.result()
+    for name in loaded.dtype.names:
+        np.testing.assert_array_equal(loaded[name], expected[name])
+        np.testing.assert_array_equal(load_stats(path)[name], expected[name])
+
+
+def test_row_statistics():
+    rng = np.random.default_rng(1)
+    voltage, states, spins = initialize_grid((8, 7, 6), rng)
+    acc = StatsAccumulator(max_r=3)
+    acc.record(0, voltage, states, spins)
+    acc.record(2, voltage, states, 1 - spins)
+    rows = acc.result()
+    for name, value in lattice_stats(voltage, states, spins).items():
+        assert rows[0][name] == pytest.approx(value)
+    assert np.isnan(rows[0]["flip_rate"])
+    assert rows[1]["flip_rate"] == pytest.approx(0.5)
+    np.testing.assert_allclose(rows[0]["spin_corr"], spin_correlation(spins, 3))
@@ -0,0 +1,35 @@
+import numpy as np
+
+from spin_engine import initialize_grid, update_grid
+from trajectory import TrajectoryReader, TrajectoryRecorder
+
+
+def _frames(steps, seed=0):
+    rng = np.random.default_rng(seed)
+    lattice = initialize_grid((6, 5, 4), rng)
+    frames = []
+    for _ in range(steps):
+        lattice = update_grid(*lattice, rng=rng, mode="synchronous")
+        frames.append(tuple(a.copy() for a in lattice))
+    return frames
+
+
+def test_flush_mid_chunk_and_resume(tmp_path):
+    frames = _frames(8)
+    recorder = TrajectoryRecorder(str(tmp_path), (6, 5, 4), chunk_frames=3, slab_size=4)
+    for step, lattice in enumerate(frames[:5], 1):
+        recorder.record(step, *lattice)
+        if step == 2:
+            recorder.flush()
+    recorder.close()
+
+    # A resumed run appends and skips the steps already stored
+    with TrajectoryRecorder(str(tmp_path), (6, 5, 4), chunk_frames=3) as recorder:
+        for step, lattice in enumerate(frames[3:], 4):
+            recorder.record(step, *lattice)
+
+    reader = TrajectoryReader(str(tmp_path))
+    np.testing.assert_array_equal(reader.steps, np.arange(1, 9))
+    np.testing.assert_array_equal(reader.read("spins"), np.stack([f[2] for f in frames]))
+    np.testing.assert_array_equal(reader.read("voltage", 2, (slice(3, 6),)),
+                                  frames[2][0][3:6].astype(np.float32))
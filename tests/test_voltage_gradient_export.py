@@ -0,0 +1,42 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from voltage_gradient_export import GradientStreamWriter, read_gradient_stream, voltage_gradients
+
+
+def _voltages(count, shape=(4, 5, 3)):
+    rng = np.random.RandomState(0)
+    return [rng.rand(*shape) for _ in range(count)]
+
+
+@pytest.mark.parametrize("steps", [slice(None), slice(2, 6), [6, 0, 3]])
+def test_stream_round_trip(tmp_path, steps):
+    voltages = _voltages(7)
+    path = tmp_path / "grad.npz"
+    with GradientStreamWriter(path, voltages[0].shape, chunk_steps=3, dtype=np.float64) as w:
+        for step, v in enumerate(voltages):
+            w.write(10 * step, v)
+    out = read_gradient_stream(path, steps)
+    expected = np.arange(7)[steps]
+    assert out["steps"].tolist() == (10 * np.asarray(expected)).tolist()
+    assert np.array_equal(out["gradient"], np.stack([voltage_gradients(voltages[i]) for i in expected]))
+
+
+# A writer killed before close() leaves no central directory; every finished
+# chunk must still be readable
+def test_unclosed_stream_keeps_finished_chunks(tmp_path):
+    voltages = _voltages(8)
+    path = tmp_path / "grad.npz"
+    w = GradientStreamWriter(path, voltages[0].shape, chunk_steps=3, dtype=np.float64)
+    for step, v in enumerate(voltages):
+        w.write(step, v)
+    crashed = tmp_path / "crashed.npz"
+    shutil.copy(path, crashed)
+    w.close()
+
+    out = read_gradient_stream(crashed)
+    assert out["steps"].tolist() == list(range(6))
+    assert np.array_equal(out["gradient"], np.stack([voltage_gradients(v) for v in voltages[:6]]))
+    assert np.array_equal(out["node_u"], read_gradient_stream(path)["node_u"])